@@ -2,13 +2,33 @@
 Virtual Staging API Endpoints
 Handles image generation requests with API key validation
 """
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends, Request, Query
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import json
 import os
-import shutil
+import threading
+import uuid
+from functools import partial
 from typing import Optional
-from ..services.comfy_wrapper import empty_2_furnished
-from ..middleware.api_key_middleware import validate_api_key_required
+from ..services.comfy_wrapper import (
+    count_uncached_variants, empty_2_furnished, get_backend_pool, get_result_cache, get_output_store,
+    get_preprocess_cache, get_scheduler, peek_backend_pool, VARIATION_MODES
+)
+from ..services.comfy_workflow import QUALITY_TIERS, DEFAULT_QUALITY_TIER
+from ..services.input_normalization import InvalidImageError, normalize_upload
+from ..services.image_derivatives import DEFAULT_QUALITY, DerivativeError, get_derivative, parse_variant, variant_name
+from ..services.upload_storage import UnsupportedImageError, UploadTooLargeError, save_upload
+from ..services.style_registry import style_registry
+from ..services.admission import AdmissionController, AdmissionRejected
+from ..services.scheduler import SLOTS_PER_BACKEND, MAX_IN_FLIGHT_PER_KEY
+from ..services.job_queue import JobQueue, TERMINAL_STATUSES
+from ..services.progress import progress_hub
+from ..services.single_flight import SingleFlight
+from ..services.metrics import registry as metrics_registry, stage_timer
+from ..database.models import DatabaseManager
+from ..middleware.api_key_middleware import get_api_key_service, validate_api_key_required, validate_api_key_readonly
 
 router = APIRouter()
 
@@ -18,9 +38,14 @@ os.makedirs("generated", exist_ok=True)
 
 @router.post("/virtual-staging")
 async def generate_virtual_staging(
+    request: Request,
     image_file: UploadFile = File(...),
     num_images: int = Form(default=1),
     style: str = Form(default="scandinavian"),
+    seed: Optional[int] = Form(default=None),
+    variation: str = Form(default="full"),
+    refine_denoise: Optional[float] = Form(default=None),
+    quality: str = Form(default=DEFAULT_QUALITY_TIER),
     api_key_info: dict = Depends(validate_api_key_required)
 ):
     """
@@ -28,16 +53,27 @@ async def generate_virtual_staging(
     
     - **image_file**: Upload an image file of an empty room
     - **num_images**: Number of variations to generate (1-10)
-    - **style**: Furnishing style (currently supports: scandinavian)
+    - **style**: Furnishing style (see `/styles` for available presets)
+    - **seed**: Optional base seed for reproducible results (variant i uses seed + i)
+    - **variation**: `full` reruns the whole workflow per variant; `refine` keeps one composition and varies only the final refine pass (much cheaper)
+    - **refine_denoise**: Optional refine-pass denoise for `refine` variations (higher varies more)
+    - **quality**: `draft` (fast ~512px preview, 1/4 quota), `standard` or `final` (more sampler steps, 1.5x quota)
     - **X-API-Key**: Required API key in header for authentication
     """
-    return await _generate_staging_internal(image_file, num_images, style, api_key_info)
+    return await _generate_staging_internal(
+        image_file, num_images, style, api_key_info, seed, request, variation, refine_denoise, quality
+    )
 
 @router.post("/generate")
 async def generate_virtual_staging_alt(
+    request: Request,
     file: UploadFile = File(...),
     num_images: int = Form(default=1),
     style: str = Form(default="scandinavian"),
+    seed: Optional[int] = Form(default=None),
+    variation: str = Form(default="full"),
+    refine_denoise: Optional[float] = Form(default=None),
+    quality: str = Form(default=DEFAULT_QUALITY_TIER),
     api_key_info: dict = Depends(validate_api_key_required)
 ):
     """
@@ -45,19 +81,219 @@ async def generate_virtual_staging_alt(
     
     - **file**: Upload an image file of an empty room
     - **num_images**: Number of variations to generate (1-10)
-    - **style**: Furnishing style (currently supports: scandinavian)
+    - **style**: Furnishing style (see `/styles` for available presets)
+    - **seed**: Optional base seed for reproducible results (variant i uses seed + i)
+    - **variation**: `full` reruns the whole workflow per variant; `refine` keeps one composition and varies only the final refine pass (much cheaper)
+    - **refine_denoise**: Optional refine-pass denoise for `refine` variations (higher varies more)
+    - **quality**: `draft` (fast ~512px preview, 1/4 quota), `standard` or `final` (more sampler steps, 1.5x quota)
     - **X-API-Key**: Required API key in header for authentication
     """
-    print(f"DEBUG: Received generate request - file: {file.filename}, num_images: {num_images}, style: {style}")
+    print(f"DEBUG: Received generate request - file: {file.filename}, num_images: {num_images}, style: {style}, seed: {seed}, variation: {variation}")
     print(f"DEBUG: API key info: {api_key_info}")
-    return await _generate_staging_internal(file, num_images, style, api_key_info)
-    return await _generate_staging_internal(file, num_images, style, api_key_info)
+    return await _generate_staging_internal(
+        file, num_images, style, api_key_info, seed, request, variation, refine_denoise, quality
+    )
+
+def _validate_generation_request(image_file: UploadFile, num_images: int, style: str, seed: Optional[int] = None,
+                                 variation: str = "full", refine_denoise: Optional[float] = None,
+                                 quality: str = DEFAULT_QUALITY_TIER):
+    """Reject bad generation parameters before any work is done"""
+    if not image_file.content_type or not image_file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    
+    if num_images < 1 or num_images > 10:
+        raise HTTPException(status_code=400, detail="Number of images must be between 1 and 10")
+    
+    # Supported styles come from the style registry (styles/*.json)
+    supported_styles = style_registry.names()
+    if style not in supported_styles:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Style '{style}' not supported. Available styles: {supported_styles}"
+        )
+    
+    if seed is not None and not 0 <= seed <= 2 ** 53:
+        raise HTTPException(status_code=400, detail="Seed must be between 0 and 2^53")
+    
+    preset = style_registry.get(style)
+    if quality not in preset.quality_tiers:
+        raise HTTPException(status_code=400, detail=f"Quality must be one of {preset.quality_tiers}")
+    
+    if variation not in VARIATION_MODES:
+        raise HTTPException(status_code=400, detail=f"Variation must be one of {list(VARIATION_MODES)}")
+    if variation == "refine" and not preset.supports_refine_variation:
+        raise HTTPException(status_code=400, detail=f"Style '{style}' does not support refinement-only variations")
+    if variation == "refine" and QUALITY_TIERS[quality].get("output_from"):
+        raise HTTPException(status_code=400, detail=f"The '{quality}' quality tier has no refine pass to vary")
+    if refine_denoise is not None and (variation != "refine" or not 0 < refine_denoise <= 1):
+        raise HTTPException(status_code=400, detail="refine_denoise must be in (0, 1] and requires variation=refine")
+
+def _format_results(result: dict, style: str, original_filename: Optional[str]) -> dict:
+    """Convert a ComfyUI wrapper result into the response format expected by the frontend"""
+    # Extract image paths from results
+    images = []
+    for img_result in result["results"]:
+        if "file_path" in img_result:
+            # Convert absolute path to relative path for web serving
+            abs_path = img_result["file_path"]
+            rel_path = os.path.relpath(abs_path, start=os.getcwd())
+            web_path = "/generated/" + os.path.basename(rel_path)  # Create web-accessible path
+            images.append({
+                "output_image_url": web_path,
+                "seed": img_result.get("seed", "unknown"),
+                "cached": img_result.get("cached", False)
+            })
+            if "base_seed" in img_result:
+                images[-1]["base_seed"] = img_result["base_seed"]
+    
+    return {
+        "success": True,
+        "message": f"Successfully generated {len(images)} virtual staging images",
+        "results": images,  # Frontend expects 'results' field
+        "metadata": {
+            "style": style,
+            "num_images": len(images),
+            "original_filename": original_filename
+        }
+    }
+
+def _charge_quality(api_key_info: dict, quality: str):
+    """
+    The API key middleware charged one quota unit for this request; adjust
+    it to the quality tier's cost (e.g. a draft costs a quarter). Called
+    once admission and upload validation have passed, so rejected requests
+    keep the middleware's single unit.
+    """
+    key_id = api_key_info["key_info"].get("id")
+    adjustment = QUALITY_TIERS[quality]["cost"] - 1
+    # Super admin usage is not tracked
+    if adjustment and key_id is not None and api_key_info.get("role") != "superadmin":
+        get_api_key_service().increment_usage(key_id, adjustment)
+
+async def _receive_upload(image_file: UploadFile, prefix: str, normalized_path: Optional[str] = None) -> dict:
+    """
+    Copy an upload to a unique temp file, then decode, orient and downscale
+    it in the process pool. Returns the normalized file's path and SHA-256.
+    """
+    try:
+        with stage_timer("upload_receive"):
+            upload = await save_upload(image_file, prefix=prefix)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"📥 Received {upload['format']} upload ({upload['size']} bytes)")
+    
+    try:
+        with stage_timer("input_normalize"):
+            return await normalize_upload(upload["path"], normalized_path or f"{upload['path']}.png")
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        try:
+            os.remove(upload["path"])
+        except OSError:
+            pass
+
+async def _admit(api_key_info: dict, num_images: int, reserve: bool = True):
+    """Admission control: 429/503 with Retry-After when the backlog is too long"""
+    key = str(api_key_info["key_info"].get("id"))
+    try:
+        if reserve:
+            return await run_in_threadpool(admission.reserve, key, num_images)
+        await run_in_threadpool(admission.check, key, num_images)
+    except AdmissionRejected as e:
+        print(f"🚦 Rejected {num_images} variants for key {key}: {e} (retry after {e.retry_after}s)")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def _admit_uncached(api_key_info: dict, normalized: dict, num_images: int, style: str, seed: int,
+                          variation: str, refine_denoise: Optional[float], quality: str, reserve: bool = True):
+    """
+    Admission for a seeded request once its upload is normalized: variants
+    the result cache already holds need no ComfyUI slot, so only the rest
+    are admitted (none at all for a fully cached request)
+    """
+    uncached = await run_in_threadpool(
+        count_uncached_variants, normalized["sha256"], num_images, style, seed,
+        variation=variation, refine_denoise=refine_denoise, quality=quality
+    )
+    try:
+        return await _admit(api_key_info, uncached, reserve=reserve)
+    except HTTPException:
+        _remove_quietly(normalized["path"])
+        raise
+
+# Identical generations in flight run once; duplicates wait for the same result
+generation_flights = SingleFlight()
+_flight_tasks = set()
+
+CANCELLED_RESULT = {"status": "cancelled", "message": "Generation cancelled", "results": []}
+
+def _flight_key(input_hash: str, style: str, num_images: int, seed: Optional[int], api_key_id,
+                variation: str = "full", refine_denoise: Optional[float] = None,
+                quality: str = DEFAULT_QUALITY_TIER) -> tuple:
+    """
+    Requests with the same key produce the same images. Seeded requests are
+    shared across keys like the result cache; unseeded ones ask for fresh
+    random variants, so only the same key's duplicates (double submits,
+    retries) are attached to each other.
+    """
+    return (input_hash, style, num_images, seed, variation, refine_denoise, quality,
+            api_key_id if seed is None else None)
+
+def _run_flight(flight, input_path: str, num_images: int, style: str, input_hash: Optional[str],
+                seed: Optional[int], api_key_id, role: str, variation: str = "full",
+                refine_denoise: Optional[float] = None, quality: str = DEFAULT_QUALITY_TIER) -> dict:
+    """Flight work: run the generation for every attached caller, then drop the input file"""
+    try:
+        return empty_2_furnished(
+            input_path=input_path,
+            num_images=num_images,
+            style=style,
+            input_hash=input_hash,
+            seed=seed,
+            api_key_id=api_key_id,
+            role=role,
+            progress_callback=flight.publish,
+            cancel_event=flight.cancel_event,
+            variation=variation,
+            refine_denoise=refine_denoise,
+            quality=quality
+        )
+    finally:
+        _remove_quietly(input_path)
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass  # Don't fail if cleanup doesn't work
+
+async def _await_unless_disconnected(generation: asyncio.Future, request: Optional[Request],
+                                     cancel_event: threading.Event, interval: float = 1.0):
+    """
+    Wait for a generation, setting ``cancel_event`` if the client goes away
+    so its queued and running ComfyUI prompts are dropped (once no other
+    caller is waiting for the same generation)
+    """
+    while request is not None and not generation.done():
+        await asyncio.wait([generation], timeout=interval)
+        if not generation.done() and await request.is_disconnected():
+            print("🛑 Client disconnected, cancelling generation")
+            cancel_event.set()
+            return CANCELLED_RESULT
+    return await generation
 
 async def _generate_staging_internal(
     image_file: UploadFile,
     num_images: int,
     style: str,
-    api_key_info: dict
+    api_key_info: dict,
+    seed: Optional[int] = None,
+    request: Optional[Request] = None,
+    variation: str = "full",
+    refine_denoise: Optional[float] = None,
+    quality: str = DEFAULT_QUALITY_TIER
 ):
     """Internal function to handle virtual staging generation"""
     
@@ -68,69 +304,65 @@ async def _generate_staging_internal(
     print(f"🎯 Starting virtual staging generation...")
     
     # Validate inputs
-    if not image_file.content_type or not image_file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
-    
-    if num_images < 1 or num_images > 10:
-        raise HTTPException(status_code=400, detail="Number of images must be between 1 and 10")
+    _validate_generation_request(image_file, num_images, style, seed, variation, refine_denoise, quality)
     
-    # Supported styles
-    supported_styles = ["scandinavian"]
-    if style not in supported_styles:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Style '{style}' not supported. Available styles: {supported_styles}"
-        )
+    # Turn excess load away before normalizing the upload. Seeded requests may be served from
+    # the result cache, which is keyed by the normalized input, so they are admitted after it
+    reservation = await _admit(api_key_info, num_images) if seed is None else None
+    leader = False
     
     try:
-        # Save uploaded file temporarily
-        temp_filename = f"temp_{image_file.filename}"
-        temp_path = os.path.join("temp_uploads", temp_filename)
+        # Save and normalize the upload under a unique temp name
+        normalized = await _receive_upload(image_file, prefix="temp")
+        temp_path = normalized["path"]
+        if reservation is None:
+            reservation = await _admit_uncached(
+                api_key_info, normalized, num_images, style, seed, variation, refine_denoise, quality
+            )
+        # Only requests that will run are billed at their tier's cost
+        await run_in_threadpool(_charge_quality, api_key_info, quality)
         
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(image_file.file, buffer)
+        def on_progress(event):
+            # Finished variants stop counting towards the admission backlog (cached ones never did)
+            if event.get("event") == "variant_done" and not event.get("cached"):
+                reservation.variant_done()
         
-        # Generate images using ComfyUI wrapper
-        result = empty_2_furnished(
-            input_path=os.path.abspath(temp_path),
-            num_images=num_images,
-            style=style
+        # Attach to an identical generation already running, or start one
+        api_key_id = api_key_info["key_info"].get("id")
+        cancel_event = threading.Event()
+        flight, leader = generation_flights.join(
+            _flight_key(normalized["sha256"], style, num_images, seed, api_key_id, variation, refine_denoise, quality),
+            cancel_event, on_progress
         )
+        if leader:
+            # The admitted variants stay pending until the flight ends, even if this client leaves first
+            flight.future.add_done_callback(lambda _: reservation.release())
+            # Generate images using ComfyUI wrapper (off the event loop)
+            work = partial(
+                _run_flight, input_path=os.path.abspath(temp_path), num_images=num_images, style=style,
+                input_hash=normalized["sha256"], seed=seed, api_key_id=api_key_id,
+                role=api_key_info.get("role", "user"), variation=variation, refine_denoise=refine_denoise,
+                quality=quality
+            )
+            task = asyncio.ensure_future(run_in_threadpool(generation_flights.execute, flight, work))
+            # The flight outlives this request if the client disconnects while others wait on it
+            _flight_tasks.add(task)
+            task.add_done_callback(_flight_tasks.discard)
+        else:
+            print(f"🔗 Attached to an identical generation in flight ({num_images} x {style})")
+            _remove_quietly(temp_path)
+            # The shared generation is already accounted for by its leader
+            reservation.release()
+        result = await _await_unless_disconnected(asyncio.wrap_future(flight.future), request, cancel_event)
         
         print(f"DEBUG: ComfyUI result: {result}")
         
-        # Clean up temp file
-        try:
-            os.remove(temp_path)
-        except:
-            pass  # Don't fail if cleanup doesn't work
-        
         # Return results in format expected by frontend
+        if result["status"] == "cancelled":
+            # Nobody is listening any more; the status is only for the access log
+            raise HTTPException(status_code=499, detail="Client disconnected")
         if result["status"] == "success":
-            # Extract image paths from results
-            images = []
-            for img_result in result["results"]:
-                if "file_path" in img_result:
-                    # Convert absolute path to relative path for web serving
-                    abs_path = img_result["file_path"]
-                    rel_path = os.path.relpath(abs_path, start=os.getcwd())
-                    web_path = "/generated/" + os.path.basename(rel_path)  # Create web-accessible path
-                    images.append({
-                        "output_image_url": web_path,
-                        "seed": img_result.get("seed", "unknown")
-                    })
-            
-            response_data = {
-                "success": True,
-                "message": f"Successfully generated {len(images)} virtual staging images",
-                "results": images,  # Frontend expects 'results' field
-                "metadata": {
-                    "style": style,
-                    "num_images": len(images),
-                    "original_filename": image_file.filename
-                }
-            }
-            
+            response_data = _format_results(result, style, image_file.filename)
             print(f"DEBUG: Returning response: {response_data}")
             return response_data
         else:
@@ -141,30 +373,386 @@ async def _generate_staging_internal(
     except Exception as e:
         print(f"❌ Error generating virtual staging: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        # A leader's reservation is released by its flight, which may outlive this request
+        if reservation is not None and not leader:
+            reservation.release()
 
-@router.get("/generated/{filename}")
-async def get_generated_image(filename: str):
+def _publish_job_progress(job_id: str, event: dict):
+    progress_hub.publish(job_id, event)
+    # Streams served by other worker processes read it from the jobs table
+    job_queue.record_progress(job_id, event)
+
+def _run_generation_job(job: dict) -> dict:
+    """Job queue handler: run one queued generation and return its response payload"""
+    print(f"🎯 Starting generation job {job['id']} ({job['num_images']} x {job['style']})")
+    input_hash = job["params"].get("input_hash")
+    seed = job["params"].get("seed")
+    variation = job["params"].get("variation", "full")
+    refine_denoise = job["params"].get("refine_denoise")
+    quality = job["params"].get("quality", DEFAULT_QUALITY_TIER)
+    key = _flight_key(input_hash or job["input_path"], job["style"], job["num_images"], seed, job["api_key_id"],
+                      variation, refine_denoise, quality)
+    work = partial(
+        _run_flight, input_path=job["input_path"], num_images=job["num_images"], style=job["style"],
+        input_hash=input_hash, seed=seed, api_key_id=job["api_key_id"], role=job["params"].get("role", "user"),
+        variation=variation, refine_denoise=refine_denoise, quality=quality
+    )
+    try:
+        result, coalesced = generation_flights.run(
+            key, work, cancel_event=job.get("cancel_event"),
+            progress_callback=lambda event: _publish_job_progress(job["id"], event),
+            cancelled_result=CANCELLED_RESULT
+        )
+        if coalesced:
+            print(f"🔗 Generation job {job['id']} shared an identical generation in flight")
+    finally:
+        progress_hub.clear(job["id"])
+        _remove_quietly(job["input_path"])
+    
+    if result["status"] != "success":
+        raise RuntimeError(result["message"])
+    return _format_results(result, job["style"], job["original_filename"])
+
+# Durable queue for asynchronous generation (workers started on application startup)
+job_queue = JobQueue(DatabaseManager(), _run_generation_job)
+
+# Backpressure for both synchronous requests and job submissions
+admission = AdmissionController(get_backend_pool, SLOTS_PER_BACKEND, MAX_IN_FLIGHT_PER_KEY, backlog=job_queue.backlog)
+
+# Gauges read at scrape time
+metrics_registry.gauge("staging_job_queue_depth", "Generation jobs waiting to be picked up",
+                       callback=lambda: job_queue.status_counts()["queued"])
+metrics_registry.gauge("staging_jobs_in_flight", "Generation jobs being processed",
+                       callback=lambda: job_queue.status_counts()["running"])
+metrics_registry.gauge("staging_variants_in_flight", "Variants holding a scheduler dispatch slot",
+                       callback=lambda: get_scheduler().status()["in_flight"])
+metrics_registry.gauge("staging_variants_waiting", "Variants waiting for a scheduler dispatch slot",
+                       callback=lambda: get_scheduler().status()["waiting"])
+
+def _backend_gauge(field):
+    """Per-backend gauge values; empty until a request has started the backend pool, so a scrape never starts it"""
+    def read():
+        pool = peek_backend_pool()
+        return {(b["address"],): int(b[field]) for b in pool.status()} if pool is not None else {}
+    return read
+
+metrics_registry.gauge("staging_comfy_queue_depth", "Prompts queued or running on each ComfyUI backend", ["backend"],
+                       callback=_backend_gauge("queue_depth"))
+metrics_registry.gauge("staging_comfy_backend_available", "Whether each ComfyUI backend accepts work", ["backend"],
+                       callback=_backend_gauge("available"))
+
+def _job_status_response(job: dict) -> dict:
+    response = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "style": job["style"],
+        "num_images": job["num_images"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "error": job["error_message"],
+        "status_url": f"/api/virtual-staging/jobs/{job['id']}",
+        "result_url": f"/api/virtual-staging/jobs/{job['id']}/result"
+    }
+    if job["status"] == "queued":
+        response["queue_position"] = job_queue.queue_position(job["id"])
+    return response
+
+def _get_owned_job(job_id: str, api_key_info: dict) -> dict:
+    """Load a job, hiding jobs that belong to other API keys (super admin sees all)"""
+    job = job_queue.get_job(job_id)
+    key_id = api_key_info["key_info"].get("id")
+    if not job or (api_key_info.get("role") != "superadmin" and job["api_key_id"] != key_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/jobs", status_code=202)
+async def submit_generation_job(
+    file: UploadFile = File(...),
+    num_images: int = Form(default=1),
+    style: str = Form(default="scandinavian"),
+    seed: Optional[int] = Form(default=None),
+    variation: str = Form(default="full"),
+    refine_denoise: Optional[float] = Form(default=None),
+    quality: str = Form(default=DEFAULT_QUALITY_TIER),
+    api_key_info: dict = Depends(validate_api_key_required)
+):
     """
-    Download a generated image file
+    Queue a virtual staging job and return immediately with its job id
+    
+    - **file**: Upload an image file of an empty room
+    - **num_images**: Number of variations to generate (1-10)
+    - **style**: Furnishing style (see `/styles` for available presets)
+    - **seed**: Optional base seed for reproducible results (variant i uses seed + i)
+    - **variation**: `full` reruns the whole workflow per variant; `refine` keeps one composition and varies only the final refine pass (much cheaper)
+    - **refine_denoise**: Optional refine-pass denoise for `refine` variations (higher varies more)
+    - **quality**: `draft` (fast ~512px preview, 1/4 quota), `standard` or `final` (more sampler steps, 1.5x quota)
+    - **X-API-Key**: Required API key in header for authentication
+    
+    Poll `status_url` until the job succeeds, then fetch `result_url`.
     """
-    file_path = os.path.join("generated", filename)
+    _validate_generation_request(file, num_images, style, seed, variation, refine_denoise, quality)
+    # Queued jobs count towards the backlog through the jobs table, so only check here
+    # (after normalizing for seeded jobs, whose cached variants need no ComfyUI slot)
+    if seed is None:
+        await _admit(api_key_info, num_images, reserve=False)
     
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Image not found")
+    job_id = uuid.uuid4().hex
+    normalized = await _receive_upload(
+        file, prefix=f"job_{job_id}", normalized_path=os.path.abspath(os.path.join("temp_uploads", f"job_{job_id}.png"))
+    )
+    input_path = normalized["path"]
+    if seed is not None:
+        await _admit_uncached(
+            api_key_info, normalized, num_images, style, seed, variation, refine_denoise, quality, reserve=False
+        )
+    # Only jobs that get queued are billed at their tier's cost
+    await run_in_threadpool(_charge_quality, api_key_info, quality)
+    
+    await run_in_threadpool(
+        job_queue.submit,
+        api_key_id=api_key_info["key_info"].get("id"),
+        input_path=input_path,
+        style=style,
+        num_images=num_images,
+        original_filename=file.filename,
+        params={
+            "seed": seed, "input_hash": normalized["sha256"], "role": api_key_info.get("role", "user"),
+            "variation": variation, "refine_denoise": refine_denoise, "quality": quality
+        },
+        job_id=job_id
+    )
+    print(f"📥 Queued generation job {job_id} for {api_key_info['key_info'].get('user_email', 'Unknown')}")
+    
+    job = await run_in_threadpool(job_queue.get_job, job_id)
+    return _job_status_response(job)
+
+@router.get("/jobs/{job_id}")
+async def get_generation_job(
+    job_id: str,
+    api_key_info: dict = Depends(validate_api_key_readonly)
+):
+    """
+    Get the status of a queued virtual staging job
+    """
+    job = await run_in_threadpool(_get_owned_job, job_id, api_key_info)
+    return _job_status_response(job)
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_generation_job(
+    job_id: str,
+    api_key_info: dict = Depends(validate_api_key_readonly)
+):
+    """
+    Cancel a queued or running virtual staging job
+    
+    Queued ComfyUI prompts of the job are removed and the running one is interrupted.
+    """
+    job = await run_in_threadpool(_get_owned_job, job_id, api_key_info)
+    if not await run_in_threadpool(_cancel_job, job):
+        raise HTTPException(status_code=409, detail=f"Job is already {job['status']}")
+    
+    job = await run_in_threadpool(job_queue.get_job, job_id)
+    return _job_status_response(job)
+
+def _cancel_job(job: dict) -> bool:
+    """Cancel a queued or running job; False if it had already finished"""
+    if job["status"] in TERMINAL_STATUSES:
+        return False
+    previous = job_queue.cancel(job["id"])
+    if previous is None:
+        return False
+    if previous == "queued":
+        # No worker will pick it up, so nobody else removes its input
+        _remove_quietly(job["input_path"])
+    print(f"🛑 Cancelled generation job {job['id']}")
+    return True
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.get("/jobs/{job_id}/events")
+async def stream_generation_job_events(
+    job_id: str,
+    cancel_on_disconnect: bool = Query(default=False, description="Cancel the job if this stream is closed before it finishes"),
+    api_key_info: dict = Depends(validate_api_key_readonly)
+):
+    """
+    Stream live progress of a virtual staging job as Server-Sent Events
+    
+    - **status**: job status and queue position while waiting
+    - **progress**: current variant, ComfyUI node and sampler step
+    - **done**: final job status; the stream closes afterwards
+    - **cancel_on_disconnect**: Cancel the job when the client goes away before `done` (for clients that only want the result while they are watching)
+    """
+    await run_in_threadpool(_get_owned_job, job_id, api_key_info)
     
-    return FileResponse(
-        path=file_path,
-        filename=filename,
-        media_type='image/png'
+    async def event_stream():
+        loop = asyncio.get_running_loop()
+        events = progress_hub.subscribe(job_id)
+        finished = False
+        try:
+            last_status = None
+            last_stored_progress = None
+            next_check = 0.0
+            last_sent = loop.time()
+            latest = progress_hub.latest(job_id)
+            if latest:
+                yield _sse("progress", latest)
+            while True:
+                # Job status comes from the database, at most once per second
+                if loop.time() >= next_check:
+                    current = await run_in_threadpool(job_queue.get_job, job_id)
+                    status = _job_status_response(current)
+                    if current["status"] in TERMINAL_STATUSES:
+                        finished = True
+                        yield _sse("done", status)
+                        return
+                    if status != last_status:
+                        yield _sse("status", status)
+                        last_status = status
+                        last_sent = loop.time()
+                    # Without a local publisher the job runs in another worker process
+                    if (current["progress"] and current["progress"] != last_stored_progress
+                            and progress_hub.latest(job_id) is None):
+                        yield _sse("progress", current["progress"])
+                        last_stored_progress = current["progress"]
+                        last_sent = loop.time()
+                    next_check = loop.time() + 1.0
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=max(0.05, next_check - loop.time()))
+                    yield _sse("progress", event)
+                    last_sent = loop.time()
+                except asyncio.TimeoutError:
+                    if loop.time() - last_sent >= 15:
+                        yield ": keep-alive\n\n"
+                        last_sent = loop.time()
+        finally:
+            progress_hub.unsubscribe(job_id, events)
+            if cancel_on_disconnect and not finished:
+                # The stream was closed under us; the generator cannot await any more
+                print(f"🛑 Event stream of job {job_id} closed, cancelling it")
+                loop.run_in_executor(None, lambda: _cancel_job(job_queue.get_job(job_id)))
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+@router.get("/jobs/{job_id}/result")
+async def get_generation_job_result(
+    job_id: str,
+    api_key_info: dict = Depends(validate_api_key_readonly)
+):
+    """
+    Get the result of a finished virtual staging job
+    """
+    job = await run_in_threadpool(_get_owned_job, job_id, api_key_info)
+    
+    if job["status"] == "succeeded":
+        return job["result"]
+    if job["status"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job['error_message']}")
+    raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+
+# Generated images never change once written (content-addressed or uuid names)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag == "*" or tag.replace("W/", "", 1) == etag for tag in candidates)
+
+async def generated_image_response(
+    request: Request,
+    filename: str,
+    size: str = "full",
+    image_format: str = "png",
+    quality: int = DEFAULT_QUALITY,
+    download: bool = False
+):
+    """
+    Serve a generated image or one of its derivatives (thumbnail/preview,
+    PNG/JPEG/WebP). Derivatives are rendered on first request and cached on
+    disk. Responses carry a strong ETag and ``Cache-Control: immutable``;
+    ranges are handled by ``FileResponse``.
+    """
+    try:
+        size, image_format, quality = parse_variant(size, image_format, quality)
+    except DerivativeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    output_store = get_output_store()
+    source_path = await run_in_threadpool(output_store.resolve, filename)
+    if not source_path:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    # The ETag follows from the source's name (its content hash) and the derivative parameters,
+    # so revalidation is answered without rendering anything
+    stem = os.path.splitext(filename)[0]
+    etag = f'"{stem}.{variant_name(size, image_format, quality)}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        path, media_type, variant = await run_in_threadpool(
+            get_derivative, source_path, size, image_format, quality, output_store.record_derivative
+        )
+    except FileNotFoundError:
+        # Evicted between resolving and rendering
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    download_name = f"{stem}{os.path.splitext(variant)[1]}" if download else None
+    return FileResponse(path=path, media_type=media_type, filename=download_name, headers=headers)
+
+@router.get("/generated/{filename}")
+async def get_generated_image(
+    request: Request,
+    filename: str,
+    size: str = Query(default="full", description="full, preview or thumbnail"),
+    format: str = Query(default="png", description="png, jpeg or webp"),
+    quality: int = Query(default=DEFAULT_QUALITY, description="1-100, for jpeg and webp")
+):
+    """
+    Download a generated image file
+    
+    - **size**: `full` (default), `preview` (1024px) or `thumbnail` (320px)
+    - **format**: `png` (default), `jpeg` or `webp`
+    - **quality**: Encoder quality for jpeg/webp (default 85)
+    """
+    return await generated_image_response(request, filename, size, format, quality, download=True)
+
+@router.get("/styles")
+async def list_styles():
+    """
+    List the available furnishing style presets
+    """
+    return {"styles": await run_in_threadpool(style_registry.list)}
+
 @router.get("/health")
 async def health_check():
     """
     Health check endpoint for virtual staging service
     """
+    # Starting the backend pool probes every backend, and the stats read the database
+    return await run_in_threadpool(_health_status)
+
+def _health_status() -> dict:
+    backends = get_backend_pool().status()
     return {
-        "status": "healthy",
+        "status": "healthy" if any(b["available"] for b in backends) else "degraded",
         "service": "virtual-staging",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "backends": backends,
+        "scheduler": get_scheduler().status(),
+        "admission": admission.status(),
+        "single_flight": generation_flights.status(),
+        "result_cache": get_result_cache().stats(),
+        "output_store": get_output_store().stats(),
+        "preprocess_cache": get_preprocess_cache().stats()
     }
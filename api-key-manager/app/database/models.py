@@ -1,8 +1,11 @@
 import sqlite3
+import time
 from datetime import datetime, date
 from typing import List, Dict, Optional, Tuple
 import os
 
+from app.services.metrics import observe_stage
+
 class DatabaseManager:
     def __init__(self, db_path: str = "api_keys.db"):
         self.db_path = db_path
@@ -56,6 +59,94 @@ class DatabaseManager:
             )
         ''')
         
+        # Create Generation Jobs table (durable queue for asynchronous generation)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS generation_jobs (
+                id TEXT PRIMARY KEY,
+                api_key_id INTEGER,
+                status TEXT NOT NULL DEFAULT 'queued',
+                input_path TEXT NOT NULL,
+                original_filename TEXT,
+                style TEXT NOT NULL,
+                num_images INTEGER NOT NULL,
+                params TEXT,
+                result TEXT,
+                error_message TEXT,
+                attempts INTEGER DEFAULT 0,
+                worker_id TEXT,
+                created_at TIMESTAMP NOT NULL,
+                started_at TIMESTAMP,
+                heartbeat_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                progress TEXT,
+                FOREIGN KEY (api_key_id) REFERENCES api_keys(id)
+            )
+        ''')
+        
+        # Add progress column to existing generation_jobs tables if it doesn't exist
+        try:
+            cursor.execute('ALTER TABLE generation_jobs ADD COLUMN progress TEXT')
+            print("🔄 Added 'progress' column to existing generation_jobs table")
+        except sqlite3.OperationalError:
+            # Column already exists
+            pass
+        
+        # Create ComfyUI Uploads table (which input images each backend already holds)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS comfy_uploads (
+                backend TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                comfy_name TEXT NOT NULL,
+                uploaded_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (backend, content_hash)
+            )
+        ''')
+        
+        # Create Result Cache table (deterministic requests -> stored outputs)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS result_cache (
+                cache_key TEXT PRIMARY KEY,
+                file_path TEXT NOT NULL,
+                seed INTEGER NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                last_access TIMESTAMP NOT NULL,
+                hits INTEGER DEFAULT 0
+            )
+        ''')
+        
+        # Create Output Store table (content-addressed generated images)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS output_store (
+                content_hash TEXT PRIMARY KEY,
+                rel_path TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                last_access TIMESTAMP NOT NULL,
+                derivative_bytes INTEGER DEFAULT 0
+            )
+        ''')
+        
+        # Create Preprocess Cache table (depth/segmentation maps per workflow version and input)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS preprocess_cache (
+                version TEXT NOT NULL,
+                input_hash TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                last_access TIMESTAMP NOT NULL,
+                PRIMARY KEY (version, input_hash)
+            )
+        ''')
+        
+        # Add derivative_bytes column to existing output_store tables if it doesn't exist
+        try:
+            cursor.execute('ALTER TABLE output_store ADD COLUMN derivative_bytes INTEGER DEFAULT 0')
+            print("🔄 Added 'derivative_bytes' column to existing output_store table")
+        except sqlite3.OperationalError:
+            # Column already exists
+            pass
+        
         # Create indexes for better performance
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_key_hash ON api_keys(key_hash)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_email ON api_keys(user_email)')
@@ -63,6 +154,11 @@ class DatabaseManager:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_role ON api_keys(role)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_api_key_id ON usage_logs(api_key_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON usage_logs(request_timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_status ON generation_jobs(status, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_api_key_id ON generation_jobs(api_key_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_result_cache_access ON result_cache(last_access)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_output_store_access ON output_store(last_access)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_preprocess_cache_access ON preprocess_cache(last_access)')
         
         conn.commit()
         conn.close()
@@ -73,29 +169,35 @@ class DatabaseManager:
     
     def execute_query(self, query: str, params: tuple = ()) -> List[Tuple]:
         """Execute a SELECT query and return results"""
+        started = time.perf_counter()
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute(query, params)
         results = cursor.fetchall()
         conn.close()
+        observe_stage("db_query", time.perf_counter() - started)
         return results
     
     def execute_update(self, query: str, params: tuple = ()) -> int:
         """Execute an INSERT/UPDATE/DELETE query and return affected rows"""
+        started = time.perf_counter()
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute(query, params)
         affected_rows = cursor.rowcount
         conn.commit()
         conn.close()
+        observe_stage("db_query", time.perf_counter() - started)
         return affected_rows
     
     def execute_insert(self, query: str, params: tuple = ()) -> int:
         """Execute an INSERT query and return the last inserted ID"""
+        started = time.perf_counter()
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute(query, params)
         last_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        observe_stage("db_query", time.perf_counter() - started)
         return last_id
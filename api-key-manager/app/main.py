@@ -1,5 +1,6 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
+from starlette.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
@@ -11,10 +12,16 @@ import os
 load_dotenv()
 
 from app.api.api_keys import router as api_keys_router
-from app.api.virtual_staging import router as virtual_staging_router
+from app.api.virtual_staging import router as virtual_staging_router, job_queue, generated_image_response
 from app.middleware.auth import verify_admin_credentials
+from app.middleware.upload_limit import UploadLimitMiddleware
 from app.database.models import DatabaseManager
 from app.services.api_key_service import APIKeyService
+from app.services.comfy_wrapper import close_connections
+from app.services.input_normalization import shutdown_normalization_pool
+from app.services.image_derivatives import DEFAULT_QUALITY
+from app.services.style_registry import style_registry
+from app.services.metrics import registry as metrics_registry
 
 app = FastAPI(
     title="Virtual Staging API",
@@ -22,6 +29,9 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Refuse oversized uploads while they are received (added first so CORS headers wrap the 413)
+app.add_middleware(UploadLimitMiddleware)
+
 # Add CORS middleware - cross origin resource sharing (CORS) to allow requests from any origin
 app.add_middleware(
     CORSMiddleware,
@@ -36,11 +46,24 @@ db_manager = DatabaseManager()
 
 # Serve static files (CSS, JS, images)
 app.mount("/app/static", StaticFiles(directory="app/static"), name="static")
-app.mount("/generated", StaticFiles(directory="generated"), name="generated")
 
 # Templates
 templates = Jinja2Templates(directory="app/templates")
 
+@app.on_event("startup")
+def start_job_workers():
+    """Load style presets, watch them for changes and start the dispatcher threads for queued generation jobs"""
+    style_registry.start()
+    job_queue.start()
+
+@app.on_event("shutdown")
+def shutdown_comfy_connections():
+    """Stop job workers, the style watcher, the normalization pool and long-lived ComfyUI connections"""
+    job_queue.stop()
+    style_registry.stop()
+    shutdown_normalization_pool()
+    close_connections()
+
 # Dependency functions
 def get_db_manager():
     return DatabaseManager()
@@ -112,11 +135,23 @@ async def admin_panel(request: Request):
     """Serve the admin panel interface"""
     return templates.TemplateResponse("main.html", {"request": request})
 
+@app.get("/generated/{filename}", include_in_schema=False)
+async def serve_generated_image(request: Request, filename: str, size: str = "full", format: str = "png", quality: int = DEFAULT_QUALITY):
+    """Serve generated images (and their thumbnail/preview derivatives) from the output store"""
+    return await generated_image_response(request, filename, size, format, quality)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "message": "Virtual Staging API is running"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, cache/quota/ComfyUI error counters and queue gauges"""
+    # Some gauges query the database
+    body = await run_in_threadpool(metrics_registry.render)
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     import os
     port = int(os.environ.get("PORT", 8004))
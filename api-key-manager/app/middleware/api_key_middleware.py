@@ -6,6 +6,7 @@ from fastapi import HTTPException, Depends, Header
 from typing import Optional
 from app.services.api_key_service import APIKeyService
 from app.database.models import DatabaseManager
+from app.services.metrics import stage_timer
 
 # Dependency to get API key service
 def get_api_key_service():
@@ -23,7 +24,8 @@ async def validate_api_key_optional(
         return None
     
     # Validate the API key with role support (includes super admin)
-    is_valid, key_info, message, role = api_key_service.validate_api_key_with_role(x_api_key)
+    with stage_timer("auth"):
+        is_valid, key_info, message, role = api_key_service.validate_api_key_with_role(x_api_key)
     
     if not is_valid:
         raise HTTPException(
@@ -56,7 +58,8 @@ async def validate_api_key_required(
         )
     
     # Validate the API key with role support (includes super admin)
-    is_valid, key_info, message, role = api_key_service.validate_api_key_with_role(x_api_key)
+    with stage_timer("auth"):
+        is_valid, key_info, message, role = api_key_service.validate_api_key_with_role(x_api_key)
     
     if not is_valid:
         raise HTTPException(
@@ -74,3 +77,27 @@ async def validate_api_key_required(
         "authenticated": True,
         "role": role.value if role else "user"
     }
+
+async def validate_api_key_readonly(
+    x_api_key: str = Header(..., description="Required API key for authentication"),
+    api_key_service: APIKeyService = Depends(get_api_key_service)
+) -> dict:
+    """
+    Required API key validation without usage tracking - for status/polling endpoints
+    that must not consume quota
+    """
+    with stage_timer("auth"):
+        is_valid, key_info, message, role = api_key_service.validate_api_key_with_role(x_api_key)
+    
+    if not is_valid:
+        raise HTTPException(
+            status_code=401,
+            detail=f"Invalid API key: {message}"
+        )
+    
+    return {
+        "api_key": x_api_key,
+        "key_info": key_info.__dict__ if key_info else {},
+        "authenticated": True,
+        "role": role.value if role else "user"
+    }
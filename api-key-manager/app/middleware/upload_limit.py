@@ -0,0 +1,54 @@
+"""
+Upload limit middleware
+Rejects oversized request bodies with 413 before they are buffered
+"""
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+from app.services.upload_storage import MAX_REQUEST_BYTES, MAX_UPLOAD_BYTES
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that caps request bodies at ``max_body_bytes``.
+
+    FastAPI parses (and spools to disk) the whole multipart form before a
+    route handler runs, so the limit has to be enforced here. A declared
+    ``Content-Length`` over the limit is refused before any of the body is
+    read; bodies without one (chunked) are counted as they arrive and the
+    request fails with 413 as soon as the limit is crossed.
+    """
+
+    def __init__(self, app, max_body_bytes: int = MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    def _too_large_detail(self) -> str:
+        return f"Upload exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            response = JSONResponse({"detail": self._too_large_detail()}, status_code=413,
+                                    headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # Surfaces from the form parser as a 413 response
+                    raise HTTPException(status_code=413, detail=self._too_large_detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -35,10 +35,10 @@ class APIKeyResponse(BaseModel):
     revoked_at: Optional[str]
     rate_limit: int
     daily_quota: int
-    current_daily_usage: int
+    current_daily_usage: float  # Quota units; draft/final quality requests cost less/more than 1
     last_quota_reset: str
     is_active: Optional[bool] = None
-    usage_count: Optional[int] = None  # Frontend compatibility field
+    usage_count: Optional[float] = None  # Frontend compatibility field
     
     def __init__(self, **data):
         super().__init__(**data)
@@ -60,7 +60,7 @@ class APIKeyValidationResponse(BaseModel):
     valid: bool
     message: str
     key_info: Optional[APIKeyResponse] = None
-    remaining_quota: Optional[int] = None
+    remaining_quota: Optional[float] = None
     rate_limit_remaining: Optional[int] = None
 
 class UsageLogResponse(BaseModel):
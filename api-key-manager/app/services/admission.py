@@ -0,0 +1,181 @@
+"""
+Admission Control
+Rejects generation requests early when the backlog would take too long to drain
+"""
+import math
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+from .comfy_backends import BackendPool
+from .metrics import ADMISSION_REJECTIONS
+
+# Reject new work when the estimated wait for it to finish exceeds this (seconds)
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "300"))
+# Variants a single API key may have waiting or running at once
+ADMISSION_MAX_PENDING_PER_KEY = int(os.getenv("ADMISSION_MAX_PENDING_PER_KEY", "20"))
+# Completion time assumed for a prompt until one has been measured
+ADMISSION_DEFAULT_PROMPT_SECONDS = float(os.getenv("ADMISSION_DEFAULT_PROMPT_SECONDS", "30"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is turned away; carries the HTTP status and Retry-After seconds"""
+
+    def __init__(self, status_code: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Decides whether a request for ``n`` variants can be accepted.
+
+    Pending work is the variants of admitted synchronous requests that
+    have not finished, plus the variants of queued and running jobs
+    (``backlog``), plus prompts other clients queued directly on the
+    backends. Since ``in_flight / completion time`` gives the throughput
+    of each dispatch slot, the drain time is estimated as
+    ``pending * avg_prompt_seconds / (available_backends * slots_per_backend)``.
+
+    - No available backend: 503, retry once an ejection or open circuit ends.
+    - The key already has too many variants pending: 429.
+    - The estimated drain time exceeds ``max_wait_seconds``: 503.
+
+    Retry-After is the estimated time until the request would be admitted.
+    Callers pass only the variants ComfyUI has to render: a request the
+    result cache serves entirely is admitted without looking at the backends.
+    """
+
+    def __init__(self, pool_getter: Callable[[], BackendPool], slots_per_backend: int, key_parallelism: int,
+                 backlog: Optional[Callable[[], Dict[str, int]]] = None,
+                 max_wait_seconds: float = ADMISSION_MAX_WAIT_SECONDS,
+                 max_pending_per_key: int = ADMISSION_MAX_PENDING_PER_KEY,
+                 default_prompt_seconds: float = ADMISSION_DEFAULT_PROMPT_SECONDS):
+        self.pool_getter = pool_getter
+        self.slots_per_backend = max(1, slots_per_backend)
+        self.key_parallelism = max(1, key_parallelism)
+        self.backlog = backlog
+        self.max_wait_seconds = max_wait_seconds
+        self.max_pending_per_key = max_pending_per_key
+        self.default_prompt_seconds = default_prompt_seconds
+        self._lock = threading.Lock()
+        self._admit_lock = threading.Lock()
+        self._pending: Dict[str, int] = {}
+        self.admitted = 0
+        self.rejected = 0
+
+    def estimate(self) -> Dict:
+        """Current capacity, pending variants and estimated drain time"""
+        backends = self.pool_getter().status()
+        available = [b for b in backends if b["available"]]
+        durations = [b["avg_prompt_seconds"] for b in available if b["avg_prompt_seconds"]]
+        prompt_seconds = sum(durations) / len(durations) if durations else self.default_prompt_seconds
+        # Prompts queued on the backends by other clients
+        external = sum(max(0, b["queue_depth"] - b["in_flight"]) for b in available)
+
+        with self._lock:
+            pending_by_key = dict(self._pending)
+        for key, variants in (self.backlog() if self.backlog else {}).items():
+            pending_by_key[key] = pending_by_key.get(key, 0) + variants
+
+        parallelism = len(available) * self.slots_per_backend
+        pending = sum(pending_by_key.values()) + external
+        return {
+            "available_backends": len(available),
+            "parallelism": parallelism,
+            "prompt_seconds": prompt_seconds,
+            "pending_variants": pending,
+            "pending_by_key": pending_by_key,
+            "drain_seconds": pending * prompt_seconds / parallelism if parallelism else None,
+        }
+
+    def check(self, key: str, num_variants: int):
+        """Raise AdmissionRejected if ``num_variants`` more for ``key`` cannot be accepted now"""
+        if num_variants <= 0:
+            # Served entirely from the result cache; nothing waits for a backend
+            return
+        estimate = self.estimate()
+        if not estimate["parallelism"]:
+            self._reject(503, "No ComfyUI backend is available", self.pool_getter().retry_after(), "no_backend")
+
+        prompt_seconds = estimate["prompt_seconds"]
+        key_pending = estimate["pending_by_key"].get(key, 0)
+        # A key with nothing pending is never refused here, however many variants it asks for
+        if key_pending and key_pending + num_variants > self.max_pending_per_key:
+            excess = key_pending + num_variants - self.max_pending_per_key
+            self._reject(
+                429,
+                f"Too many generations pending for this API key ({key_pending} variants)",
+                excess * prompt_seconds / min(estimate["parallelism"], self.key_parallelism),
+                "key_backlog"
+            )
+
+        drain_seconds = (estimate["pending_variants"] + num_variants) * prompt_seconds / estimate["parallelism"]
+        if drain_seconds > self.max_wait_seconds:
+            self._reject(
+                503,
+                f"Generation capacity exhausted (estimated wait {int(drain_seconds)}s)",
+                drain_seconds - self.max_wait_seconds,
+                "capacity"
+            )
+
+    def _reject(self, status_code: int, message: str, retry_after: float, reason: str):
+        with self._lock:
+            self.rejected += 1
+        ADMISSION_REJECTIONS.inc(reason=reason)
+        raise AdmissionRejected(status_code, message, max(1, math.ceil(retry_after)))
+
+    def reserve(self, key: str, num_variants: int) -> "Reservation":
+        """Check and reserve ``num_variants`` for a synchronous request; release the reservation when done"""
+        # Check and reserve atomically so a burst cannot all pass the same check
+        with self._admit_lock:
+            self.check(key, num_variants)
+            with self._lock:
+                if num_variants > 0:
+                    self._pending[key] = self._pending.get(key, 0) + num_variants
+                self.admitted += 1
+        return Reservation(self, key, num_variants)
+
+    def _unreserve(self, key: str, num_variants: int):
+        with self._lock:
+            remaining = self._pending.get(key, 0) - num_variants
+            if remaining > 0:
+                self._pending[key] = remaining
+            else:
+                self._pending.pop(key, None)
+
+    def status(self) -> Dict:
+        estimate = self.estimate()
+        return {
+            "pending_variants": estimate["pending_variants"],
+            "drain_seconds": round(estimate["drain_seconds"], 1) if estimate["drain_seconds"] is not None else None,
+            "prompt_seconds": round(estimate["prompt_seconds"], 2),
+            "max_wait_seconds": self.max_wait_seconds,
+            "max_pending_per_key": self.max_pending_per_key,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+class Reservation:
+    """Variants admitted for one request; each finished variant stops counting towards the backlog"""
+
+    def __init__(self, controller: AdmissionController, key: str, num_variants: int):
+        self.controller = controller
+        self.key = key
+        self.remaining = num_variants
+        self._lock = threading.Lock()
+
+    def variant_done(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return
+            self.remaining -= 1
+        self.controller._unreserve(self.key, 1)
+
+    def release(self):
+        with self._lock:
+            remaining, self.remaining = self.remaining, 0
+        if remaining:
+            self.controller._unreserve(self.key, remaining)
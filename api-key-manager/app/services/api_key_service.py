@@ -6,6 +6,7 @@ from datetime import datetime, date, timedelta
 from typing import Optional, Tuple, Dict, List
 from app.database.models import DatabaseManager
 from app.models.api_key_models import APIKeyCreate, APIKeyUpdate, APIKeyResponse, UsageLogResponse, UserRole
+from app.services.metrics import QUOTA_REJECTIONS
 
 class APIKeyService:
     def __init__(self, db_manager: DatabaseManager):
@@ -207,6 +208,7 @@ class APIKeyService:
         
         # Check daily quota
         if key_info.current_daily_usage >= key_info.daily_quota:
+            QUOTA_REJECTIONS.inc(reason="daily_quota")
             return False, "Daily quota exceeded", {
                 "daily_quota": key_info.daily_quota,
                 "current_usage": key_info.current_daily_usage
@@ -214,6 +216,7 @@ class APIKeyService:
         
         # Check rate limit (simplified - in production, use Redis for this)
         if not self._check_rate_limit(key_id, key_info.rate_limit):
+            QUOTA_REJECTIONS.inc(reason="rate_limit")
             return False, "Rate limit exceeded", {
                 "rate_limit": key_info.rate_limit
             }
@@ -224,10 +227,10 @@ class APIKeyService:
             "rate_limit": key_info.rate_limit
         }
     
-    def increment_usage(self, key_id: int):
-        """Increment the daily usage counter"""
-        query = "UPDATE api_keys SET current_daily_usage = current_daily_usage + 1 WHERE id = ?"
-        self.db_manager.execute_update(query, (key_id,))
+    def increment_usage(self, key_id: int, amount: float = 1):
+        """Increment the daily usage counter (by a request's quota cost, which may be fractional or negative)"""
+        query = "UPDATE api_keys SET current_daily_usage = MAX(0, current_daily_usage + ?) WHERE id = ?"
+        self.db_manager.execute_update(query, (amount, key_id))
     
     def _hash_exists(self, key_hash: str) -> bool:
         """Check if a hash already exists in the database"""
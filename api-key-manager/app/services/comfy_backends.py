@@ -0,0 +1,306 @@
+"""
+ComfyUI Backend Pool
+Tracks health and queue depth of every ComfyUI backend and picks the least-loaded one
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from .comfy_connection import ComfyConnection
+from .metrics import COMFY_ERRORS
+
+# How often each backend's /queue and /system_stats are probed (seconds)
+PROBE_INTERVAL = 2.0
+PROBE_TIMEOUT = 3.0
+
+# Consecutive failures before a backend is ejected, and how long it stays out
+EJECT_AFTER_FAILURES = 3
+EJECT_COOLDOWN = 30.0
+
+# Smoothing factor for the moving average of prompt completion times
+DURATION_EWMA_ALPHA = 0.2
+
+# Circuit breaker on requests: consecutive failures (errors and timeouts) that open it,
+# and how long it stays open; the cooldown doubles each time a trial request fails
+BREAKER_FAILURES = int(os.getenv("COMFY_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("COMFY_BREAKER_COOLDOWN", "30"))
+BREAKER_MAX_COOLDOWN = float(os.getenv("COMFY_BREAKER_MAX_COOLDOWN", "300"))
+
+
+class NoHealthyBackendError(Exception):
+    """Raised when every ComfyUI backend is down or ejected"""
+
+
+class CircuitBreaker:
+    """
+    Per-backend circuit breaker for generation requests.
+
+    ``closed``: requests flow; ``failure_threshold`` consecutive failures open it.
+    ``open``: the backend gets no requests until ``cooldown`` has passed.
+    ``half_open``: a single trial request is let through; success closes the
+    circuit, failure opens it again with twice the cooldown.
+
+    Probes do not close the circuit: a backend can answer ``/queue`` while its
+    prompts hang. Callers hold the pool lock.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN,
+                 max_cooldown: float = BREAKER_MAX_COOLDOWN):
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_until = 0.0
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    def allows_request(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() >= self.opened_until
+        return not self.trial_in_flight
+
+    def on_dispatch(self):
+        if self.state == "open" and time.monotonic() >= self.opened_until:
+            self.state = "half_open"
+        if self.state == "half_open":
+            self.trial_in_flight = True
+
+    def on_release(self):
+        # A trial that ended without a verdict (e.g. cancelled) frees the way for another
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.cooldown = self.base_cooldown
+        self.trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Count a failure; returns True if this opened the circuit"""
+        self.failures += 1
+        if self.state == "half_open":
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        elif self.state == "open" or self.failures < self.failure_threshold:
+            return False
+        self.state = "open"
+        self.opened_until = time.monotonic() + self.cooldown
+        self.trial_in_flight = False
+        self.times_opened += 1
+        return True
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit lets a request through again"""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_until - time.monotonic())
+
+    def to_dict(self) -> Dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_after": round(self.retry_after(), 1),
+            "times_opened": self.times_opened,
+        }
+
+
+class ComfyBackend:
+    """Health and load bookkeeping for a single ComfyUI backend"""
+
+    def __init__(self, connection: ComfyConnection):
+        self.connection = connection
+        self.address = connection.server_address
+        self.healthy = False
+        self.queue_depth = 0
+        self.dispatched_since_probe = 0
+        self.in_flight = 0
+        self.vram_free: Optional[int] = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.last_error: Optional[str] = None
+        self.last_probe: Optional[float] = None
+        # Moving average of dispatch-to-result time of successful prompts
+        self.avg_prompt_seconds: Optional[float] = None
+        self.breaker = CircuitBreaker()
+
+    @property
+    def available(self) -> bool:
+        return (self.healthy and self.connection.connected and time.monotonic() >= self.ejected_until
+                and self.breaker.allows_request())
+
+    @property
+    def load(self) -> int:
+        """Estimated prompts ahead of a new submission on this backend"""
+        return self.queue_depth + self.dispatched_since_probe
+
+    def to_dict(self) -> Dict:
+        return {
+            "address": self.address,
+            "healthy": self.healthy,
+            "available": self.available,
+            "connected": self.connection.connected,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "vram_free": self.vram_free,
+            "consecutive_failures": self.consecutive_failures,
+            "ejected": time.monotonic() < self.ejected_until,
+            "last_error": self.last_error,
+            "avg_prompt_seconds": round(self.avg_prompt_seconds, 2) if self.avg_prompt_seconds is not None else None,
+            "circuit": self.breaker.to_dict(),
+        }
+
+
+class BackendPool:
+    """
+    Pool of ComfyUI backends with queue-depth-aware dispatch.
+
+    A probe thread refreshes each backend's queue depth from ``/queue`` and
+    free VRAM from ``/system_stats``. ``acquire()`` hands out the available
+    backend with the fewest prompts ahead of us; backends that keep failing
+    probes are ejected for ``EJECT_COOLDOWN`` seconds, and backends whose
+    requests keep failing or timing out are cut off by their circuit breaker.
+    """
+
+    def __init__(self, connections: List[ComfyConnection], probe_interval: float = PROBE_INTERVAL):
+        self.backends = [ComfyBackend(connection) for connection in connections]
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Probe every backend once, then keep probing in the background"""
+        if self._thread and self._thread.is_alive():
+            return
+        for backend in self.backends:
+            backend.connection.start()
+        for backend in self.backends:
+            backend.connection.wait_connected(timeout=PROBE_TIMEOUT)
+        self.probe_all()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._probe_loop, name="comfy-backend-probe", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.probe_interval):
+            self.probe_all()
+
+    def probe_all(self):
+        for backend in self.backends:
+            self.probe(backend)
+
+    def probe(self, backend: ComfyBackend):
+        session = backend.connection.session
+        try:
+            response = session.get(backend.connection.url("/queue"), timeout=PROBE_TIMEOUT)
+            response.raise_for_status()
+            queue_info = response.json()
+            depth = len(queue_info.get("queue_running", [])) + len(queue_info.get("queue_pending", []))
+
+            response = session.get(backend.connection.url("/system_stats"), timeout=PROBE_TIMEOUT)
+            response.raise_for_status()
+            devices = response.json().get("devices") or []
+            vram_free = sum(device.get("vram_free", 0) for device in devices) if devices else None
+        except Exception as e:
+            COMFY_ERRORS.inc(backend=backend.address, kind="probe")
+            self.record_failure(backend, f"probe failed: {e}")
+            return
+
+        with self._lock:
+            backend.queue_depth = depth
+            backend.dispatched_since_probe = 0
+            backend.vram_free = vram_free
+            backend.last_probe = time.monotonic()
+            backend.healthy = True
+            backend.consecutive_failures = 0
+            backend.last_error = None
+
+    def record_failure(self, backend: ComfyBackend, error: str):
+        with self._lock:
+            backend.consecutive_failures += 1
+            backend.last_error = error
+            if backend.consecutive_failures >= EJECT_AFTER_FAILURES:
+                if backend.healthy:
+                    print(f"⚠️ Ejecting ComfyUI backend {backend.address} for {EJECT_COOLDOWN:.0f}s: {error}")
+                backend.healthy = False
+                backend.ejected_until = time.monotonic() + EJECT_COOLDOWN
+
+    def record_request_failure(self, backend: ComfyBackend, error: str):
+        with self._lock:
+            backend.last_error = error
+            if backend.breaker.record_failure():
+                print(f"⚠️ Circuit opened for ComfyUI backend {backend.address} "
+                      f"for {backend.breaker.cooldown:.0f}s: {error}")
+
+    def record_success(self, backend: ComfyBackend, duration: Optional[float] = None):
+        with self._lock:
+            backend.consecutive_failures = 0
+            if backend.breaker.state != "closed":
+                print(f"✅ Circuit closed for ComfyUI backend {backend.address}")
+            backend.breaker.record_success()
+            if duration is not None:
+                if backend.avg_prompt_seconds is None:
+                    backend.avg_prompt_seconds = duration
+                else:
+                    backend.avg_prompt_seconds += DURATION_EWMA_ALPHA * (duration - backend.avg_prompt_seconds)
+
+    def acquire(self, prefer: Optional[ComfyBackend] = None) -> ComfyBackend:
+        """Reserve ``prefer`` if it is available (its node cache is warm), else the least-loaded backend"""
+        with self._lock:
+            candidates = [backend for backend in self.backends if backend.available]
+            if not candidates:
+                raise NoHealthyBackendError("No healthy ComfyUI backend available")
+            if prefer in candidates:
+                backend = prefer
+            else:
+                backend = min(candidates, key=lambda b: (b.load, b.in_flight))
+            backend.breaker.on_dispatch()
+            backend.dispatched_since_probe += 1
+            backend.in_flight += 1
+            return backend
+
+    def release(self, backend: ComfyBackend):
+        with self._lock:
+            backend.in_flight = max(0, backend.in_flight - 1)
+            backend.breaker.on_release()
+
+    def retry_after(self) -> float:
+        """Seconds until some backend is expected to take requests again"""
+        now = time.monotonic()
+        with self._lock:
+            waits = [
+                max(backend.ejected_until - now, backend.breaker.retry_after())
+                for backend in self.backends if backend.healthy and backend.connection.connected
+            ]
+        return min(waits) if waits else EJECT_COOLDOWN
+
+    @contextmanager
+    def lease(self, prefer: Optional[ComfyBackend] = None):
+        """Context manager around acquire()/release() that records transport failures"""
+        backend = self.acquire(prefer)
+        started = time.monotonic()
+        try:
+            yield backend
+        except OSError as e:
+            # Connection/HTTP errors and timeouts count against the backend; workflow errors do not
+            COMFY_ERRORS.inc(backend=backend.address, kind="timeout" if isinstance(e, TimeoutError) else "transport")
+            self.record_request_failure(backend, str(e))
+            raise
+        else:
+            self.record_success(backend, time.monotonic() - started)
+        finally:
+            self.release(backend)
+
+    def status(self) -> List[Dict]:
+        with self._lock:
+            return [backend.to_dict() for backend in self.backends]
@@ -0,0 +1,280 @@
+"""
+ComfyUI Connection Manager
+Keeps one long-lived websocket and a pooled HTTP session per ComfyUI backend
+"""
+import json
+import os
+import queue
+import struct
+import threading
+import uuid
+from typing import Dict, Optional
+
+import requests
+import websocket
+from requests.adapters import HTTPAdapter
+
+# Reconnect backoff (seconds) for the websocket reader
+RECONNECT_BACKOFF_INITIAL = 0.5
+RECONNECT_BACKOFF_MAX = 30.0
+
+# Maximum number of keep-alive HTTP connections kept per backend
+HTTP_POOL_SIZE = 16
+
+# Per-call HTTP deadlines (seconds): connecting, and waiting for each read
+HTTP_CONNECT_TIMEOUT = float(os.getenv("COMFY_HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("COMFY_HTTP_TIMEOUT", "30"))
+
+# The websocket is pinged after this long without a frame, and dropped if
+# the next interval passes without any frame (pong included) either
+WS_CONNECT_TIMEOUT = 10.0
+WS_IDLE_TIMEOUT = 20.0
+
+# ComfyUI binary websocket frame types (server.BinaryEventTypes) and image formats
+BINARY_PREVIEW_IMAGE = 1
+BINARY_IMAGE_FORMATS = {1: "JPEG", 2: "PNG"}
+
+
+class PromptValidationError(Exception):
+    """ComfyUI rejected a prompt (HTTP 400) - a workflow/input problem, not a backend failure"""
+
+    def __init__(self, message: str, node_errors: Optional[dict] = None):
+        super().__init__(message)
+        self.node_errors = node_errors or {}
+
+
+class ComfyConnection:
+    """
+    Long-lived connection to a single ComfyUI backend.
+
+    A background thread owns the websocket (opened with a stable client id)
+    and fans every event out to the request waiting on its ``prompt_id``.
+    Requests register with ``listen()`` *before* queueing their prompt so no
+    event can be missed.
+    """
+
+    def __init__(self, server_address: str, client_id: Optional[str] = None,
+                 timeout: tuple = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        self.server_address = server_address
+        self.client_id = client_id or str(uuid.uuid4())
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount("http://", adapter)
+
+        self._listeners: Dict[str, queue.Queue] = {}
+        self._lock = threading.Lock()
+        self._ws = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._connected = threading.Event()
+        # (prompt_id, node) ComfyUI is currently executing for this client
+        self._executing = (None, None)
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        """Start the websocket reader thread (idempotent)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=f"comfy-ws-{self.server_address}", daemon=True
+            )
+            self._thread.start()
+
+    def close(self):
+        """Stop the reader thread and release sockets"""
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.abort()
+            except Exception:
+                pass
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.session.close()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        """Block until the websocket is connected"""
+        self.start()
+        return self._connected.wait(timeout)
+
+    # ------------------------------------------------------------------
+    # Event routing
+    # ------------------------------------------------------------------
+    def listen(self, prompt_id: str) -> queue.Queue:
+        """Register interest in a prompt's events and return its event queue"""
+        events = queue.Queue()
+        with self._lock:
+            self._listeners[prompt_id] = events
+        return events
+
+    def unlisten(self, prompt_id: str):
+        """Stop routing events for a prompt"""
+        with self._lock:
+            self._listeners.pop(prompt_id, None)
+
+    def _dispatch(self, message: dict):
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id") if isinstance(data, dict) else None
+        with self._lock:
+            if prompt_id is not None:
+                targets = [self._listeners[prompt_id]] if prompt_id in self._listeners else []
+            else:
+                # Backend-wide events (e.g. queue status) go to everyone
+                targets = list(self._listeners.values())
+        for events in targets:
+            events.put(message)
+
+    def _track_executing(self, message: dict):
+        if message.get("type") == "executing":
+            data = message.get("data") or {}
+            if data.get("node") is None:
+                self._executing = (None, None)
+            else:
+                self._executing = (data.get("prompt_id"), data.get("node"))
+
+    def _dispatch_binary(self, frame: bytes):
+        """
+        Route a binary frame (image sent by SaveImageWebsocket or a sampler
+        preview) to the prompt that is executing. Binary frames carry no
+        prompt id, but ComfyUI runs one prompt at a time per backend.
+        """
+        if len(frame) < 8:
+            return
+        event_type, image_format = struct.unpack(">II", frame[:8])
+        if event_type != BINARY_PREVIEW_IMAGE:
+            return
+        prompt_id, node = self._executing
+        if prompt_id is None:
+            return
+        self._dispatch({
+            "type": "binary_image",
+            "data": {
+                "prompt_id": prompt_id,
+                "node": node,
+                "format": BINARY_IMAGE_FORMATS.get(image_format, "PNG"),
+                "image": frame[8:],
+            }
+        })
+
+    def _run(self):
+        backoff = RECONNECT_BACKOFF_INITIAL
+        while not self._stop.is_set():
+            try:
+                ws = websocket.WebSocket()
+                ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}", timeout=WS_CONNECT_TIMEOUT)
+                ws.settimeout(WS_IDLE_TIMEOUT)
+                self._ws = ws
+                self._connected.set()
+                backoff = RECONNECT_BACKOFF_INITIAL
+                # Events may have been lost while disconnected; let waiters re-check history
+                self._dispatch({"type": "reconnected", "data": {}})
+
+                ping_pending = False
+                while not self._stop.is_set():
+                    try:
+                        opcode, data = ws.recv_data(control_frame=True)
+                    except websocket.WebSocketTimeoutException:
+                        # A backend that died without closing the socket never answers
+                        if ping_pending:
+                            raise ConnectionError(f"no frame for {2 * WS_IDLE_TIMEOUT:.0f}s")
+                        ws.ping()
+                        ping_pending = True
+                        continue
+                    ping_pending = False
+                    if opcode == websocket.ABNF.OPCODE_TEXT:
+                        try:
+                            message = json.loads(data.decode("utf-8"))
+                        except ValueError:
+                            continue
+                        self._track_executing(message)
+                        self._dispatch(message)
+                    elif opcode == websocket.ABNF.OPCODE_BINARY:
+                        self._dispatch_binary(data)
+                    elif opcode == websocket.ABNF.OPCODE_CLOSE:
+                        raise ConnectionError("closed by server")
+            except Exception as e:
+                if not self._stop.is_set():
+                    print(f"⚠️ ComfyUI websocket {self.server_address} lost: {e}; reconnecting in {backoff:.1f}s")
+            finally:
+                self._connected.clear()
+                self._executing = (None, None)
+                if self._ws is not None:
+                    try:
+                        self._ws.close()
+                    except Exception:
+                        pass
+                    self._ws = None
+
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    # ------------------------------------------------------------------
+    # HTTP API
+    # ------------------------------------------------------------------
+    def url(self, path: str) -> str:
+        return f"http://{self.server_address}{path}"
+
+    def queue_prompt(self, prompt: dict, prompt_id: str) -> dict:
+        payload = {"prompt": prompt, "client_id": self.client_id, "prompt_id": prompt_id}
+        response = self.session.post(self.url("/prompt"), data=json.dumps(payload).encode("utf-8"),
+                                     timeout=self.timeout)
+        if response.status_code == 400:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+            error = body.get("error") or {}
+            message = error.get("message", response.text) if isinstance(error, dict) else str(error)
+            raise PromptValidationError(f"ComfyUI rejected prompt: {message}", body.get("node_errors"))
+        response.raise_for_status()
+        return response.json()
+
+    def get_history(self, prompt_id: str) -> dict:
+        response = self.session.get(self.url(f"/history/{prompt_id}"), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_image(self, filename: str, subfolder: str, folder_type: str) -> bytes:
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        response = self.session.get(self.url("/view"), params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def upload_image(self, data: bytes, name: str, overwrite: bool = True) -> dict:
+        """Upload an input image through /upload/image; returns ComfyUI's {name, subfolder, type}"""
+        files = {"image": (name, data, "application/octet-stream")}
+        form = {"type": "input", "overwrite": "true" if overwrite else "false"}
+        response = self.session.post(self.url("/upload/image"), files=files, data=form, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def delete_queued(self, prompt_ids: list):
+        """Remove prompts that have not started yet from the backend's queue"""
+        response = self.session.post(self.url("/queue"), json={"delete": list(prompt_ids)}, timeout=self.timeout)
+        response.raise_for_status()
+
+    def interrupt(self, prompt_id: Optional[str] = None):
+        """Interrupt the running prompt (only ``prompt_id`` on ComfyUI versions that accept it)"""
+        payload = {"prompt_id": prompt_id} if prompt_id else {}
+        response = self.session.post(self.url("/interrupt"), json=payload, timeout=self.timeout)
+        response.raise_for_status()
+
+    def cancel_prompt(self, prompt_id: str):
+        """
+        Stop a prompt wherever it is: drop it from the queue if still pending,
+        and interrupt it if this client's websocket reports it executing.
+        """
+        self.delete_queued([prompt_id])
+        if self._executing[0] == prompt_id:
+            self.interrupt(prompt_id)
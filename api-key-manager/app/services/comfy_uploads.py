@@ -0,0 +1,107 @@
+"""
+ComfyUI Input Uploads
+Content-addressed upload of input images to ComfyUI backends with a dedup index
+"""
+import hashlib
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from app.database.models import DatabaseManager
+
+from .comfy_connection import ComfyConnection
+from .metrics import record_cache_lookup
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadIndex:
+    """
+    Records which input images (by content hash) each backend already holds.
+
+    Images are uploaded through ComfyUI's ``/upload/image`` under their
+    content hash, so re-staging the same room with different settings skips
+    the upload. The index lives in the ``comfy_uploads`` table and is cached
+    in memory; ``invalidate()`` drops an entry that turned out to be stale
+    (e.g. the backend's input directory was cleaned).
+    """
+
+    def __init__(self, db_manager: DatabaseManager):
+        self.db_manager = db_manager
+        self._known: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+        self._upload_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+    def lookup(self, backend: str, content_hash: str) -> Optional[str]:
+        key = (backend, content_hash)
+        with self._lock:
+            if key in self._known:
+                return self._known[key]
+        results = self.db_manager.execute_query(
+            "SELECT comfy_name FROM comfy_uploads WHERE backend = ? AND content_hash = ?",
+            (backend, content_hash)
+        )
+        if not results:
+            return None
+        with self._lock:
+            self._known[key] = results[0][0]
+        return results[0][0]
+
+    def record(self, backend: str, content_hash: str, comfy_name: str):
+        self.db_manager.execute_update('''
+            INSERT OR REPLACE INTO comfy_uploads (backend, content_hash, comfy_name, uploaded_at)
+            VALUES (?, ?, ?, ?)
+        ''', (backend, content_hash, comfy_name, datetime.now().isoformat()))
+        with self._lock:
+            self._known[(backend, content_hash)] = comfy_name
+
+    def invalidate(self, backend: str, content_hash: str):
+        self.db_manager.execute_update(
+            "DELETE FROM comfy_uploads WHERE backend = ? AND content_hash = ?",
+            (backend, content_hash)
+        )
+        with self._lock:
+            self._known.pop((backend, content_hash), None)
+
+    def ensure_uploaded(self, connection: ComfyConnection, input_path: str, content_hash: str) -> str:
+        """Return the ComfyUI image name for this input, uploading it first if the backend lacks it"""
+        backend = connection.server_address
+        comfy_name = self.lookup(backend, content_hash)
+        if comfy_name:
+            record_cache_lookup("upload", hit=True)
+            return comfy_name
+
+        key = (backend, content_hash)
+        with self._lock:
+            upload_lock = self._upload_locks.setdefault(key, threading.Lock())
+        with upload_lock:
+            # Another request may have uploaded it while we waited
+            comfy_name = self.lookup(backend, content_hash)
+            if comfy_name:
+                record_cache_lookup("upload", hit=True)
+                return comfy_name
+
+            record_cache_lookup("upload", hit=False)
+            extension = os.path.splitext(input_path)[1].lower() or ".png"
+            with open(input_path, "rb") as f:
+                data = f.read()
+            uploaded = connection.upload_image(data, f"{content_hash}{extension}")
+            comfy_name = uploaded["name"]
+            if uploaded.get("subfolder"):
+                comfy_name = f"{uploaded['subfolder']}/{comfy_name}"
+            self.record(backend, content_hash, comfy_name)
+            print(f"📤 Uploaded input {content_hash[:12]} to ComfyUI backend {backend}")
+
+        with self._lock:
+            self._upload_locks.pop(key, None)
+        return comfy_name
@@ -0,0 +1,256 @@
+"""
+ComfyUI Workflow Helpers
+Transformations applied to API-format workflows before they are queued
+"""
+import copy
+import hashlib
+import json
+
+# Node that produces the final staged image in joger.json
+OUTPUT_NODE = "159"
+
+
+def use_websocket_output(prompt, node_id=OUTPUT_NODE):
+    """
+    Replace a ``SaveImage`` node with ``SaveImageWebsocket`` so the image is
+    streamed back as a binary websocket frame instead of being written to
+    ComfyUI's output directory and fetched over ``/view``.
+
+    ``SaveImageWebsocket`` ships with ComfyUI as
+    ``custom_nodes/websocket_image_save.py``.
+    """
+    node = prompt.get(node_id)
+    if node is None:
+        raise KeyError(f"Workflow has no node {node_id}")
+    prompt[node_id] = {
+        "class_type": "SaveImageWebsocket",
+        "inputs": {"images": node["inputs"]["images"]},
+        "_meta": node.get("_meta", {}),
+    }
+    return prompt
+
+
+# ----------------------------------------------------------------------
+# Graph helpers
+# ----------------------------------------------------------------------
+def is_link(value):
+    """API-format inputs reference other nodes as ``[node_id, output_index]``"""
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def upstream_nodes(prompt, node_ids):
+    """Return ``node_ids`` plus every node they (transitively) depend on"""
+    seen = set()
+    stack = list(node_ids)
+    while stack:
+        node_id = stack.pop()
+        if node_id in seen or node_id not in prompt:
+            continue
+        seen.add(node_id)
+        for value in prompt[node_id].get("inputs", {}).values():
+            if is_link(value):
+                stack.append(value[0])
+    return seen
+
+
+def prune_to_outputs(prompt, output_nodes):
+    """
+    Return the minimal workflow that computes ``output_nodes``.
+
+    Every node the outputs do not (transitively) depend on is dropped, e.g.
+    the editor's ``PreviewImage``/``MaskPreview`` sinks, which ComfyUI would
+    otherwise execute, encode to temp PNGs and list in ``/history``.
+    Node dicts are shared with ``prompt``, not copied.
+    """
+    missing = [node_id for node_id in output_nodes if node_id not in prompt]
+    if missing:
+        raise KeyError(f"Workflow has no output node(s) {missing}")
+    keep = upstream_nodes(prompt, output_nodes)
+    return {node_id: node for node_id, node in prompt.items() if node_id in keep}
+
+
+def dangling_links(prompt):
+    """Return ``(node_id, input_name, target)`` for every link to a node missing from ``prompt``"""
+    return [
+        (node_id, name, value[0])
+        for node_id, node in prompt.items()
+        for name, value in node.get("inputs", {}).items()
+        if is_link(value) and value[0] not in prompt
+    ]
+
+
+def rewire(prompt, old_link, new_link):
+    """Point every input that reads ``old_link`` at ``new_link`` instead"""
+    for node in prompt.values():
+        inputs = node.get("inputs", {})
+        for name, value in inputs.items():
+            if is_link(value) and value[0] == old_link[0] and value[1] == old_link[1]:
+                inputs[name] = list(new_link)
+
+
+# ----------------------------------------------------------------------
+# Preprocessing (depth map + segmentation) cached per input image
+# ----------------------------------------------------------------------
+INPUT_NODE = "9"
+DEPTH_NODE = "46"
+SEGMENTATION_NODE = "161"
+SEGMENTATION_MASK_NODE = "161_mask"
+
+# Preview sinks added to the preprocessing workflow, by map name
+PREPROCESS_OUTPUTS = {
+    "depth": "preprocess_depth",
+    "segmentation": "preprocess_segmentation",
+    "mask": "preprocess_mask",
+}
+
+# Node whose "image" input receives each cached map in the variant workflow
+PREPROCESSED_MAP_NODES = {
+    "depth": DEPTH_NODE,
+    "segmentation": SEGMENTATION_NODE,
+    "mask": SEGMENTATION_MASK_NODE,
+}
+
+
+def build_preprocess_workflow(prompt):
+    """
+    Extract the depth (DepthAnything_V2) and segmentation (Interior Design
+    Segmentator) branches of ``prompt`` into a standalone workflow whose
+    outputs are the depth map, the segmentation image and the mask.
+    """
+    keep = upstream_nodes(prompt, [DEPTH_NODE, SEGMENTATION_NODE])
+    workflow = {node_id: copy.deepcopy(prompt[node_id]) for node_id in keep}
+    workflow[PREPROCESS_OUTPUTS["depth"]] = {
+        "class_type": "PreviewImage",
+        "inputs": {"images": [DEPTH_NODE, 0]},
+    }
+    workflow[PREPROCESS_OUTPUTS["segmentation"]] = {
+        "class_type": "PreviewImage",
+        "inputs": {"images": [SEGMENTATION_NODE, 0]},
+    }
+    workflow["preprocess_mask_image"] = {
+        "class_type": "MaskToImage",
+        "inputs": {"mask": [SEGMENTATION_NODE, 1]},
+    }
+    workflow[PREPROCESS_OUTPUTS["mask"]] = {
+        "class_type": "PreviewImage",
+        "inputs": {"images": ["preprocess_mask_image", 0]},
+    }
+    return workflow
+
+
+def preprocess_version(prompt):
+    """Fingerprint of the preprocessing branches; cached maps are only valid for the same version"""
+    keep = upstream_nodes(prompt, [DEPTH_NODE, SEGMENTATION_NODE]) - {INPUT_NODE}
+    material = json.dumps({node_id: prompt[node_id] for node_id in sorted(keep)}, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:16]
+
+
+def supports_preprocessed_maps(prompt):
+    return DEPTH_NODE in prompt and SEGMENTATION_NODE in prompt
+
+
+def use_preprocessed_maps(prompt):
+    """
+    Swap the depth and segmentation models for loaders of cached maps.
+
+    Node 46 becomes a ``LoadImage`` of the depth map, node 161 a ``LoadImage``
+    of the segmentation image, and a new ``LoadImageMask`` node replaces the
+    segmentator's mask output. Callers fill in each loader's ``image`` input
+    (see ``PREPROCESSED_MAP_NODES``).
+    """
+    prompt[DEPTH_NODE] = {
+        "class_type": "LoadImage",
+        "inputs": {"image": ""},
+        "_meta": {"title": "Cached Depth Map"},
+    }
+    prompt[SEGMENTATION_NODE] = {
+        "class_type": "LoadImage",
+        "inputs": {"image": ""},
+        "_meta": {"title": "Cached Segmentation"},
+    }
+    prompt[SEGMENTATION_MASK_NODE] = {
+        "class_type": "LoadImageMask",
+        "inputs": {"image": "", "channel": "red"},
+        "_meta": {"title": "Cached Segmentation Mask"},
+    }
+    rewire(prompt, [SEGMENTATION_NODE, 1], [SEGMENTATION_MASK_NODE, 0])
+    return prompt
+
+
+# ----------------------------------------------------------------------
+# Refinement-only variations
+# ----------------------------------------------------------------------
+SEED_NODE = "107"
+REFINE_SAMPLER_NODE = "155"
+
+
+def supports_refine_variation(prompt):
+    """The refine pass must be a KSampler fed by the shared seed primitive"""
+    node = prompt.get(REFINE_SAMPLER_NODE)
+    return (
+        SEED_NODE in prompt and node is not None and node.get("class_type") == "KSampler"
+        and is_link(node["inputs"].get("seed")) and node["inputs"]["seed"][0] == SEED_NODE
+    )
+
+
+def use_refine_variation(prompt, refine_seed, denoise=None):
+    """
+    Detach the refine KSampler (node 155) from the shared seed so only the
+    refinement changes between variants. The style guidance (7), inpaint
+    (41) and upscale (144) passes keep reading node 107, so their inputs stay
+    identical across variants and ComfyUI serves them from its node cache
+    when the variants run back to back on the same backend.
+    """
+    inputs = prompt[REFINE_SAMPLER_NODE]["inputs"]
+    inputs["seed"] = refine_seed
+    if denoise is not None:
+        inputs["denoise"] = denoise
+    return prompt
+
+
+# ----------------------------------------------------------------------
+# Quality tiers
+# ----------------------------------------------------------------------
+INPAINT_DECODE_NODE = "42"
+
+# ``overrides`` set node inputs; ``output_from`` feeds the output node from an
+# earlier image, after which pruning drops everything that only led to the old one.
+# ``cost`` weighs both quota usage and scheduling relative to a standard render.
+QUALITY_TIERS = {
+    # Fewer steps, no 4x upscale / lanczos downscale / refine pass: a ~512px preview
+    "draft": {
+        "cost": 0.25,
+        "overrides": {"7": {"steps": 12}, "41": {"steps": 20}},
+        "output_from": [INPAINT_DECODE_NODE, 0],
+    },
+    # The workflow as authored
+    "standard": {
+        "cost": 1.0,
+        "overrides": {},
+    },
+    # Longer inpaint (41) and refine (155) KSampler passes for the image that gets delivered;
+    # the 4x model upscale (144) has no sampler steps to raise
+    "final": {
+        "cost": 1.5,
+        "overrides": {"41": {"steps": 60}, "155": {"steps": 75}},
+    },
+}
+DEFAULT_QUALITY_TIER = "standard"
+
+
+def supports_quality_tier(prompt, tier):
+    config = QUALITY_TIERS[tier]
+    nodes = set(config["overrides"])
+    if config.get("output_from"):
+        nodes.add(config["output_from"][0])
+    return all(node_id in prompt for node_id in nodes)
+
+
+def apply_quality_tier(prompt, tier, output_node=OUTPUT_NODE):
+    """Apply a tier's overrides to ``prompt`` (edited in place) and return it pruned to ``output_node``"""
+    config = QUALITY_TIERS[tier]
+    for node_id, inputs in config["overrides"].items():
+        prompt[node_id]["inputs"].update(inputs)
+    if config.get("output_from"):
+        prompt[output_node]["inputs"]["images"] = list(config["output_from"])
+    return prune_to_outputs(prompt, [output_node])
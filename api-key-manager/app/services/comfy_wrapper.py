@@ -2,110 +2,567 @@
 ComfyUI Wrapper Service
 Handles all ComfyUI communication and image generation logic
 """
-import websocket
 import uuid
-import json
-import os, io
-from PIL import Image
+import os
+import threading
 import base64
 import copy
 import random
+import queue
+import time
+from app.database.models import DatabaseManager
+from .comfy_connection import ComfyConnection, PromptValidationError
+from .comfy_backends import BackendPool
+from .comfy_uploads import UploadIndex, file_sha256
+from .result_cache import ResultCache
+from .output_store import OutputStore
+from .comfy_workflow import (
+    OUTPUT_NODE, INPUT_NODE, PREPROCESS_OUTPUTS, PREPROCESSED_MAP_NODES,
+    use_websocket_output, build_preprocess_workflow, use_preprocessed_maps, use_refine_variation, prune_to_outputs,
+    apply_quality_tier, QUALITY_TIERS, DEFAULT_QUALITY_TIER, REFINE_SAMPLER_NODE
+)
+from .preprocess_cache import PreprocessCache
+from .style_registry import style_registry
+from .scheduler import FairScheduler, SchedulingCancelled, SLOTS_PER_BACKEND
+from .metrics import COMFY_ERRORS, observe_stage, record_cache_lookup, stage_timer
 
-COMFY_HOST = "127.0.0.1"
-COMFY_PORT = 8188
-CLIENT_ID = str(uuid.uuid4())
+COMFY_HOST = os.getenv("COMFY_HOST", "127.0.0.1")
+COMFY_PORT = int(os.getenv("COMFY_PORT", "8188"))
 SERVER_ADDRESS = f"{COMFY_HOST}:{COMFY_PORT}"
 
+# Comma-separated list of ComfyUI backends, e.g. "10.0.0.5:8188,10.0.0.6:8188"
+COMFY_BACKENDS = [
+    address.strip()
+    for address in os.getenv("COMFY_BACKENDS", SERVER_ADDRESS).split(",")
+    if address.strip()
+]
+
+# Deliver the final image over the websocket (requires the SaveImageWebsocket node on every backend)
+COMFY_WS_OUTPUT = os.getenv("COMFY_WS_OUTPUT", "false").lower() in ("1", "true", "yes")
+
+# Compute depth/segmentation once per input image and reuse them for every variant
+COMFY_PREPROCESS_CACHE = os.getenv("COMFY_PREPROCESS_CACHE", "true").lower() in ("1", "true", "yes")
+
+# "full" reruns the whole workflow per variant; "refine" renders the composition once
+# and only reruns the refine pass (node 155) with a new seed for the other variants
+VARIATION_MODES = ("full", "refine")
+# Scheduling cost of a refine-only variant relative to a full run
+REFINE_VARIANT_COST = 0.3
+
+_connections = {}
+_connections_lock = threading.RLock()
+_backend_pool = None
+_upload_index = None
+_result_cache = None
+_preprocess_cache = None
+_output_store = None
+_scheduler = None
+
+def get_connection(server_address=SERVER_ADDRESS):
+    """Return the shared long-lived connection for a ComfyUI backend"""
+    with _connections_lock:
+        connection = _connections.get(server_address)
+        if connection is None:
+            connection = ComfyConnection(server_address)
+            _connections[server_address] = connection
+    connection.start()
+    return connection
+
+def get_backend_pool():
+    """Return the shared pool of ComfyUI backends, starting it on first use"""
+    global _backend_pool
+    with _connections_lock:
+        if _backend_pool is None:
+            _backend_pool = BackendPool([get_connection(address) for address in COMFY_BACKENDS])
+            _backend_pool.start()
+        return _backend_pool
+
+def peek_backend_pool():
+    """Return the backend pool if it has been started, without starting it (e.g. for metrics)"""
+    with _connections_lock:
+        return _backend_pool
+
+def get_upload_index():
+    """Return the shared index of input images already uploaded to each backend"""
+    global _upload_index
+    with _connections_lock:
+        if _upload_index is None:
+            _upload_index = UploadIndex(DatabaseManager())
+        return _upload_index
+
+def get_result_cache():
+    """Return the shared cache of already rendered results"""
+    global _result_cache
+    with _connections_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(DatabaseManager())
+        return _result_cache
+
+def get_preprocess_cache():
+    """Return the shared on-disk cache of depth maps and segmentation masks"""
+    global _preprocess_cache
+    with _connections_lock:
+        if _preprocess_cache is None:
+            _preprocess_cache = PreprocessCache(DatabaseManager())
+        return _preprocess_cache
+
+def get_output_store():
+    """Return the shared content-addressed store of generated images"""
+    global _output_store
+    with _connections_lock:
+        if _output_store is None:
+            _output_store = OutputStore(DatabaseManager())
+        return _output_store
+
+def get_scheduler():
+    """Return the shared fair-share scheduler that gates dispatch to ComfyUI"""
+    global _scheduler
+    with _connections_lock:
+        if _scheduler is None:
+            _scheduler = FairScheduler(SLOTS_PER_BACKEND * len(COMFY_BACKENDS))
+        return _scheduler
+
+def close_connections():
+    """Close every open ComfyUI connection (called on application shutdown)"""
+    global _backend_pool
+    with _connections_lock:
+        if _backend_pool is not None:
+            _backend_pool.stop()
+            _backend_pool = None
+        connections = list(_connections.values())
+        _connections.clear()
+    for connection in connections:
+        connection.close()
+
 def queue_prompt(prompt, prompt_id):
-    import urllib.request
-    data = json.dumps({"prompt": prompt, "client_id": CLIENT_ID, "prompt_id": prompt_id}).encode("utf-8")
-    req = urllib.request.Request(f"http://{SERVER_ADDRESS}/prompt", data=data)
-    urllib.request.urlopen(req).read()
+    return get_connection().queue_prompt(prompt, prompt_id)
 
 def get_image(filename, subfolder, folder_type):
-    import urllib.parse, urllib.request
-    data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    url_values = urllib.parse.urlencode(data)
-    with urllib.request.urlopen(f"http://{SERVER_ADDRESS}/view?{url_values}") as response:
-        return response.read()
+    return get_connection().get_image(filename, subfolder, folder_type)
 
 def get_history(prompt_id):
-    import urllib.request
-    with urllib.request.urlopen(f"http://{SERVER_ADDRESS}/history/{prompt_id}") as response:
-        return json.loads(response.read())
+    return get_connection().get_history(prompt_id)
+
+# ComfyUI websocket events forwarded to progress callbacks
+PROGRESS_EVENT_TYPES = ("status", "execution_start", "execution_cached", "executing", "progress")
+
+# How often a waiting generation checks whether it was cancelled (seconds)
+CANCEL_POLL_INTERVAL = 0.5
+
+# Deadline for one prompt from queueing to its last output, including queue wait
+PROMPT_TIMEOUT = float(os.getenv("COMFY_PROMPT_TIMEOUT", "600"))
+# Without events for this long, /history is checked in case the completion message was lost
+HISTORY_CHECK_INTERVAL = 30.0
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is cancelled by its caller"""
+
+class PromptInterrupted(GenerationCancelled):
+    """The backend interrupted a prompt, e.g. through ComfyUI's own /interrupt"""
 
-def generate_images_ws(ws, prompt, seed=None):
+class PromptTimeoutError(TimeoutError):
+    """A prompt missed its deadline; counts as a backend failure like other OSErrors"""
+
+def _check_history_status(entry, prompt_id):
+    """
+    Raise ``RuntimeError`` if a prompt's ``/history`` entry records an
+    execution error or an interrupt. Finding the prompt in the history only
+    means it left the queue, not that it produced its outputs.
+    """
+    status = entry.get("status") or {}
+    status_str = status.get("status_str")
+    if status_str in (None, "success"):
+        return
+    messages = {}
+    for message in status.get("messages") or []:
+        if isinstance(message, (list, tuple)) and len(message) == 2:
+            messages[message[0]] = message[1] or {}
+    if "execution_interrupted" in messages or status_str == "interrupted":
+        raise RuntimeError(f"ComfyUI prompt {prompt_id} was interrupted")
+    error = messages.get("execution_error", {})
+    raise RuntimeError(f"ComfyUI execution error: {error.get('exception_message', status_str)}")
+
+def generate_images_ws(connection, prompt, seed=None, on_event=None, output_nodes=None, ws_output_node=None,
+                       cancel_event=None, timeout=PROMPT_TIMEOUT):
+    """
+    Queue a prompt and wait for its output images.
+
+    ``output_nodes`` limits which nodes' images are downloaded from
+    ``/history`` + ``/view``. When ``ws_output_node`` is set, that node is
+    expected to be a ``SaveImageWebsocket`` whose frames are collected from
+    the websocket, and no history or view requests are made at all.
+    Setting ``cancel_event`` removes the prompt from the backend's queue (or
+    interrupts it if already running) and raises ``GenerationCancelled``;
+    a prompt still unfinished after ``timeout`` seconds is cancelled the
+    same way and raises ``PromptTimeoutError``. A prompt interrupted on the
+    backend by anyone else raises ``PromptInterrupted``.
+    """
     prompt_id = str(uuid.uuid4())
     if seed is not None and "107" in prompt:
         prompt["107"]["inputs"]["value"] = seed
-    queue_prompt(prompt, prompt_id)
     output_images = {}
 
-    while True:
-        out = ws.recv()
-        if isinstance(out, str):
-            message = json.loads(out)
+    if not connection.wait_connected(timeout=10):
+        raise ConnectionError(f"ComfyUI websocket at {connection.server_address} is not connected")
+
+    # Register before queueing so the completion event cannot be missed
+    events = connection.listen(prompt_id)
+    deadline = time.monotonic() + timeout
+    try:
+        connection.queue_prompt(prompt, prompt_id)
+        queued_at = time.monotonic()
+        started_at = None
+        next_history_check = time.monotonic() + HISTORY_CHECK_INTERVAL
+        while True:
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            if cancelled or time.monotonic() >= deadline:
+                try:
+                    connection.cancel_prompt(prompt_id)
+                except OSError as e:
+                    print(f"⚠️ Could not cancel prompt {prompt_id} on {connection.server_address}: {e}")
+                if cancelled:
+                    raise GenerationCancelled(f"Prompt {prompt_id} cancelled")
+                raise PromptTimeoutError(
+                    f"ComfyUI prompt {prompt_id} on {connection.server_address} did not finish within {timeout:g}s"
+                )
+            now = time.monotonic()
+            wait = min(deadline, next_history_check) - now
+            if cancel_event is not None:
+                wait = min(wait, CANCEL_POLL_INTERVAL)
+            try:
+                message = events.get(timeout=max(0.0, wait))
+            except queue.Empty:
+                if time.monotonic() >= next_history_check and ws_output_node is None:
+                    # The completion message may have been dropped
+                    history = connection.get_history(prompt_id)
+                    if prompt_id in history:
+                        _check_history_status(history[prompt_id], prompt_id)
+                        break
+                    next_history_check = time.monotonic() + HISTORY_CHECK_INTERVAL
+                continue
+            next_history_check = time.monotonic() + HISTORY_CHECK_INTERVAL
+            if started_at is None and message["type"] in ("execution_start", "execution_cached", "executing"):
+                # The backend has picked the prompt up: everything before this was queue wait
+                started_at = time.monotonic()
+                observe_stage("comfy_queue_wait", started_at - queued_at)
+            if on_event is not None and message["type"] in PROGRESS_EVENT_TYPES:
+                on_event(message)
             if message["type"] == "executing":
                 data = message["data"]
                 if data["node"] is None and data["prompt_id"] == prompt_id:
                     break
-        else:
-            continue
+            elif message["type"] == "execution_error":
+                COMFY_ERRORS.inc(backend=connection.server_address, kind="execution")
+                raise RuntimeError(f"ComfyUI execution error: {message['data'].get('exception_message', 'unknown')}")
+            elif message["type"] == "execution_interrupted":
+                # Followed by the same "executing" message as a finished prompt, without its outputs
+                raise PromptInterrupted(f"ComfyUI prompt {prompt_id} was interrupted on {connection.server_address}")
+            elif message["type"] == "binary_image":
+                data = message["data"]
+                if ws_output_node is not None and data["node"] == ws_output_node:
+                    output_images.setdefault(data["node"], []).append(data["image"])
+            elif message["type"] == "reconnected":
+                # The websocket dropped; the prompt may have finished (or failed) meanwhile
+                history = connection.get_history(prompt_id)
+                if prompt_id in history:
+                    _check_history_status(history[prompt_id], prompt_id)
+                    if ws_output_node is not None:
+                        raise ConnectionError("ComfyUI websocket dropped while streaming output images")
+                    break
+    finally:
+        connection.unlisten(prompt_id)
+    observe_stage("comfy_execution", time.monotonic() - (started_at or queued_at))
+
+    if ws_output_node is not None:
+        return output_images
 
-    history = get_history(prompt_id)[prompt_id]
-    for node_id, node_output in history["outputs"].items():
-        if "images" in node_output and node_output["images"]:
-            images_data = [get_image(img["filename"], img["subfolder"], img["type"]) for img in node_output["images"]]
-            output_images[node_id] = images_data
+    with stage_timer("image_fetch"):
+        history = connection.get_history(prompt_id)[prompt_id]
+        _check_history_status(history, prompt_id)
+        for node_id, node_output in history["outputs"].items():
+            if output_nodes is not None and node_id not in output_nodes:
+                continue
+            if "images" in node_output and node_output["images"]:
+                images_data = [connection.get_image(img["filename"], img["subfolder"], img["type"]) for img in node_output["images"]]
+                output_images[node_id] = images_data
 
     return output_images
 
-def empty_2_furnished(input_path, num_images, style="scandinavian"):
+def _progress_event(message, prompt, variant, num_images):
+    """Translate a raw ComfyUI websocket message into a client-facing progress event"""
+    data = message.get("data") or {}
+    event = {"event": message["type"], "variant": variant, "num_variants": num_images}
+    if message["type"] == "status":
+        exec_info = (data.get("status") or {}).get("exec_info") or {}
+        event["queue_remaining"] = exec_info.get("queue_remaining")
+        return event
+    node = data.get("node")
+    if node is not None:
+        event["node"] = node
+        event["node_title"] = prompt.get(node, {}).get("_meta", {}).get("title")
+    if message["type"] == "progress":
+        event["value"] = data.get("value")
+        event["max"] = data.get("max")
+    elif message["type"] == "execution_cached":
+        event["nodes"] = data.get("nodes", [])
+    return event
+
+def _generate_on_backend(backend, prompt, uploads, **kwargs):
+    """
+    Point each loader node in ``uploads`` ({node_id: (local_path, sha256)})
+    at the backend's copy of that file, uploading it if needed, and run the
+    prompt. If the backend rejects one of those files because our upload
+    index is stale, they are re-uploaded and the prompt is retried once.
+    """
+    upload_index = get_upload_index()
+    connection = backend.connection
+    for node_id, (path, content_hash) in uploads.items():
+        if node_id in prompt:
+            prompt[node_id]["inputs"]["image"] = upload_index.ensure_uploaded(connection, path, content_hash)
+    try:
+        return generate_images_ws(connection, prompt, **kwargs)
+    except PromptValidationError as e:
+        COMFY_ERRORS.inc(backend=connection.server_address, kind="validation")
+        stale = [node_id for node_id in uploads if node_id in e.node_errors]
+        if not stale:
+            raise
+        print(f"🔁 ComfyUI backend {connection.server_address} lost inputs for nodes {stale}; re-uploading")
+        for node_id in stale:
+            path, content_hash = uploads[node_id]
+            upload_index.invalidate(connection.server_address, content_hash)
+            prompt[node_id]["inputs"]["image"] = upload_index.ensure_uploaded(connection, path, content_hash)
+        return generate_images_ws(connection, prompt, **kwargs)
+
+def _ensure_preprocessed(pool, preset, input_path, input_hash, slot):
+    """
+    Return the cached depth map, segmentation image and mask for an input,
+    running the preprocessing branch of the style's workflow once if needed.
+    ``slot`` is a context manager factory for a scheduler slot.
+    """
+    cache = get_preprocess_cache()
+    version = preset.preprocess_version
+    maps = cache.get(version, input_hash)
+    record_cache_lookup("preprocess", hit=bool(maps))
+    if maps:
+        return maps
+    
+    try:
+        with cache.lock(version, input_hash):
+            maps = cache.get(version, input_hash)
+            if maps:
+                return maps
+            
+            workflow = build_preprocess_workflow(preset.workflow)
+            with slot(), pool.lease() as backend:
+                images = _generate_on_backend(
+                    backend, workflow, {INPUT_NODE: (input_path, input_hash)},
+                    output_nodes=list(PREPROCESS_OUTPUTS.values())
+                )
+            missing = [node for node in PREPROCESS_OUTPUTS.values() if not images.get(node)]
+            if missing:
+                raise RuntimeError(f"Preprocessing produced no output for nodes {missing}")
+            
+            print(f"🗺️ Cached depth/segmentation maps for input {input_hash[:12]}")
+            return cache.put(version, input_hash, {
+                name: images[node][0] for name, node in PREPROCESS_OUTPUTS.items()
+            })
+    finally:
+        # Failed or interrupted runs must not leave their lock behind either
+        cache.drop_lock(version, input_hash)
+
+def _uses_preprocess_cache(preset, preprocess_cache=None):
+    if preprocess_cache is None:
+        preprocess_cache = COMFY_PREPROCESS_CACHE
+    return preprocess_cache and preset.supports_preprocess
+
+def _cache_params(preset, quality, preprocess_cache, variation="full", base_seed=None, refine_denoise=None):
+    """Result cache key parameters besides the input, style, workflow version and seed"""
+    cache_params = {
+        "prompt": preset.prompt,
+        "negative_prompt": preset.negative_prompt,
+        "ckpt_name": preset.ckpt_name,
+        "preprocess": preset.preprocess_version if preprocess_cache else None
+    }
+    if quality != DEFAULT_QUALITY_TIER:
+        cache_params["quality"] = quality
+    if variation == "refine":
+        cache_params["variation"] = {"mode": variation, "base_seed": base_seed, "denoise": refine_denoise}
+    return cache_params
+
+def count_uncached_variants(input_hash, num_images, style="scandinavian", seed=None, preprocess_cache=None,
+                            variation="full", refine_denoise=None, quality=DEFAULT_QUALITY_TIER):
+    """
+    Number of the requested variants that ComfyUI would have to render, i.e.
+    that the result cache cannot serve. Only seeded requests are cached.
+    Uses the same keys as empty_2_furnished, without counting as lookups.
+    """
+    preset = style_registry.get(style)
+    if seed is None or preset is None:
+        return num_images
+    cache_params = _cache_params(
+        preset, quality, _uses_preprocess_cache(preset, preprocess_cache), variation, seed, refine_denoise
+    )
+    result_cache = get_result_cache()
+    # Variant i uses seed + i in both variation modes
+    return sum(
+        1 for i in range(num_images)
+        if not result_cache.contains(
+            result_cache.make_key(input_hash, style, preset.workflow_version, seed + i, cache_params)
+        )
+    )
+
+def empty_2_furnished(input_path, num_images, style="scandinavian", progress_callback=None, inline_images=False,
+                      websocket_output=None, input_hash=None, seed=None, preprocess_cache=None,
+                      api_key_id=None, role="user", cancel_event=None, variation="full", refine_denoise=None,
+                      quality=DEFAULT_QUALITY_TIER):
     """
     Generate furnished room images from empty room input
     
     Args:
         input_path (str): Path to input image file
         num_images (int): Number of images to generate
-        style (str): Style of furnishing (default: scandinavian)
+        style (str): Style preset name from the style registry (default: scandinavian)
+        progress_callback (callable): Optional; receives a dict per ComfyUI
+            progress event (variant, current node, sampler step, queue size)
+        inline_images (bool): Also return each image as a base64 data URL
+            (off by default; callers normally serve ``file_path``)
+        websocket_output (bool): Receive the final image as a websocket frame
+            instead of via /history + /view (default: COMFY_WS_OUTPUT)
+        input_hash (str): SHA-256 of the input file, if already known
+        seed (int): Optional base seed; variant i uses seed + i. Without it
+            seeds are random. Identical (input, style, seed) requests are
+            served from the result cache.
+        preprocess_cache (bool): Run depth estimation and segmentation once
+            per input image and load the cached maps in every variant
+            (default: COMFY_PREPROCESS_CACHE)
+        api_key_id (str): Requesting key; variants are interleaved fairly
+            across keys by the scheduler
+        role (str): Role of the requesting key, which sets its scheduling weight
+        cancel_event (threading.Event): Set it to stop the generation; the
+            running prompt is dequeued/interrupted and no further variants
+            are dispatched (a shared preprocessing run is left to finish)
+        variation (str): "full" (default) renders every variant from scratch;
+            "refine" keeps the composition of the first variant and varies
+            only the refine pass's seed, so ComfyUI reuses the cached
+            inpaint and upscale outputs for the remaining variants
+        refine_denoise (float): Denoise of the refine pass in "refine" mode
+            (default: the workflow's); higher values vary more
+        quality (str): Quality tier ("draft", "standard", "final"); draft
+            uses fewer steps and skips the upscale and refine passes
     
     Returns:
         dict: Response with status and results
     """
-    workflow_file = os.path.join(os.path.dirname(__file__), "..", "..", "joger.json")
-    prompt_text = "A modern minimal living room, clean design, photorealistic"
-    negative_prompt_text = "lowres, blurry, distorted, cartoonish"
-    ckpt_name = "juggernaut_reborn.safetensors"
-    
-    # Style-specific prompts
-    if style == "scandinavian":
-        prompt_text = "Scandinavian living room, modern, minimalistic, bright, cozy, clean lines, natural materials, wood, white walls, large windows, plants, soft lighting"
+    preset = style_registry.get(style)
+    if preset is None:
+        return {
+            "status": "error",
+            "message": f"Unknown style '{style}'",
+            "results": []
+        }
+    if variation not in VARIATION_MODES:
+        return {"status": "error", "message": f"Unknown variation mode '{variation}'", "results": []}
+    if quality not in preset.quality_tiers:
+        return {"status": "error", "message": f"Style '{style}' has no '{quality}' quality tier", "results": []}
+    refine_only = variation == "refine"
+    if refine_only and not preset.supports_refine_variation:
+        return {
+            "status": "error",
+            "message": f"Style '{style}' does not support refinement-only variations",
+            "results": []
+        }
+    base_prompt = preset.workflow
+    prompt_text = preset.prompt
+    negative_prompt_text = preset.negative_prompt
+    ckpt_name = preset.ckpt_name
+
+    # Anything that changes the rendered pixels must be part of the cache key
+    workflow_version = preset.workflow_version
+    preprocess_cache = _uses_preprocess_cache(preset, preprocess_cache)
+    base_seed = None
+    if refine_only:
+        # Every variant shares the composition rendered with the base seed
+        base_seed = seed if seed is not None else random.randint(1000000, 9999999)
+    cache_params = _cache_params(preset, quality, preprocess_cache, variation, base_seed, refine_denoise)
     
-    # Load workflow
-    try:
-        with open(workflow_file, "r", encoding="utf-8") as f:
-            base_prompt = json.load(f)
-    except Exception as e:
+    # Variants are built from this template; the untouched workflow is kept for preprocessing
+    variant_prompt = apply_quality_tier(copy.deepcopy(base_prompt), quality, OUTPUT_NODE)
+    if refine_only and REFINE_SAMPLER_NODE not in variant_prompt:
         return {
             "status": "error",
-            "message": f"Failed to load workflow {workflow_file}: {e}",
+            "message": f"The '{quality}' quality tier has no refine pass to vary",
             "results": []
         }
+    tier_cost = QUALITY_TIERS[quality]["cost"]
+    if websocket_output is None:
+        websocket_output = COMFY_WS_OUTPUT
+    if websocket_output:
+        use_websocket_output(variant_prompt, OUTPUT_NODE)
+    if preprocess_cache:
+        use_preprocessed_maps(variant_prompt)
+    # Swapping in cached maps orphans the depth/segmentation model loaders
+    variant_prompt = prune_to_outputs(variant_prompt, [OUTPUT_NODE])
 
     results = []
 
     try:
-        # Open WebSocket connection to ComfyUI
-        ws = websocket.WebSocket()
-        ws.connect(f"ws://{SERVER_ADDRESS}/ws?clientId={CLIENT_ID}")
+        # Inputs are uploaded to ComfyUI under their content hash
+        if input_hash is None:
+            input_hash = file_sha256(input_path)
+        
+        result_cache = get_result_cache()
+        pool = None
+        scheduler = get_scheduler()
+        scheduler_key = str(api_key_id) if api_key_id is not None else "anonymous"
+        slot = lambda cost=1.0: scheduler.slot(scheduler_key, role, cost, cancel_event=cancel_event)
+        uploads = {INPUT_NODE: (input_path, input_hash)}
+        # Refine-only variants stay on the backend whose node cache holds the first pass
+        affinity = None
         
         # Generate multiple images
         for i in range(num_images):
-            prompt = copy.deepcopy(base_prompt)
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelled("Generation cancelled")
+            # Client seeds make variants reproducible; otherwise pick a random one
+            if refine_only:
+                seed_val = base_seed + i
+            else:
+                seed_val = seed + i if seed is not None else random.randint(1000000, 9999999)
+            cache_key = result_cache.make_key(input_hash, style, workflow_version, seed_val, cache_params)
+            cached = result_cache.get(cache_key)
+            if cached:
+                result = {
+                    "style": style,
+                    "seed": seed_val,
+                    "file_path": cached["file_path"],
+                    "filename": os.path.basename(cached["file_path"]),
+                    "index": i + 1,
+                    "cached": True
+                }
+                if inline_images:
+                    with open(cached["file_path"], "rb") as f:
+                        img_b64 = base64.b64encode(f.read()).decode("utf-8")
+                    result["image"] = f"data:image/png;base64,{img_b64}"
+                if refine_only:
+                    result["base_seed"] = base_seed
+                results.append(result)
+                if progress_callback is not None:
+                    progress_callback({"event": "variant_done", "variant": i + 1, "num_variants": num_images, "cached": True})
+                continue
+            
+            # Dispatch each variant to the least-loaded healthy backend
+            if pool is None:
+                pool = get_backend_pool()
+                if preprocess_cache:
+                    if progress_callback is not None:
+                        progress_callback({"event": "preprocessing", "variant": i + 1, "num_variants": num_images})
+                    maps = _ensure_preprocessed(pool, preset, input_path, input_hash, slot)
+                    for name, node_id in PREPROCESSED_MAP_NODES.items():
+                        uploads[node_id] = (maps[name]["path"], maps[name]["hash"])
+            
+            prompt = copy.deepcopy(variant_prompt)
             
             # Configure prompt parameters
-            if "9" in prompt:
-                prompt["9"]["inputs"]["image"] = input_path
             if "32" in prompt:
                 prompt["32"]["inputs"]["value"] = prompt_text
             if "33" in prompt and negative_prompt_text:
@@ -114,45 +571,76 @@ def empty_2_furnished(input_path, num_images, style="scandinavian"):
                 prompt["3"]["inputs"]["ckpt_name"] = ckpt_name
             if "38" in prompt:
                 prompt["38"]["inputs"]["ckpt_name"] = ckpt_name
+            if refine_only:
+                use_refine_variation(prompt, seed_val, refine_denoise)
 
-            # Generate random seed for variation
-            seed_val = random.randint(1000000, 9999999)
-            
             # Generate image
-            images = generate_images_ws(ws, prompt, seed=seed_val)
+            on_event = None
+            if progress_callback is not None:
+                on_event = lambda message, i=i, prompt=prompt: progress_callback(
+                    _progress_event(message, prompt, i + 1, num_images)
+                )
+            
+            # Wait for a fair-share slot, then dispatch to the least-loaded healthy backend
+            cost = tier_cost * (REFINE_VARIANT_COST if refine_only and affinity is not None else 1.0)
+            with slot(cost), pool.lease(prefer=affinity) as backend:
+                images = _generate_on_backend(
+                    backend, prompt, uploads, seed=base_seed if refine_only else seed_val, on_event=on_event,
+                    output_nodes=[OUTPUT_NODE],
+                    ws_output_node=OUTPUT_NODE if websocket_output else None,
+                    cancel_event=cancel_event
+                )
+            if refine_only:
+                affinity = backend
 
-            if "159" in images and images["159"]:
-                image_data = images["159"][0]
-                image = Image.open(io.BytesIO(image_data))
+            if not images.get(OUTPUT_NODE):
+                # Never report success with fewer images than were asked (and charged) for
+                raise RuntimeError(f"ComfyUI returned no output image for variant {i + 1}")
+            image_data = images[OUTPUT_NODE][0]
 
-                # Save generated image
-                os.makedirs("generated", exist_ok=True)
-                filename = f"generated_{uuid.uuid4().hex}.png"
-                save_path = os.path.join("generated", filename)
-                image.save(save_path, format="PNG")
+            # Store the PNG bytes exactly as ComfyUI produced them (no decode/re-encode)
+            with stage_timer("image_save"):
+                stored = get_output_store().put(image_data)
+            result_cache.put(cache_key, stored["path"], seed_val)
 
-                # Convert to base64 for response
-                buf = io.BytesIO()
-                image.save(buf, format="PNG")
-                img_b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
+            result = {
+                "style": style,
+                "seed": seed_val,
+                "file_path": stored["path"],
+                "filename": stored["filename"],
+                "index": i + 1,
+                "cached": False
+            }
+            if refine_only:
+                result["base_seed"] = base_seed
+            if inline_images:
+                img_b64 = base64.b64encode(image_data).decode("utf-8")
+                result["image"] = f"data:image/png;base64,{img_b64}"
+            results.append(result)
 
-                results.append({
-                    "image": f"data:image/png;base64,{img_b64}",
-                    "style": style,
-                    "seed": seed_val,
-                    "file_path": save_path,
-                    "filename": filename,
-                    "index": i + 1
-                })
+            if progress_callback is not None:
+                progress_callback({"event": "variant_done", "variant": i + 1, "num_variants": num_images, "cached": False})
 
-        ws.close()
-        
         return {
             "status": "success",
             "message": f"Successfully generated {len(results)} images",
             "results": results
         }
         
+    except (GenerationCancelled, SchedulingCancelled) as e:
+        if isinstance(e, PromptInterrupted) and not (cancel_event is not None and cancel_event.is_set()):
+            # Interrupted behind our back; the caller is still waiting for its images
+            return {
+                "status": "error",
+                "message": f"Error during image generation: {str(e)}",
+                "results": []
+            }
+        print(f"🛑 Generation cancelled after {len(results)} of {num_images} variants")
+        return {
+            "status": "cancelled",
+            "message": "Generation cancelled",
+            "results": results
+        }
     except Exception as e:
         return {
             "status": "error", 
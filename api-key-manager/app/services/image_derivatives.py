@@ -0,0 +1,112 @@
+"""
+Image Derivatives
+Resized and re-encoded variants of generated images, rendered on first request and cached on disk
+"""
+import os
+import threading
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+from PIL import Image
+
+# Longest edge of each derivative size ("full" keeps the original dimensions)
+DERIVATIVE_SIZES = {
+    "thumbnail": 320,
+    "preview": 1024,
+    "full": None,
+}
+
+# format name -> (PIL format, media type, extension)
+OUTPUT_FORMATS = {
+    "png": ("PNG", "image/png", ".png"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+}
+FORMAT_ALIASES = {"jpg": "jpeg"}
+
+DEFAULT_QUALITY = 85
+
+
+class DerivativeError(ValueError):
+    """Raised for an unknown size/format or an out-of-range quality"""
+
+
+def parse_variant(size: str, image_format: str, quality: int) -> Tuple[str, str, int]:
+    """Validate and normalize request parameters"""
+    size = (size or "full").lower()
+    image_format = (image_format or "png").lower()
+    image_format = FORMAT_ALIASES.get(image_format, image_format)
+    if size not in DERIVATIVE_SIZES:
+        raise DerivativeError(f"Unknown size '{size}'. Available sizes: {list(DERIVATIVE_SIZES)}")
+    if image_format not in OUTPUT_FORMATS:
+        raise DerivativeError(f"Unknown format '{image_format}'. Available formats: {list(OUTPUT_FORMATS)}")
+    if not 1 <= quality <= 100:
+        raise DerivativeError("Quality must be between 1 and 100")
+    return size, image_format, quality
+
+
+def variant_name(size: str, image_format: str, quality: int) -> str:
+    """File name of a derivative; PNG is lossless so its name carries no quality"""
+    extension = OUTPUT_FORMATS[image_format][2]
+    if image_format == "png":
+        return f"{size}{extension}"
+    return f"{size}-q{quality}{extension}"
+
+
+def render_derivative(source_path: str, destination_path: str, size: str, image_format: str, quality: int):
+    pil_format = OUTPUT_FORMATS[image_format][0]
+    with Image.open(source_path) as image:
+        image.load()
+        max_edge = DERIVATIVE_SIZES[size]
+        if max_edge is not None:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if pil_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+
+        options = {}
+        if pil_format in ("JPEG", "WEBP"):
+            options["quality"] = quality
+        if pil_format == "JPEG":
+            options["optimize"] = True
+            options["progressive"] = True
+        if pil_format == "WEBP":
+            options["method"] = 4
+
+        temp_path = f"{destination_path}.{uuid.uuid4().hex}.tmp"
+        image.save(temp_path, format=pil_format, **options)
+    os.replace(temp_path, destination_path)
+
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def get_derivative(source_path: str, size: str, image_format: str, quality: int,
+                   on_render: Optional[Callable[[str, int], None]] = None) -> Tuple[str, str, str]:
+    """
+    Return ``(path, media_type, variant)`` for a derivative of ``source_path``,
+    rendering it on first use. Derivatives live next to their source in
+    ``<source>.d/`` so they are deleted together with it. The full-size PNG
+    is the source itself. ``on_render(source_path, size_bytes)`` is called
+    after a derivative is rendered, so its owner can account for the space.
+    """
+    media_type = OUTPUT_FORMATS[image_format][1]
+    variant = variant_name(size, image_format, quality)
+    if size == "full" and image_format == "png":
+        return source_path, media_type, variant
+
+    path = os.path.join(f"{source_path}.d", variant)
+    if os.path.exists(path):
+        return path, media_type, variant
+
+    with _locks_lock:
+        lock = _locks.setdefault(path, threading.Lock())
+    with lock:
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            render_derivative(source_path, path, size, image_format, quality)
+            if on_render is not None:
+                on_render(source_path, os.path.getsize(path))
+    with _locks_lock:
+        _locks.pop(path, None)
+    return path, media_type, variant
@@ -0,0 +1,119 @@
+"""
+Input Normalization
+Decodes, validates and downscales uploaded room photos before they reach ComfyUI
+"""
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+# Size of the process pool that decodes/resizes uploads
+NORMALIZE_WORKERS = int(os.getenv("NORMALIZE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# SDXL training buckets, as picked by CM_NearestSDXLResolution (node 262)
+SDXL_BUCKETS = [
+    (1024, 1024),
+    (1152, 896), (896, 1152),
+    (1216, 832), (832, 1216),
+    (1344, 768), (768, 1344),
+    (1536, 640), (640, 1536),
+]
+
+EXIF_ORIENTATION = 0x0112
+# EXIF orientations that rotate the image by 90/270 degrees
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class InvalidImageError(Exception):
+    """Raised when an upload cannot be decoded as an image"""
+
+
+def nearest_sdxl_bucket(width: int, height: int) -> Tuple[int, int]:
+    """Return the SDXL bucket whose aspect ratio is closest to width/height"""
+    aspect = width / height
+    return min(SDXL_BUCKETS, key=lambda bucket: abs(bucket[0] / bucket[1] - aspect))
+
+
+def target_size(width: int, height: int) -> Tuple[int, int]:
+    """Largest size with the same aspect ratio that fits the nearest bucket (never upscales)"""
+    bucket_width, bucket_height = nearest_sdxl_bucket(width, height)
+    scale = min(bucket_width / width, bucket_height / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def normalize_image_file(source_path: str, destination_path: str) -> Dict:
+    """
+    Decode an upload, apply its EXIF orientation and downscale it to fit the
+    nearest SDXL bucket, writing a PNG to ``destination_path``.
+
+    JPEGs are decoded in draft mode at the smallest DCT scale that still
+    covers the target size, so a 40 MP photo is never fully decoded.
+    Runs inside the process pool; returns size info and the output's SHA-256.
+    """
+    try:
+        with Image.open(source_path) as image:
+            original_size = image.size
+            source_format = image.format
+            orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+            oriented = original_size[::-1] if orientation in TRANSPOSED_ORIENTATIONS else original_size
+            width, height = target_size(*oriented)
+
+            # draft() works in stored (un-rotated) coordinates
+            draft_size = (height, width) if orientation in TRANSPOSED_ORIENTATIONS else (width, height)
+            image.draft("RGB", draft_size)
+            image.load()
+
+            image = ImageOps.exif_transpose(image)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            if image.size != (width, height):
+                image = image.resize((width, height), Image.LANCZOS)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        print(f"⚠️ Rejected upload {os.path.basename(source_path)}: {e}")
+        raise InvalidImageError("Invalid or corrupt image")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    data = buffer.getvalue()
+    with open(destination_path, "wb") as f:
+        f.write(data)
+
+    return {
+        "path": destination_path,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "original_size": list(original_size),
+        "original_format": source_format,
+        "size": [width, height],
+    }
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_normalization_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # By now the process runs websocket, probe and job worker threads; forking
+        # it could hand a child a lock held by one of them, so start clean workers
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(max_workers=NORMALIZE_WORKERS,
+                                    mp_context=multiprocessing.get_context(start_method))
+    return _pool
+
+
+def shutdown_normalization_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
+
+
+async def normalize_upload(source_path: str, destination_path: str) -> Dict:
+    """Normalize an upload in the process pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_normalization_pool(), normalize_image_file, source_path, destination_path)
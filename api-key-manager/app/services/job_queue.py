@@ -0,0 +1,305 @@
+"""
+Generation Job Queue
+Durable SQLite-backed queue of generation jobs served by a pool of dispatcher threads
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from app.database.models import DatabaseManager
+
+# Number of dispatcher threads pulling jobs from the queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Idle workers re-check the table this often (seconds) for jobs queued by other processes
+POLL_INTERVAL = 2.0
+
+# Running jobs refresh their heartbeat this often; jobs silent for STALE_AFTER are requeued
+HEARTBEAT_INTERVAL = 15.0
+STALE_AFTER = timedelta(seconds=90)
+
+# Running jobs write their latest progress event to the jobs table at most this often,
+# for progress streams served by other processes
+PROGRESS_WRITE_INTERVAL = 1.0
+
+# A job that keeps getting orphaned (e.g. crashes the process) is failed after this many attempts
+MAX_ATTEMPTS = 3
+
+JOB_COLUMNS = (
+    "id", "api_key_id", "status", "input_path", "original_filename", "style",
+    "num_images", "params", "result", "error_message", "attempts", "worker_id",
+    "created_at", "started_at", "heartbeat_at", "finished_at", "progress",
+)
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+# Claim order of queued jobs (alias j): keys with the fewest running jobs first, then by age
+CLAIM_ORDER = '''
+    ORDER BY (
+        SELECT COUNT(*) FROM generation_jobs r
+        WHERE r.api_key_id IS j.api_key_id AND r.status = 'running'
+    ), j.created_at
+'''
+
+
+class JobQueue:
+    """
+    Persistent job queue.
+
+    ``submit()`` inserts a row and returns immediately; dispatcher threads
+    claim queued rows one at a time and run ``handler(job)``, storing its
+    return value as the job result. Jobs that were running when a process
+    died are picked up again once their heartbeat goes stale.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, handler: Callable[[Dict], Dict], num_workers: int = JOB_WORKERS):
+        self.db_manager = db_manager
+        self.handler = handler
+        self.num_workers = num_workers
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        # Running jobs of this process -> their cancel events
+        self._running_jobs: Dict[str, threading.Event] = {}
+        # Running jobs of this process -> when their progress was last written
+        self._progress_written: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self.requeue_stale_jobs()
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._worker_loop, args=(f"{self.worker_prefix}:{i}",),
+                                      name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        print(f"🧵 Started {self.num_workers} generation job workers")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    # ------------------------------------------------------------------
+    # Producer API
+    # ------------------------------------------------------------------
+    def submit(self, api_key_id: Optional[int], input_path: str, style: str, num_images: int,
+               original_filename: Optional[str] = None, params: Optional[Dict] = None,
+               job_id: Optional[str] = None) -> str:
+        """Persist a new job and wake a worker; returns the job id"""
+        job_id = job_id or uuid.uuid4().hex
+        query = '''
+            INSERT INTO generation_jobs (
+                id, api_key_id, status, input_path, original_filename, style,
+                num_images, params, created_at
+            ) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?)
+        '''
+        self.db_manager.execute_insert(query, (
+            job_id, api_key_id, input_path, original_filename, style, num_images,
+            json.dumps(params or {}), datetime.now().isoformat()
+        ))
+        self._wakeup.set()
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        query = f"SELECT {', '.join(JOB_COLUMNS)} FROM generation_jobs WHERE id = ?"
+        results = self.db_manager.execute_query(query, (job_id,))
+        if not results:
+            return None
+        return self._row_to_job(results[0])
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """
+        Number of queued jobs that would be claimed before this one (None
+        once it has left the queue). Uses the same order as the workers, so
+        it can move back as well as forward while other keys' jobs start
+        and finish.
+        """
+        results = self.db_manager.execute_query(
+            f"SELECT j.id FROM generation_jobs j WHERE j.status = 'queued' {CLAIM_ORDER}"
+        )
+        queued = [row[0] for row in results]
+        return queued.index(job_id) if job_id in queued else None
+
+    def record_progress(self, job_id: str, event: Dict):
+        """
+        Store a running job's latest progress event, at most once per
+        PROGRESS_WRITE_INTERVAL, so clients of other processes can follow it
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._progress_written.get(job_id, float("-inf")) < PROGRESS_WRITE_INTERVAL:
+                return
+            self._progress_written[job_id] = now
+        self.db_manager.execute_update(
+            "UPDATE generation_jobs SET progress = ? WHERE id = ? AND status = 'running'",
+            (json.dumps(event), job_id)
+        )
+
+    def status_counts(self) -> Dict[str, int]:
+        """Number of queued and running jobs across all processes"""
+        results = self.db_manager.execute_query('''
+            SELECT status, COUNT(*) FROM generation_jobs
+            WHERE status IN ('queued', 'running')
+            GROUP BY status
+        ''')
+        counts = {"queued": 0, "running": 0}
+        counts.update(dict(results))
+        return counts
+
+    def backlog(self) -> Dict[str, int]:
+        """Variants of queued and running jobs, per API key"""
+        results = self.db_manager.execute_query('''
+            SELECT api_key_id, SUM(num_images) FROM generation_jobs
+            WHERE status IN ('queued', 'running')
+            GROUP BY api_key_id
+        ''')
+        return {str(api_key_id): variants for api_key_id, variants in results}
+
+    # ------------------------------------------------------------------
+    # Worker internals
+    # ------------------------------------------------------------------
+    def _claim_next(self, worker_id: str) -> Optional[Dict]:
+        """
+        Atomically move the next queued job to 'running' for this worker.
+        Keys with the fewest running jobs go first so one key's backlog
+        cannot occupy every worker; ties are broken by age.
+        """
+        while True:
+            results = self.db_manager.execute_query(
+                f"SELECT j.id FROM generation_jobs j WHERE j.status = 'queued' {CLAIM_ORDER} LIMIT 1"
+            )
+            if not results:
+                return None
+            job_id = results[0][0]
+            now = datetime.now().isoformat()
+            claimed = self.db_manager.execute_update('''
+                UPDATE generation_jobs
+                SET status = 'running', worker_id = ?, started_at = ?, heartbeat_at = ?,
+                    attempts = attempts + 1, progress = NULL
+                WHERE id = ? AND status = 'queued'
+            ''', (worker_id, now, now, job_id))
+            if claimed:
+                return self.get_job(job_id)
+            # Another worker won the race; try the next one
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict] = None, error_message: Optional[str] = None):
+        self.db_manager.execute_update('''
+            UPDATE generation_jobs
+            SET status = ?, result = ?, error_message = ?, finished_at = ?
+            WHERE id = ? AND status = 'running'
+        ''', (status, json.dumps(result) if result is not None else None, error_message,
+              datetime.now().isoformat(), job_id))
+
+    def _worker_loop(self, worker_id: str):
+        while not self._stop.is_set():
+            job = self._claim_next(worker_id)
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            # Handlers stop early once the job's cancel event is set
+            job["cancel_event"] = threading.Event()
+            with self._lock:
+                self._running_jobs[job["id"]] = job["cancel_event"]
+            try:
+                result = self.handler(job)
+                self._finish(job["id"], "succeeded", result=result)
+            except Exception as e:
+                if job["cancel_event"].is_set():
+                    print(f"🛑 Generation job {job['id']} cancelled")
+                else:
+                    print(f"❌ Generation job {job['id']} failed: {e}")
+                    self._finish(job["id"], "failed", error_message=str(e))
+            finally:
+                with self._lock:
+                    self._running_jobs.pop(job["id"], None)
+                    self._progress_written.pop(job["id"], None)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            with self._lock:
+                job_ids = list(self._running_jobs)
+            now = datetime.now().isoformat()
+            for job_id in job_ids:
+                updated = self.db_manager.execute_update(
+                    "UPDATE generation_jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                    (now, job_id)
+                )
+                if not updated:
+                    # Cancelled through another process
+                    self._signal_cancel(job_id)
+            self.requeue_stale_jobs()
+
+    def _signal_cancel(self, job_id: str):
+        with self._lock:
+            cancel_event = self._running_jobs.get(job_id)
+        if cancel_event is not None:
+            cancel_event.set()
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """
+        Cancel a queued or running job. A running job in this process is
+        signalled immediately; one running in another process notices at
+        its next heartbeat. Returns the status the job was cancelled from
+        ('queued' or 'running'), or None if it had already finished.
+        """
+        conn = self.db_manager.get_connection()
+        try:
+            # Read and replace the status in one write transaction so a worker cannot claim it in between
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT status FROM generation_jobs WHERE id = ?", (job_id,)).fetchone()
+            previous = row[0] if row and row[0] in ("queued", "running") else None
+            if previous is not None:
+                conn.execute('''
+                    UPDATE generation_jobs
+                    SET status = 'cancelled', error_message = 'Cancelled by client', finished_at = ?
+                    WHERE id = ?
+                ''', (datetime.now().isoformat(), job_id))
+            conn.commit()
+        finally:
+            conn.close()
+        if previous is not None:
+            self._signal_cancel(job_id)
+        return previous
+
+    def requeue_stale_jobs(self):
+        """Return orphaned running jobs to the queue (or fail them after MAX_ATTEMPTS)"""
+        cutoff = (datetime.now() - STALE_AFTER).isoformat()
+        self.db_manager.execute_update('''
+            UPDATE generation_jobs
+            SET status = 'failed', error_message = 'Job abandoned too many times', finished_at = ?
+            WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?
+        ''', (datetime.now().isoformat(), cutoff, MAX_ATTEMPTS))
+        requeued = self.db_manager.execute_update('''
+            UPDATE generation_jobs
+            SET status = 'queued', worker_id = NULL
+            WHERE status = 'running' AND heartbeat_at < ?
+        ''', (cutoff,))
+        if requeued:
+            print(f"🔁 Requeued {requeued} stale generation jobs")
+            self._wakeup.set()
+
+    def _row_to_job(self, row: tuple) -> Dict:
+        job = dict(zip(JOB_COLUMNS, row))
+        job["params"] = json.loads(job["params"]) if job["params"] else {}
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["progress"] = json.loads(job["progress"]) if job["progress"] else None
+        return job
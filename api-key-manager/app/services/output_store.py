@@ -0,0 +1,192 @@
+"""
+Output Store
+Content-addressed, sharded storage for generated images with TTL and size-based eviction
+"""
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from app.database.models import DatabaseManager
+
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "generated")
+# Outputs not accessed for this long are deleted
+OUTPUT_TTL_DAYS = float(os.getenv("OUTPUT_TTL_DAYS", "30"))
+# Total size budget; least recently accessed outputs are deleted first
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_BYTES", str(50 * 1024 ** 3)))
+
+# Seconds between eviction sweeps triggered by put()
+EVICT_INTERVAL = 60
+# Seconds between last_access updates for the same output
+ACCESS_UPDATE_INTERVAL = 300
+
+OUTPUT_FILENAME = re.compile(r"^([0-9a-f]{64})\.png$")
+
+
+class OutputStore:
+    """
+    Generated images stored under their SHA-256 in ``<root>/<h[:2]>/<h[2:4]>/<h>.png``.
+
+    The ``output_store`` table indexes every file with its size, the size
+    of its derivatives (``<h>.png.d/``) and last access time. Sweeps delete
+    outputs idle for longer than the TTL, then the least recently accessed
+    ones until the byte budget, derivatives included, is met. Writes and
+    deletes hold ``_files_lock`` so a sweep cannot remove an output while it
+    is being stored or a derivative of it is being recorded. Files from
+    before the store (flat ``generated_<uuid>.png``) are still served but
+    are not indexed or evicted.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, root: str = OUTPUT_DIR,
+                 ttl_days: float = OUTPUT_TTL_DAYS, max_bytes: int = OUTPUT_MAX_BYTES):
+        self.db_manager = db_manager
+        self.root = root
+        self.ttl_days = ttl_days
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._files_lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self._last_sweep = 0.0
+        self.evictions = 0
+
+    def _path(self, content_hash: str) -> str:
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], f"{content_hash}.png")
+
+    def put(self, data: bytes) -> Dict:
+        """Store image bytes (idempotent) and return ``{"content_hash", "path", "filename"}``"""
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self._path(content_hash)
+        with self._files_lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+
+            now = datetime.now().isoformat()
+            self.db_manager.execute_update('''
+                INSERT OR IGNORE INTO output_store (content_hash, rel_path, size_bytes, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (content_hash, os.path.relpath(path, self.root), len(data), now, now))
+            self.db_manager.execute_update(
+                "UPDATE output_store SET last_access = ? WHERE content_hash = ?", (now, content_hash)
+            )
+
+        if time.monotonic() - self._last_sweep >= EVICT_INTERVAL:
+            self.evict()
+        return {"content_hash": content_hash, "path": path, "filename": os.path.basename(path)}
+
+    def resolve(self, filename: str) -> Optional[str]:
+        """Map a public output filename to its file on disk, or None"""
+        match = OUTPUT_FILENAME.match(filename)
+        if match is None:
+            # Legacy flat files; refuse anything that could escape the root
+            if os.path.basename(filename) != filename or filename.startswith("."):
+                return None
+            path = os.path.join(self.root, filename)
+            return path if os.path.isfile(path) else None
+
+        content_hash = match.group(1)
+        path = self._path(content_hash)
+        if not os.path.exists(path):
+            return None
+        self._touch(content_hash)
+        return path
+
+    def record_derivative(self, source_path: str, size_bytes: int):
+        """
+        Count a newly rendered derivative of ``source_path`` against the byte
+        budget. If a sweep deleted the output while the derivative was being
+        rendered, the re-created ``.d`` directory is removed instead.
+        """
+        match = OUTPUT_FILENAME.match(os.path.basename(source_path))
+        if match is None:
+            # Legacy flat files are not indexed
+            return
+        with self._files_lock:
+            if not os.path.exists(source_path):
+                shutil.rmtree(f"{source_path}.d", ignore_errors=True)
+                return
+            self.db_manager.execute_update(
+                "UPDATE output_store SET derivative_bytes = derivative_bytes + ? WHERE content_hash = ?",
+                (size_bytes, match.group(1))
+            )
+
+    def _touch(self, content_hash: str):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._touched.get(content_hash, 0) < ACCESS_UPDATE_INTERVAL:
+                return
+            self._touched[content_hash] = now
+        self.db_manager.execute_update(
+            "UPDATE output_store SET last_access = ? WHERE content_hash = ?",
+            (datetime.now().isoformat(), content_hash)
+        )
+
+    def _delete(self, rows):
+        for content_hash, rel_path in rows:
+            path = os.path.join(self.root, rel_path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            # Thumbnails and other derivatives live next to the output
+            shutil.rmtree(f"{path}.d", ignore_errors=True)
+        conn = self.db_manager.get_connection()
+        try:
+            conn.executemany("DELETE FROM output_store WHERE content_hash = ?", [(row[0],) for row in rows])
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            for content_hash, _ in rows:
+                self._touched.pop(content_hash, None)
+            self.evictions += len(rows)
+
+    def evict(self):
+        """Delete expired outputs, then least recently accessed ones until under the byte budget"""
+        self._last_sweep = time.monotonic()
+        with self._files_lock:
+            cutoff = (datetime.now() - timedelta(days=self.ttl_days)).isoformat()
+            expired = self.db_manager.execute_query(
+                "SELECT content_hash, rel_path FROM output_store WHERE last_access < ?", (cutoff,)
+            )
+            if expired:
+                self._delete(expired)
+
+            total_bytes = self.db_manager.execute_query(
+                "SELECT COALESCE(SUM(size_bytes + derivative_bytes), 0) FROM output_store"
+            )[0][0]
+            while total_bytes > self.max_bytes:
+                rows = self.db_manager.execute_query('''
+                    SELECT content_hash, rel_path, size_bytes + derivative_bytes FROM output_store
+                    ORDER BY last_access ASC LIMIT 500
+                ''')
+                if not rows:
+                    break
+                doomed = []
+                for content_hash, rel_path, size_bytes in rows:
+                    if total_bytes <= self.max_bytes:
+                        break
+                    doomed.append((content_hash, rel_path))
+                    total_bytes -= size_bytes
+                self._delete(doomed)
+
+    def stats(self) -> Dict:
+        count, total_bytes, derivative_bytes = self.db_manager.execute_query(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(derivative_bytes), 0) FROM output_store"
+        )[0]
+        return {
+            "outputs": count,
+            "bytes": total_bytes + derivative_bytes,
+            "derivative_bytes": derivative_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_days": self.ttl_days,
+            "evictions": self.evictions,
+        }
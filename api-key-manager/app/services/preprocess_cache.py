@@ -0,0 +1,189 @@
+"""
+Preprocessing Cache
+Stores depth maps and segmentation masks computed once per input image
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from app.database.models import DatabaseManager
+
+PREPROCESS_DIR = os.getenv("PREPROCESS_DIR", "preprocessed")
+# Maps not used for this long are deleted
+PREPROCESS_TTL_DAYS = float(os.getenv("PREPROCESS_TTL_DAYS", "30"))
+# Total size budget; least recently used maps are deleted first
+PREPROCESS_MAX_BYTES = int(os.getenv("PREPROCESS_MAX_BYTES", str(5 * 1024 ** 3)))
+
+MANIFEST_NAME = "maps.json"
+
+# Seconds between eviction sweeps triggered by put()
+EVICT_INTERVAL = 60
+# Seconds between last_access updates for the same entry
+ACCESS_UPDATE_INTERVAL = 300
+
+
+class PreprocessCache:
+    """
+    On-disk cache of preprocessing outputs.
+
+    Maps live in ``<root>/<version>/<hash[:2]>/<hash>/`` next to a manifest
+    recording each file's SHA-256 (used as its ComfyUI upload name). The
+    version is a fingerprint of the preprocessing branch of the workflow,
+    so changing models or settings never reuses stale maps.
+
+    The ``preprocess_cache`` table indexes every entry with its size and
+    last use. Like the ``OutputStore``, sweeps delete entries unused for
+    longer than the TTL, then the least recently used ones until the byte
+    budget is met. Entries of an old workflow version are never used again,
+    so they expire and their version directory is removed with the last one.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, root: str = PREPROCESS_DIR,
+                 ttl_days: float = PREPROCESS_TTL_DAYS, max_bytes: int = PREPROCESS_MAX_BYTES):
+        self.db_manager = db_manager
+        self.root = root
+        self.ttl_days = ttl_days
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._files_lock = threading.Lock()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._touched: Dict[str, float] = {}
+        self._last_sweep = 0.0
+        self.evictions = 0
+
+    def _directory(self, version: str, input_hash: str) -> str:
+        return os.path.join(self.root, version, input_hash[:2], input_hash)
+
+    def lock(self, version: str, input_hash: str) -> threading.Lock:
+        """Per-input lock so concurrent requests for the same room preprocess it once"""
+        with self._lock:
+            return self._locks.setdefault(f"{version}/{input_hash}", threading.Lock())
+
+    def drop_lock(self, version: str, input_hash: str):
+        """Forget an input's lock once its preprocessing has finished or failed"""
+        with self._lock:
+            self._locks.pop(f"{version}/{input_hash}", None)
+
+    def get(self, version: str, input_hash: str) -> Optional[Dict[str, Dict]]:
+        """Return ``{name: {"path", "hash"}}`` for a cached input, or None"""
+        directory = self._directory(version, input_hash)
+        try:
+            with open(os.path.join(directory, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        maps = {}
+        for name, entry in manifest.items():
+            path = os.path.join(directory, entry["file"])
+            if not os.path.exists(path):
+                return None
+            maps[name] = {"path": path, "hash": entry["hash"]}
+        self._touch(version, input_hash)
+        return maps
+
+    def put(self, version: str, input_hash: str, images: Dict[str, bytes]) -> Dict[str, Dict]:
+        """Store the maps for an input (manifest written last, atomically)"""
+        directory = self._directory(version, input_hash)
+        with self._files_lock:
+            os.makedirs(directory, exist_ok=True)
+            manifest = {}
+            for name, data in images.items():
+                filename = f"{name}.png"
+                with open(os.path.join(directory, filename), "wb") as f:
+                    f.write(data)
+                manifest[name] = {"file": filename, "hash": hashlib.sha256(data).hexdigest()}
+
+            temp_manifest = os.path.join(directory, f".{MANIFEST_NAME}.{uuid.uuid4().hex}")
+            with open(temp_manifest, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(temp_manifest, os.path.join(directory, MANIFEST_NAME))
+
+            now = datetime.now().isoformat()
+            self.db_manager.execute_update('''
+                INSERT OR REPLACE INTO preprocess_cache (version, input_hash, size_bytes, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (version, input_hash, sum(len(data) for data in images.values()), now, now))
+
+        if time.monotonic() - self._last_sweep >= EVICT_INTERVAL:
+            self.evict()
+        return self.get(version, input_hash)
+
+    def _touch(self, version: str, input_hash: str):
+        key = f"{version}/{input_hash}"
+        now = time.monotonic()
+        with self._lock:
+            if now - self._touched.get(key, 0) < ACCESS_UPDATE_INTERVAL:
+                return
+            self._touched[key] = now
+        self.db_manager.execute_update(
+            "UPDATE preprocess_cache SET last_access = ? WHERE version = ? AND input_hash = ?",
+            (datetime.now().isoformat(), version, input_hash)
+        )
+
+    def _delete(self, rows):
+        for version, input_hash in rows:
+            directory = self._directory(version, input_hash)
+            shutil.rmtree(directory, ignore_errors=True)
+            # Drop the shard and version directories once they are empty
+            for parent in (os.path.dirname(directory), os.path.join(self.root, version)):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+        conn = self.db_manager.get_connection()
+        try:
+            conn.executemany("DELETE FROM preprocess_cache WHERE version = ? AND input_hash = ?", rows)
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            for version, input_hash in rows:
+                self._touched.pop(f"{version}/{input_hash}", None)
+            self.evictions += len(rows)
+
+    def evict(self):
+        """Delete expired entries, then least recently used ones until under the byte budget"""
+        self._last_sweep = time.monotonic()
+        with self._files_lock:
+            cutoff = (datetime.now() - timedelta(days=self.ttl_days)).isoformat()
+            expired = self.db_manager.execute_query(
+                "SELECT version, input_hash FROM preprocess_cache WHERE last_access < ?", (cutoff,)
+            )
+            if expired:
+                self._delete(expired)
+
+            total_bytes = self.db_manager.execute_query(
+                "SELECT COALESCE(SUM(size_bytes), 0) FROM preprocess_cache"
+            )[0][0]
+            while total_bytes > self.max_bytes:
+                rows = self.db_manager.execute_query('''
+                    SELECT version, input_hash, size_bytes FROM preprocess_cache
+                    ORDER BY last_access ASC LIMIT 500
+                ''')
+                if not rows:
+                    break
+                doomed = []
+                for version, input_hash, size_bytes in rows:
+                    if total_bytes <= self.max_bytes:
+                        break
+                    doomed.append((version, input_hash))
+                    total_bytes -= size_bytes
+                self._delete(doomed)
+
+    def stats(self) -> Dict:
+        count, total_bytes = self.db_manager.execute_query(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM preprocess_cache"
+        )[0]
+        return {
+            "entries": count,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_days": self.ttl_days,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,63 @@
+"""
+Progress Hub
+Relays generation progress from worker threads to streaming HTTP clients
+"""
+import asyncio
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class ProgressHub:
+    """
+    In-process publish/subscribe channel keyed by job id.
+
+    Worker threads call ``publish()``; async endpoints ``subscribe()`` from
+    the event loop and receive every later event on an ``asyncio.Queue``.
+    The most recent event per job is kept so late subscribers can catch up.
+    Only subscribers in the publishing process are reached; streams served
+    by other workers fall back to the job's stored progress.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest: Dict[str, dict] = {}
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def publish(self, key: str, event: dict):
+        with self._lock:
+            self._latest[key] = event
+            subscribers = list(self._subscribers.get(key, []))
+        for loop, events in subscribers:
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, event)
+            except RuntimeError:
+                # Subscriber's event loop has already closed
+                pass
+
+    def subscribe(self, key: str) -> asyncio.Queue:
+        """Register the calling coroutine for events on ``key`` (must run inside an event loop)"""
+        events = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(key, []).append((asyncio.get_running_loop(), events))
+        return events
+
+    def unsubscribe(self, key: str, events: asyncio.Queue):
+        with self._lock:
+            subscribers = [entry for entry in self._subscribers.get(key, []) if entry[1] is not events]
+            if subscribers:
+                self._subscribers[key] = subscribers
+            else:
+                self._subscribers.pop(key, None)
+
+    def latest(self, key: str) -> Optional[dict]:
+        with self._lock:
+            return self._latest.get(key)
+
+    def clear(self, key: str):
+        """Forget the retained event once a job is finished"""
+        with self._lock:
+            self._latest.pop(key, None)
+
+
+# Shared hub for generation jobs
+progress_hub = ProgressHub()
@@ -0,0 +1,124 @@
+"""
+Result Cache
+Maps deterministic generation requests to outputs that were already rendered
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.database.models import DatabaseManager
+
+from .metrics import record_cache_lookup
+
+# Entry limit (least recently used entries are dropped first)
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+
+
+class ResultCache:
+    """
+    Persistent LRU cache of generated images.
+
+    Entries are keyed by everything that determines a render - input image
+    hash, style, workflow version, seed and quality parameters - and point
+    at an already stored output file. Entries whose file has disappeared
+    are treated as misses. Eviction only drops the pointer: the files
+    belong to the ``OutputStore``, whose TTL and byte budget bound the disk
+    space, and an entry whose file it deleted simply misses.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.db_manager = db_manager
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(input_hash: str, style: str, workflow_version: str, seed: int, params: Optional[Dict] = None) -> str:
+        material = json.dumps({
+            "input": input_hash,
+            "style": style,
+            "workflow": workflow_version,
+            "seed": seed,
+            "params": params or {},
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, cache_key: str) -> Optional[Dict]:
+        """Return the cached entry (``file_path``, ``seed``, ...) or None"""
+        results = self.db_manager.execute_query(
+            "SELECT file_path, seed, size_bytes FROM result_cache WHERE cache_key = ?", (cache_key,)
+        )
+        if not results or not os.path.exists(results[0][0]):
+            if results:
+                self.db_manager.execute_update("DELETE FROM result_cache WHERE cache_key = ?", (cache_key,))
+            with self._lock:
+                self.misses += 1
+            record_cache_lookup("result", hit=False)
+            return None
+
+        self.db_manager.execute_update(
+            "UPDATE result_cache SET last_access = ?, hits = hits + 1 WHERE cache_key = ?",
+            (datetime.now().isoformat(), cache_key)
+        )
+        with self._lock:
+            self.hits += 1
+        record_cache_lookup("result", hit=True)
+        file_path, seed, size_bytes = results[0]
+        return {"file_path": file_path, "seed": seed, "size_bytes": size_bytes}
+
+    def contains(self, cache_key: str) -> bool:
+        """Whether ``cache_key`` would hit, without counting a lookup or touching the entry"""
+        results = self.db_manager.execute_query(
+            "SELECT file_path FROM result_cache WHERE cache_key = ?", (cache_key,)
+        )
+        return bool(results) and os.path.exists(results[0][0])
+
+    def put(self, cache_key: str, file_path: str, seed: int):
+        now = datetime.now().isoformat()
+        self.db_manager.execute_update('''
+            INSERT OR REPLACE INTO result_cache (cache_key, file_path, seed, size_bytes, created_at, last_access, hits)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+        ''', (cache_key, file_path, seed, os.path.getsize(file_path), now, now))
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the entry limit is met"""
+        count = self.db_manager.execute_query("SELECT COUNT(*) FROM result_cache")[0][0]
+        if count <= self.max_entries:
+            return
+
+        rows = self.db_manager.execute_query(
+            "SELECT cache_key FROM result_cache ORDER BY last_access ASC LIMIT ?",
+            (count - self.max_entries,)
+        )
+        doomed = [(cache_key,) for cache_key, in rows]
+
+        conn = self.db_manager.get_connection()
+        try:
+            conn.executemany("DELETE FROM result_cache WHERE cache_key = ?", doomed)
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self.evictions += len(doomed)
+
+    def stats(self) -> Dict:
+        count, total_bytes = self.db_manager.execute_query(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM result_cache"
+        )[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": count,
+                "bytes": total_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,154 @@
+"""
+Generation Scheduler
+Weighted fair queuing of variants across API keys in front of the ComfyUI backends
+"""
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from .metrics import observe_stage
+
+
+def _parse_role_weights(value: str) -> Dict[str, float]:
+    weights = {}
+    for item in value.split(","):
+        if ":" in item:
+            role, weight = item.split(":", 1)
+            weights[role.strip()] = float(weight)
+    return weights
+
+
+# Share of GPU time per role, e.g. "user:1,admin:2,superadmin:4"
+ROLE_WEIGHTS = _parse_role_weights(os.getenv("SCHEDULER_ROLE_WEIGHTS", "user:1,admin:2,superadmin:4"))
+# Variants dispatched to each backend at once (1 running + 1 queued keeps the GPU busy)
+SLOTS_PER_BACKEND = int(os.getenv("SCHEDULER_SLOTS_PER_BACKEND", "2"))
+# Variants a single API key may have dispatched at once
+MAX_IN_FLIGHT_PER_KEY = int(os.getenv("SCHEDULER_MAX_IN_FLIGHT_PER_KEY", "2"))
+
+# How often a waiter checks its cancel event (seconds)
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class SchedulingCancelled(Exception):
+    """Raised by acquire() when the waiter's cancel event is set"""
+
+
+class _Waiter:
+    __slots__ = ("key", "start", "finish", "seq", "granted", "enqueued_at")
+
+    def __init__(self, key: str, start: float, finish: float, seq: int):
+        self.key = key
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class FairScheduler:
+    """
+    Grants dispatch slots to variants using weighted fair queuing.
+
+    Each API key gets a virtual finish time that advances by
+    ``cost / weight`` per variant, so keys take turns instead of the first
+    caller's ten variants running back to back, and roles with a higher
+    weight (admin, superadmin) get a proportionally larger share. A key
+    never holds more than ``max_in_flight_per_key`` slots while others wait.
+    """
+
+    def __init__(self, slots: int, role_weights: Optional[Dict[str, float]] = None,
+                 max_in_flight_per_key: int = MAX_IN_FLIGHT_PER_KEY):
+        self.slots = max(1, slots)
+        self.role_weights = role_weights if role_weights is not None else ROLE_WEIGHTS
+        self.max_in_flight_per_key = max(1, max_in_flight_per_key)
+        self._condition = threading.Condition()
+        self._waiting: List[_Waiter] = []
+        self._in_flight: Dict[str, int] = {}
+        self._last_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self.granted_total = 0
+        self.wait_seconds_total = 0.0
+
+    def _weight(self, role: str) -> float:
+        return max(self.role_weights.get(role, 1.0), 0.001)
+
+    def _dispatch(self):
+        """Grant free slots to eligible waiters with the smallest finish tag (caller holds the lock)"""
+        granted = False
+        while self._waiting and sum(self._in_flight.values()) < self.slots:
+            eligible = [w for w in self._waiting if self._in_flight.get(w.key, 0) < self.max_in_flight_per_key]
+            if not eligible:
+                break
+            waiter = min(eligible, key=lambda w: (w.finish, w.seq))
+            self._waiting.remove(waiter)
+            self._virtual_time = max(self._virtual_time, waiter.start)
+            self._in_flight[waiter.key] = self._in_flight.get(waiter.key, 0) + 1
+            waiter.granted = True
+            self.granted_total += 1
+            waited = time.monotonic() - waiter.enqueued_at
+            self.wait_seconds_total += waited
+            observe_stage("schedule_wait", waited)
+            granted = True
+        if granted:
+            self._condition.notify_all()
+
+    def acquire(self, key: str, role: str = "user", cost: float = 1.0, cancel_event: Optional[threading.Event] = None):
+        """Block until this key may dispatch one variant (or ``cancel_event`` is set)"""
+        with self._condition:
+            start = max(self._virtual_time, self._last_finish.get(key, 0.0))
+            finish = start + cost / self._weight(role)
+            self._last_finish[key] = finish
+            waiter = _Waiter(key, start, finish, next(self._seq))
+            self._waiting.append(waiter)
+            self._dispatch()
+            try:
+                while not waiter.granted:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise SchedulingCancelled("Cancelled while waiting for a dispatch slot")
+                    self._condition.wait(CANCEL_POLL_INTERVAL if cancel_event is not None else None)
+            except BaseException:
+                if waiter.granted:
+                    self._release_locked(key)
+                else:
+                    self._waiting.remove(waiter)
+                raise
+
+    def _release_locked(self, key: str):
+        self._in_flight[key] -= 1
+        if self._in_flight[key] <= 0:
+            del self._in_flight[key]
+            # Idle keys start over at the current virtual time
+            if not any(w.key == key for w in self._waiting):
+                self._last_finish.pop(key, None)
+        self._dispatch()
+
+    def release(self, key: str):
+        with self._condition:
+            self._release_locked(key)
+
+    @contextmanager
+    def slot(self, key: str, role: str = "user", cost: float = 1.0, cancel_event: Optional[threading.Event] = None):
+        self.acquire(key, role, cost, cancel_event)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def status(self) -> Dict:
+        with self._condition:
+            waiting: Dict[str, int] = {}
+            for waiter in self._waiting:
+                waiting[waiter.key] = waiting.get(waiter.key, 0) + 1
+            return {
+                "slots": self.slots,
+                "in_flight": sum(self._in_flight.values()),
+                "waiting": len(self._waiting),
+                "active_keys": len(set(self._in_flight) | set(waiting)),
+                "max_in_flight_per_key": self.max_in_flight_per_key,
+                "role_weights": self.role_weights,
+                "avg_wait_seconds": round(self.wait_seconds_total / self.granted_total, 3) if self.granted_total else 0.0,
+            }
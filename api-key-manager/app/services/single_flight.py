@@ -0,0 +1,136 @@
+"""
+Single-Flight Generation
+Attaches identical in-flight generation requests to the one already running
+"""
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# How often a waiting caller checks its own cancel event (seconds)
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class _AllCancelled:
+    """
+    Cancel flag of a flight: reads as set only once every caller attached to
+    it has cancelled, so one caller going away does not stop the others'
+    work. Quacks like ``threading.Event`` for the wrapper and scheduler.
+    """
+
+    def __init__(self):
+        self._events: List[threading.Event] = []
+
+    def add(self, event: threading.Event):
+        self._events.append(event)
+
+    def is_set(self) -> bool:
+        events = list(self._events)
+        return bool(events) and all(event.is_set() for event in events)
+
+
+class Flight:
+    """One running generation and everyone waiting for it"""
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.future: Future = Future()
+        self.cancel_event = _AllCancelled()
+        self.callers = 0
+        self._progress_callbacks: List[Callable[[Dict], None]] = []
+
+    def publish(self, event: Dict):
+        """Fan a progress event out to every attached caller"""
+        for callback in list(self._progress_callbacks):
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"⚠️ Progress callback failed: {e}")
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls with the same key.
+
+    The first caller of a key becomes the leader and runs the work through
+    ``execute()``; callers arriving while it runs attach to the same
+    ``Flight`` and receive its result (or exception) when it finishes.
+    Progress events are forwarded to all of them. Each caller passes its own
+    cancel event; the work is only cancelled once all of them have set it.
+
+    Coalescing does not change billing: every request was already charged
+    by the API key middleware before it got here.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Flight] = {}
+        self.led = 0
+        self.coalesced = 0
+
+    def join(self, key: Hashable, cancel_event: Optional[threading.Event] = None,
+             progress_callback: Optional[Callable[[Dict], None]] = None) -> Tuple[Flight, bool]:
+        """Attach to the flight for ``key``, creating it if needed; returns (flight, is_leader)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            # A flight everyone has abandoned is winding down; start over
+            leader = flight is None or flight.cancel_event.is_set()
+            if leader:
+                flight = Flight(key)
+                self._flights[key] = flight
+                self.led += 1
+            else:
+                self.coalesced += 1
+            flight.callers += 1
+            # Callers that cannot cancel keep the flight alive
+            flight.cancel_event.add(cancel_event if cancel_event is not None else threading.Event())
+            if progress_callback is not None:
+                flight._progress_callbacks.append(progress_callback)
+        return flight, leader
+
+    def execute(self, flight: Flight, fn: Callable[[Flight], Dict]):
+        """Run the leader's work and hand its outcome to every attached caller"""
+        try:
+            result = fn(flight)
+        except BaseException as e:
+            self._detach(flight)
+            flight.future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            self._detach(flight)
+            flight.future.set_result(result)
+
+    def _detach(self, flight: Flight):
+        # Later identical requests start a new flight (and hit the result cache)
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def run(self, key: Hashable, fn: Callable[[Flight], Dict], cancel_event: Optional[threading.Event] = None,
+            progress_callback: Optional[Callable[[Dict], None]] = None,
+            cancelled_result: Optional[Dict] = None) -> Tuple[Dict, bool]:
+        """
+        Blocking helper for worker threads: lead or join the flight for
+        ``key`` and return (result, coalesced). A follower whose own
+        ``cancel_event`` is set stops waiting and gets ``cancelled_result``.
+        """
+        flight, leader = self.join(key, cancel_event, progress_callback)
+        if leader:
+            self.execute(flight, fn)
+            return flight.future.result(), False
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                return cancelled_result, True
+            try:
+                return flight.future.result(timeout=CANCEL_POLL_INTERVAL if cancel_event is not None else None), True
+            except FutureTimeoutError:
+                continue
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "attached_callers": sum(flight.callers for flight in self._flights.values()),
+                "led": self.led,
+                "coalesced": self.coalesced,
+            }
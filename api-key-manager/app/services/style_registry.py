@@ -0,0 +1,222 @@
+"""
+Style Registry
+Style presets and their ComfyUI workflows, loaded from a directory and reloaded on change
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .comfy_workflow import (
+    OUTPUT_NODE, INPUT_NODE, QUALITY_TIERS, dangling_links, preprocess_version, prune_to_outputs,
+    supports_preprocessed_maps, supports_quality_tier, supports_refine_variation
+)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+STYLES_DIR = os.getenv("STYLES_DIR", os.path.join(BASE_DIR, "styles"))
+
+# Seconds between checks of the styles directory for changes
+RELOAD_CHECK_INTERVAL = 2
+
+REQUIRED_FIELDS = ("prompt", "ckpt_name", "workflow")
+
+
+class StylePresetError(Exception):
+    """Raised when a style preset or its workflow is invalid"""
+
+
+class StylePreset:
+    """
+    A validated style: prompts, checkpoint and its compiled workflow.
+
+    ``workflow`` is shared between requests and must be treated as
+    read-only; callers deep-copy it before editing.
+    """
+
+    def __init__(self, name: str, config: Dict, workflow_file: str, workflow: Dict, source_file: str):
+        self.name = name
+        self.display_name = config.get("display_name") or name.replace("_", " ").title()
+        self.description = config.get("description", "")
+        self.prompt = config["prompt"]
+        self.negative_prompt = config.get("negative_prompt", "")
+        self.ckpt_name = config["ckpt_name"]
+        self.workflow_file = workflow_file
+        self.workflow = workflow
+        self.source_file = source_file
+
+        # Compiled once: anything that changes the rendered pixels must be part of cache keys
+        self.workflow_version = hashlib.sha256(json.dumps(workflow, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self.supports_preprocess = supports_preprocessed_maps(workflow)
+        self.preprocess_version = preprocess_version(workflow) if self.supports_preprocess else None
+        self.supports_refine_variation = supports_refine_variation(workflow)
+        self.quality_tiers = [tier for tier in QUALITY_TIERS if supports_quality_tier(workflow, tier)]
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "display_name": self.display_name,
+            "description": self.description,
+            "supports_refine_variation": self.supports_refine_variation,
+            "quality_tiers": self.quality_tiers,
+        }
+
+
+def load_workflow(path: str) -> Dict:
+    """
+    Load and validate an API-format ComfyUI workflow, pruned to the nodes
+    the output node depends on (editor-only preview sinks are dropped)
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            workflow = json.load(f)
+    except (OSError, ValueError) as e:
+        raise StylePresetError(f"Failed to load workflow {path}: {e}")
+    if not isinstance(workflow, dict) or not workflow:
+        raise StylePresetError(f"Workflow {path} is not an API-format prompt")
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict) or "class_type" not in node or not isinstance(node.get("inputs"), dict):
+            raise StylePresetError(f"Workflow {path}: node {node_id} has no class_type/inputs")
+    for node_id in (INPUT_NODE, OUTPUT_NODE):
+        if node_id not in workflow:
+            raise StylePresetError(f"Workflow {path} has no node {node_id}")
+    dangling = dangling_links(workflow)
+    if dangling:
+        raise StylePresetError(f"Workflow {path} links to missing nodes: {dangling}")
+
+    pruned = prune_to_outputs(workflow, [OUTPUT_NODE])
+    if INPUT_NODE not in pruned:
+        raise StylePresetError(f"Workflow {path}: output node {OUTPUT_NODE} does not use input node {INPUT_NODE}")
+    dropped = sorted(set(workflow) - set(pruned), key=lambda node_id: (len(node_id), node_id))
+    if dropped:
+        print(f"✂️ Pruned {len(dropped)} nodes not needed for output {OUTPUT_NODE} from {os.path.basename(path)}: {dropped}")
+    return pruned
+
+
+class StyleRegistry:
+    """
+    Style presets loaded from ``<styles_dir>/*.json``.
+
+    Each file holds ``prompt``, ``negative_prompt``, ``ckpt_name`` and
+    ``workflow`` (a path relative to the project root) plus optional
+    ``display_name``/``description``; the style name is the file name.
+    Once ``start()``ed, a watcher thread checks file modification times
+    every ``RELOAD_CHECK_INTERVAL`` seconds and reloads when anything
+    changed, so new or edited styles go live without a restart. Lookups
+    only read the current presets, which a reload swaps in all at once.
+    Without the watcher (scripts, tests) presets are loaded on first use.
+    A preset that fails validation is skipped with a warning and its last
+    good version is kept.
+    """
+
+    def __init__(self, styles_dir: str = STYLES_DIR, check_interval: float = RELOAD_CHECK_INTERVAL):
+        self.styles_dir = styles_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._styles: Dict[str, StylePreset] = {}
+        self._signature: Optional[Tuple] = None
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    def _resolve_workflow(self, workflow: str) -> str:
+        return workflow if os.path.isabs(workflow) else os.path.join(BASE_DIR, workflow)
+
+    def _style_files(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.styles_dir, "*.json")))
+
+    def _current_signature(self, styles: Dict[str, StylePreset]) -> Tuple:
+        """Modification times of every style file and the workflows they reference"""
+        paths = set(self._style_files())
+        for preset in styles.values():
+            paths.add(preset.workflow_file)
+        signature = []
+        for path in sorted(paths):
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def reload(self):
+        """Re-read every preset; concurrent reloads run one at a time"""
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        # Workflows shared by several styles are parsed once
+        styles = {}
+        workflows: Dict[str, Dict] = {}
+        for path in self._style_files():
+            name = os.path.splitext(os.path.basename(path))[0]
+            try:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        config = json.load(f)
+                except (OSError, ValueError) as e:
+                    raise StylePresetError(f"Failed to load {path}: {e}")
+                missing = [field for field in REQUIRED_FIELDS if not config.get(field)]
+                if missing:
+                    raise StylePresetError(f"{path} is missing {', '.join(missing)}")
+
+                workflow_file = self._resolve_workflow(config["workflow"])
+                if workflow_file not in workflows:
+                    workflows[workflow_file] = load_workflow(workflow_file)
+                styles[name] = StylePreset(name, config, workflow_file, workflows[workflow_file], path)
+            except StylePresetError as e:
+                print(f"⚠️ Style '{name}' not loaded: {e}")
+                if name in self._styles:
+                    styles[name] = self._styles[name]
+
+        # One assignment, so lookups never see a half-built registry
+        self._signature = self._current_signature(styles)
+        self._styles = styles
+        print(f"🎨 Loaded styles: {', '.join(sorted(styles)) or 'none'}")
+
+    def check(self):
+        """Reload if any style file or workflow changed since the last load"""
+        with self._lock:
+            if self._signature is None or self._current_signature(self._styles) != self._signature:
+                self._reload()
+
+    def start(self):
+        """Load the presets and start watching the styles directory for changes"""
+        self.check()
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="style-registry-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+
+    def _watch(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"⚠️ Style registry check failed: {e}")
+
+    def _current(self) -> Dict[str, StylePreset]:
+        if self._signature is None:
+            self.check()
+        return self._styles
+
+    def get(self, name: str) -> Optional[StylePreset]:
+        return self._current().get(name)
+
+    def names(self) -> List[str]:
+        return sorted(self._current())
+
+    def list(self) -> List[Dict]:
+        styles = self._current()
+        return [styles[name].to_dict() for name in sorted(styles)]
+
+
+# Shared registry used by the API and the ComfyUI wrapper
+style_registry = StyleRegistry()
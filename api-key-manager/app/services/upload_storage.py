@@ -0,0 +1,91 @@
+"""
+Upload Storage
+Copies multipart uploads to uniquely named temp files with a size limit
+"""
+import os
+import uuid
+from typing import Dict, Optional
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+UPLOAD_DIR = "temp_uploads"
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Whole request bodies (enforced by UploadLimitMiddleware while they are received)
+# may exceed MAX_UPLOAD_BYTES by this much for the form fields and part headers
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+
+# Leading bytes of the image formats the normalizer accepts
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+]
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES"""
+
+
+class UnsupportedImageError(Exception):
+    """Raised when an upload does not start with a known image signature"""
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """Identify an image format from its first bytes"""
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+async def save_upload(upload: UploadFile, prefix: str = "upload", max_bytes: int = MAX_UPLOAD_BYTES) -> Dict:
+    """
+    Copy ``upload`` to ``temp_uploads/<prefix>_<uuid>`` in chunks.
+
+    The request body was already size-checked by ``UploadLimitMiddleware``
+    as it arrived; this copies Starlette's spooled file to a named one the
+    normalization pool can open, sniffing the format from the first chunk
+    and stopping as soon as the file itself exceeds ``max_bytes``. Reads
+    and writes run in the threadpool so the event loop never blocks on
+    disk I/O. The partial file is removed on any error.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.abspath(os.path.join(UPLOAD_DIR, f"{prefix}_{uuid.uuid4().hex}"))
+    size = 0
+    image_format = None
+
+    f = await run_in_threadpool(open, path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if size == 0:
+                image_format = sniff_image_format(chunk[:16])
+                if image_format is None:
+                    raise UnsupportedImageError("Unsupported or unrecognized image format")
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLargeError(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+            await run_in_threadpool(f.write, chunk)
+        if size == 0:
+            raise UnsupportedImageError("Uploaded file is empty")
+    except BaseException:
+        await run_in_threadpool(f.close)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    await run_in_threadpool(f.close)
+
+    return {"path": path, "size": size, "format": image_format}
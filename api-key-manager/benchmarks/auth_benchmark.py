@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Auth Hot-Path Benchmark
+Measures validate_api_key_with_role, check_quota_and_rate_limit and increment_usage
+against synthetic databases of increasing size, in-process and over HTTP
+
+Usage:
+    python benchmarks/auth_benchmark.py --keys 1000,100000 --logs 10000,1000000 --json auth.json
+    python benchmarks/auth_benchmark.py --keys 1000000 --logs 100000000 --http --clients 1,16,64
+    python benchmarks/auth_benchmark.py --keys 1000 --logs 10000 --compare auth.json
+
+Synthetic databases are built with the app's own schema (DatabaseManager) and
+cached in --data-dir, so a size is only seeded once. Keys are deterministic
+(key i is sk-proj-bench-<i>); usage logs are spread over the last 30 days.
+Results carry the git commit, so JSON files from different commits can be
+compared with --compare, which exits non-zero on a regression.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Callable, Dict, List
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from app.database.models import DatabaseManager  # noqa: E402
+from app.services.api_key_service import APIKeyService  # noqa: E402
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "api-key-manager-bench")
+
+# Seeding batch size (rows per executemany / INSERT ... SELECT)
+SEED_BATCH = 100_000
+
+# A result is a regression when its throughput drops by more than this share
+REGRESSION_THRESHOLD = 0.10
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(float(item)) for item in value.split(",") if item]
+
+
+def bench_key(index: int) -> str:
+    return f"sk-proj-bench-{index:08d}"
+
+
+# ----------------------------------------------------------------------
+# Synthetic databases
+# ----------------------------------------------------------------------
+def seed_database(path: str, num_keys: int, num_logs: int):
+    """Create the app schema and fill it with ``num_keys`` keys and ``num_logs`` usage rows"""
+    DatabaseManager(path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    now = datetime.now()
+    today = date.today().isoformat()
+
+    for start in range(0, num_keys, SEED_BATCH):
+        rows = []
+        for index in range(start, min(num_keys, start + SEED_BATCH)):
+            key = bench_key(index)
+            rows.append((
+                hashlib.sha256(key.encode()).hexdigest(), key[:12] + "...", f"bench-{index}",
+                f"bench{index}@example.com", "user",
+                # Limits high enough that the benchmark never gets rejected
+                1_000_000_000, 1_000_000_000, now.isoformat(), today,
+            ))
+        conn.executemany('''
+            INSERT INTO api_keys (
+                key_hash, key_prefix, name, user_email, role,
+                daily_quota, rate_limit, created_at, last_quota_reset
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+
+    # Generated inside SQLite: Python-side inserts are too slow for 10^8 rows
+    for start in range(0, num_logs, SEED_BATCH):
+        batch = min(SEED_BATCH, num_logs - start)
+        conn.execute('''
+            WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < ?)
+            INSERT INTO usage_logs (api_key_id, service_name, request_timestamp, response_time_ms, success)
+            SELECT abs(random()) % ? + 1, 'virtual_staging',
+                   datetime('now', '-' || (abs(random()) % 2592000) || ' seconds'),
+                   abs(random()) % 30000, 1
+            FROM n
+        ''', (batch, max(1, num_keys)))
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def synthetic_database(data_dir: str, num_keys: int, num_logs: int) -> str:
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"auth_k{num_keys}_l{num_logs}.db")
+    if not os.path.exists(path):
+        print(f"🌱 Seeding {num_keys:,} keys and {num_logs:,} usage logs into {path}...")
+        started = time.perf_counter()
+        try:
+            seed_database(path, num_keys, num_logs)
+        except BaseException:
+            os.remove(path)
+            raise
+        print(f"   seeded in {time.perf_counter() - started:.1f}s ({os.path.getsize(path) / 1e6:.0f} MB)")
+    else:
+        # Earlier runs charged usage, and on a later day every key would hit the daily reset path
+        conn = sqlite3.connect(path)
+        conn.execute("UPDATE api_keys SET current_daily_usage = 0, last_quota_reset = ?", (date.today().isoformat(),))
+        conn.commit()
+        conn.close()
+    return path
+
+
+# ----------------------------------------------------------------------
+# Measurement
+# ----------------------------------------------------------------------
+def measure(operation: Callable[[int], None], threads: int, duration: float, warmup: float = 0.2) -> Dict:
+    """Run ``operation(i)`` from ``threads`` threads for ``duration`` seconds; returns throughput and latencies"""
+    stop = threading.Event()
+    measuring = threading.Event()
+    latencies: List[List[float]] = [[] for _ in range(threads)]
+    errors = [0] * threads
+
+    def worker(slot: int):
+        rng = random.Random(slot)
+        own = latencies[slot]
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                operation(rng.randrange(1 << 30))
+            except Exception:
+                errors[slot] += 1
+                continue
+            if measuring.is_set():
+                own.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(worker, slot) for slot in range(threads)]
+        time.sleep(warmup)
+        measuring.set()
+        started = time.perf_counter()
+        time.sleep(duration)
+        stop.set()
+        elapsed = time.perf_counter() - started
+        for future in futures:
+            future.result()
+
+    samples = sorted(latency for own in latencies for latency in own)
+
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6, 1) if samples else None
+
+    return {
+        "ops": len(samples),
+        "errors": sum(errors),
+        "ops_per_second": round(len(samples) / elapsed, 1),
+        "latency_us": {
+            "mean": round(statistics.mean(samples) * 1e6, 1) if samples else None,
+            "p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99),
+            "max": round(samples[-1] * 1e6, 1) if samples else None,
+        },
+    }
+
+
+def in_process_scenarios(service: APIKeyService, num_keys: int) -> Dict[str, Callable[[int], None]]:
+    """The service calls behind every authenticated request, alone and together"""
+    keys = [bench_key(i) for i in range(num_keys)]
+
+    def validate(r):
+        ok, key_info, _, _ = service.validate_api_key_with_role(keys[r % num_keys])
+        if not ok:
+            raise RuntimeError("validation failed")
+
+    def validate_unknown(r):
+        service.validate_api_key_with_role(f"sk-proj-unknown-{r}")
+
+    def quota_check(r):
+        ok, message, _ = service.check_quota_and_rate_limit(r % num_keys + 1)
+        if not ok:
+            raise RuntimeError(message)
+
+    def increment(r):
+        service.increment_usage(r % num_keys + 1)
+
+    def hot_path(r):
+        # What a quota-checked, billed request does: validate, check, then charge
+        ok, key_info, _, _ = service.validate_api_key_with_role(keys[r % num_keys])
+        if not ok:
+            raise RuntimeError("validation failed")
+        ok, message, _ = service.check_quota_and_rate_limit(key_info.id)
+        if not ok:
+            raise RuntimeError(message)
+        service.increment_usage(key_info.id)
+
+    return {
+        "validate": validate,
+        "validate_unknown": validate_unknown,
+        "quota_check": quota_check,
+        "increment_usage": increment,
+        "hot_path": hot_path,
+    }
+
+
+# ----------------------------------------------------------------------
+# HTTP
+# ----------------------------------------------------------------------
+def serve(db_path: str, port: int):
+    """Run the app with every API key dependency pointed at ``db_path``"""
+    import uvicorn
+    os.chdir(BASE_DIR)
+    import app.main as main
+    from app.api import api_keys
+    from app.middleware import api_key_middleware
+
+    def bench_service():
+        return APIKeyService(DatabaseManager(db_path))
+
+    for dependency in (main.get_api_key_service, api_keys.get_api_key_service, api_key_middleware.get_api_key_service):
+        main.app.dependency_overrides[dependency] = bench_service
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def http_scenarios(base_url: str, num_keys: int) -> Dict[str, Callable[[int], None]]:
+    import requests
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def validate(r):
+        # Key lookup, quota and rate-limit check
+        response = session().post(f"{base_url}/api/keys/validate", json={"api_key": bench_key(r % num_keys)})
+        if response.status_code != 200 or not response.json().get("valid"):
+            raise RuntimeError(response.text)
+
+    def readonly_auth(r):
+        # Key lookup only, as done on every job status poll (the job itself does not exist)
+        response = session().get(f"{base_url}/api/virtual-staging/jobs/bench",
+                                 headers={"X-API-Key": bench_key(r % num_keys)})
+        if response.status_code != 404:
+            raise RuntimeError(response.text)
+
+    return {"http_validate": validate, "http_readonly_auth": readonly_auth}
+
+
+def start_server(db_path: str, port: int) -> subprocess.Popen:
+    import requests
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", db_path, "--port", str(port)])
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/health", timeout=1)
+            return process
+        except requests.RequestException:
+            if process.poll() is not None:
+                raise RuntimeError("benchmark server exited")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("benchmark server did not start")
+
+
+# ----------------------------------------------------------------------
+# Reporting
+# ----------------------------------------------------------------------
+def environment() -> Dict:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BASE_DIR,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=BASE_DIR, stderr=subprocess.DEVNULL).strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def result_key(result: Dict) -> tuple:
+    return result["scenario"], result["keys"], result["logs"], result["clients"]
+
+
+def compare(results: List[Dict], baseline_path: str) -> int:
+    """Print throughput changes against a previous run; returns the number of regressions"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {result_key(result): result for result in baseline["results"]}
+    regressions = 0
+    print(f"📊 Compared with {baseline_path} (commit {(baseline['environment'].get('commit') or '?')[:10]})")
+    for result in results:
+        before = previous.get(result_key(result))
+        if not before or not before["ops_per_second"]:
+            continue
+        change = result["ops_per_second"] / before["ops_per_second"] - 1
+        regressed = change < -REGRESSION_THRESHOLD
+        regressions += regressed
+        print(f"   {'❌' if regressed else '  '} {result['scenario']:<20} keys={result['keys']:<8} logs={result['logs']:<10} "
+              f"clients={result['clients']:<3} {before['ops_per_second']:>10.0f} -> {result['ops_per_second']:>10.0f} ops/s "
+              f"({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API key validation, quota and rate-limit checks")
+    parser.add_argument("--keys", type=_int_list, default=[1000, 100000], help="Comma-separated key counts")
+    parser.add_argument("--logs", type=_int_list, default=[10000, 1000000], help="Comma-separated usage_logs sizes")
+    parser.add_argument("--threads", type=_int_list, default=[1, 8], help="In-process thread counts")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds per measurement")
+    parser.add_argument("--scenarios", default=None, help="Comma-separated subset of scenarios to run")
+    parser.add_argument("--http", action="store_true", help="Also benchmark over HTTP against a local server")
+    parser.add_argument("--clients", type=_int_list, default=[1, 16], help="Concurrent HTTP clients")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Where synthetic databases are cached")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results to this file")
+    parser.add_argument("--compare", default=None, help="Previous --json output to compare against")
+    parser.add_argument("--serve", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return 0
+
+    wanted = set(args.scenarios.split(",")) if args.scenarios else None
+    results = []
+    for num_keys in args.keys:
+        for num_logs in args.logs:
+            db_path = synthetic_database(args.data_dir, num_keys, num_logs)
+            runs = []
+            service = APIKeyService(DatabaseManager(db_path))
+            for name, operation in in_process_scenarios(service, num_keys).items():
+                runs.extend((name, operation, threads) for threads in args.threads)
+
+            server = None
+            if args.http:
+                server = start_server(db_path, args.port)
+                for name, operation in http_scenarios(f"http://127.0.0.1:{args.port}", num_keys).items():
+                    runs.extend((name, operation, clients) for clients in args.clients)
+            try:
+                for name, operation, clients in runs:
+                    if wanted and name not in wanted:
+                        continue
+                    result = {"scenario": name, "keys": num_keys, "logs": num_logs, "clients": clients}
+                    result.update(measure(operation, clients, args.duration))
+                    results.append(result)
+                    latency = result["latency_us"]
+                    print(f"⚡ {name:<20} keys={num_keys:<8} logs={num_logs:<10} clients={clients:<3} "
+                          f"{result['ops_per_second']:>10.0f} ops/s  p50 {latency['p50']} µs  p99 {latency['p99']} µs"
+                          + (f"  errors {result['errors']}" if result["errors"] else ""))
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait(timeout=10)
+
+    report = {"environment": environment(), "duration": args.duration, "results": results}
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.json_path}")
+    if args.compare:
+        return 1 if compare(results, args.compare) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
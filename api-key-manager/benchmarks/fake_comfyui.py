@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+Fake ComfyUI Server
+A GPU-free stand-in for ComfyUI, for benchmarking and load-testing the generation path
+
+Implements the parts of the ComfyUI API the app uses: /prompt, /ws,
+/history, /view, /queue, /interrupt, /upload/image and /system_stats.
+Prompts run one at a time, like on a real backend. Each node sleeps for a
+configurable time and the websocket carries the same executing / progress /
+execution_cached / binary image messages ComfyUI sends. Nodes whose inputs
+did not change since the previous prompt are served from cache, as they are
+in ComfyUI. Failures and output sizes can be configured too.
+
+Usage:
+    python benchmarks/fake_comfyui.py --port 8188 --step-latency 0.02 --output-size 1024x768
+    COMFY_BACKENDS=127.0.0.1:8188 python run_server.py
+
+Timing statistics for the load-test harness are served at /fake/stats and
+reset with POST /fake/stats/reset.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import random
+import struct
+import time
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, File, Form, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
+from PIL import Image
+
+# Nodes that produce outputs; only they and their inputs are executed
+OUTPUT_CLASSES = ("SaveImage", "PreviewImage", "MaskPreview", "SaveImageWebsocket")
+LOADER_CLASSES = ("LoadImage", "LoadImageMask")
+
+# History entries and output images kept in memory
+MAX_HISTORY = 1000
+MAX_OUTPUTS = 2000
+
+# Sampler progress messages sent per node at most
+MAX_PROGRESS_MESSAGES = 20
+
+
+class FakeConfig:
+    """Simulated timings, failures and outputs"""
+
+    def __init__(self, node_latency: float = 0.005, step_latency: float = 0.02,
+                 latency_overrides: Optional[Dict[str, float]] = None, failure_rate: float = 0.0,
+                 http_error_rate: float = 0.0, output_size=(1024, 768), vram_total: int = 24 * 1024 ** 3,
+                 seed: Optional[int] = None):
+        self.node_latency = node_latency
+        self.step_latency = step_latency
+        # Keyed by node id or class_type; node ids win
+        self.latency_overrides = latency_overrides or {}
+        self.failure_rate = failure_rate
+        self.http_error_rate = http_error_rate
+        self.output_size = output_size
+        self.vram_total = vram_total
+        self.random = random.Random(seed)
+
+    def latency(self, node_id: str, node: Dict) -> float:
+        if node_id in self.latency_overrides:
+            return self.latency_overrides[node_id]
+        if node["class_type"] in self.latency_overrides:
+            return self.latency_overrides[node["class_type"]]
+        steps = node["inputs"].get("steps")
+        if isinstance(steps, int):
+            return steps * self.step_latency
+        return self.node_latency
+
+
+class PromptInterrupted(Exception):
+    pass
+
+
+class SimulatedFailure(Exception):
+    pass
+
+
+def _png_with_text(png: bytes, text: str) -> bytes:
+    """Insert a tEXt chunk after IHDR so every output has unique bytes without re-encoding"""
+    data = b"Comment\x00" + text.encode("latin-1")
+    chunk = struct.pack(">I", len(data)) + b"tEXt" + data + struct.pack(">I", zlib.crc32(b"tEXt" + data) & 0xFFFFFFFF)
+    # 8-byte signature + IHDR (4 length + 4 type + 13 data + 4 crc)
+    return png[:33] + chunk + png[33:]
+
+
+def _render_png(size) -> bytes:
+    """A noisy image, so PNG size and decode cost resemble a real render"""
+    width, height = size
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    buffer = io.BytesIO()
+    noise.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+class FakeComfy:
+    """Queue, executor, node cache and websocket fan-out of one fake backend"""
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.queue: "OrderedDict[str, Dict]" = OrderedDict()
+        self.running: Optional[Dict] = None
+        self.history: "OrderedDict[str, Dict]" = OrderedDict()
+        self.outputs: "OrderedDict[str, bytes]" = OrderedDict()
+        self.uploads: Dict[str, bytes] = {}
+        self.clients: Dict[str, WebSocket] = {}
+        self.node_cache: set = set()
+        self.number = 0
+        self.template_png = _render_png(config.output_size)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._interrupt: Optional[asyncio.Event] = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "started_at": time.time(),
+            "prompts_queued": 0, "prompts_completed": 0, "prompts_failed": 0,
+            "prompts_interrupted": 0, "prompts_deleted": 0, "prompts_rejected": 0,
+            "nodes_executed": 0, "nodes_cached": 0,
+            "uploads": 0, "upload_bytes": 0, "views": 0, "view_bytes": 0,
+            "queue_wait_seconds": 0.0, "execution_seconds": 0.0,
+        }
+        self.queue_waits: deque = deque(maxlen=10000)
+        self.executions: deque = deque(maxlen=10000)
+
+    # ------------------------------------------------------------------
+    # Websocket
+    # ------------------------------------------------------------------
+    async def send(self, client_id: Optional[str], message: Dict):
+        targets = [self.clients[client_id]] if client_id in self.clients else []
+        if client_id is None:
+            targets = list(self.clients.values())
+        for websocket in targets:
+            try:
+                await websocket.send_text(json.dumps(message))
+            except Exception:
+                pass
+
+    async def send_binary(self, client_id: str, image: bytes):
+        websocket = self.clients.get(client_id)
+        if websocket is not None:
+            try:
+                # PREVIEW_IMAGE event, PNG format
+                await websocket.send_bytes(struct.pack(">II", 1, 2) + image)
+            except Exception:
+                pass
+
+    async def broadcast_status(self):
+        remaining = len(self.queue) + (1 if self.running else 0)
+        await self.send(None, {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": remaining}}}})
+
+    # ------------------------------------------------------------------
+    # Prompts
+    # ------------------------------------------------------------------
+    def validate(self, prompt: Dict) -> Optional[Dict]:
+        """ComfyUI-style validation error body, or None"""
+        if not any(node.get("class_type") in OUTPUT_CLASSES for node in prompt.values()):
+            return {"error": {"type": "prompt_no_outputs", "message": "Prompt has no outputs"}, "node_errors": {}}
+        node_errors = {}
+        for node_id, node in prompt.items():
+            if node.get("class_type") in LOADER_CLASSES and node["inputs"].get("image") not in self.uploads:
+                node_errors[node_id] = {"errors": [{"message": "Invalid image file"}], "class_type": node["class_type"]}
+            for value in node.get("inputs", {}).values():
+                if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and value[0] not in prompt:
+                    node_errors[node_id] = {"errors": [{"message": f"Missing input node {value[0]}"}]}
+        if node_errors:
+            return {"error": {"type": "prompt_outputs_failed_validation", "message": "Prompt outputs failed validation"},
+                    "node_errors": node_errors}
+        return None
+
+    def submit(self, prompt: Dict, client_id: Optional[str], prompt_id: Optional[str]) -> Dict:
+        prompt_id = prompt_id or str(uuid.uuid4())
+        self.number += 1
+        self.queue[prompt_id] = {
+            "prompt_id": prompt_id, "number": self.number, "prompt": prompt,
+            "client_id": client_id, "queued_at": time.monotonic(),
+        }
+        self.stats["prompts_queued"] += 1
+        self._wakeup.set()
+        return {"prompt_id": prompt_id, "number": self.number, "node_errors": {}}
+
+    def queue_listing(self) -> Dict:
+        def entry(item):
+            outputs = [node_id for node_id, node in item["prompt"].items() if node["class_type"] in OUTPUT_CLASSES]
+            return [item["number"], item["prompt_id"], item["prompt"], {"client_id": item["client_id"]}, outputs]
+        return {
+            "queue_running": [entry(self.running)] if self.running else [],
+            "queue_pending": [entry(item) for item in self.queue.values()],
+        }
+
+    def delete(self, prompt_ids: List[str]):
+        for prompt_id in prompt_ids:
+            if self.queue.pop(prompt_id, None) is not None:
+                self.stats["prompts_deleted"] += 1
+
+    def interrupt(self, prompt_id: Optional[str] = None):
+        if self.running and (prompt_id is None or self.running["prompt_id"] == prompt_id):
+            self._interrupt.set()
+
+    # ------------------------------------------------------------------
+    # Executor
+    # ------------------------------------------------------------------
+    @staticmethod
+    def execution_order(prompt: Dict) -> List[str]:
+        """Ancestors of the output nodes, inputs first"""
+        order, seen = [], set()
+
+        def visit(node_id):
+            if node_id in seen or node_id not in prompt:
+                return
+            seen.add(node_id)
+            for value in prompt[node_id]["inputs"].values():
+                if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                    visit(value[0])
+            order.append(node_id)
+
+        for node_id, node in prompt.items():
+            if node["class_type"] in OUTPUT_CLASSES:
+                visit(node_id)
+        return order
+
+    @staticmethod
+    def signatures(prompt: Dict, order: List[str]) -> Dict[str, str]:
+        """Hash of each node's class and inputs, including everything upstream of it"""
+        signatures = {}
+        for node_id in order:
+            node = prompt[node_id]
+            inputs = {}
+            for name, value in node["inputs"].items():
+                if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                    value = ["link", signatures[value[0]], value[1]]
+                inputs[name] = value
+            material = json.dumps([node["class_type"], inputs], sort_keys=True, default=str)
+            signatures[node_id] = hashlib.sha1(material.encode("utf-8")).hexdigest()
+        return signatures
+
+    async def sleep(self, seconds: float):
+        if seconds <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._interrupt.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            return
+        raise PromptInterrupted()
+
+    def store_output(self, filename: str, image: bytes):
+        self.outputs[filename] = image
+        while len(self.outputs) > MAX_OUTPUTS:
+            self.outputs.popitem(last=False)
+
+    async def execute(self, item: Dict):
+        prompt_id, prompt, client_id = item["prompt_id"], item["prompt"], item["client_id"]
+        started = time.monotonic()
+        wait = started - item["queued_at"]
+        self.stats["queue_wait_seconds"] += wait
+        self.queue_waits.append(wait)
+
+        order = self.execution_order(prompt)
+        signatures = self.signatures(prompt, order)
+        cached = [node_id for node_id in order if signatures[node_id] in self.node_cache
+                  and prompt[node_id]["class_type"] not in OUTPUT_CLASSES]
+        fail_at = self.config.random.choice(order) if self.config.random.random() < self.config.failure_rate else None
+
+        await self.send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+        await self.send(client_id, {"type": "execution_cached", "data": {"prompt_id": prompt_id, "nodes": cached}})
+        self.stats["nodes_cached"] += len(cached)
+
+        outputs, status, executed = {}, "success", set()
+        try:
+            for node_id in order:
+                if node_id in cached:
+                    executed.add(signatures[node_id])
+                    continue
+                node = prompt[node_id]
+                await self.send(client_id, {"type": "executing", "data": {"node": node_id, "prompt_id": prompt_id}})
+                if node_id == fail_at:
+                    raise SimulatedFailure(f"Simulated failure in node {node_id} ({node['class_type']})")
+                latency = self.config.latency(node_id, node)
+                steps = node["inputs"].get("steps")
+                if isinstance(steps, int) and steps > 0:
+                    updates = min(steps, MAX_PROGRESS_MESSAGES)
+                    for update in range(1, updates + 1):
+                        await self.sleep(latency / updates)
+                        value = steps * update // updates
+                        await self.send(client_id, {"type": "progress", "data": {
+                            "value": value, "max": steps, "node": node_id, "prompt_id": prompt_id}})
+                else:
+                    await self.sleep(latency)
+                executed.add(signatures[node_id])
+                self.stats["nodes_executed"] += 1
+
+                if node["class_type"] == "SaveImageWebsocket":
+                    await self.send_binary(client_id, _png_with_text(self.template_png, f"{prompt_id}:{node_id}"))
+                elif node["class_type"] in OUTPUT_CLASSES:
+                    folder = "output" if node["class_type"] == "SaveImage" else "temp"
+                    filename = f"{prompt_id}_{node_id}.png"
+                    self.store_output(filename, _png_with_text(self.template_png, f"{prompt_id}:{node_id}"))
+                    outputs[node_id] = {"images": [{"filename": filename, "subfolder": "", "type": folder}]}
+                    await self.send(client_id, {"type": "executed", "data": {
+                        "node": node_id, "prompt_id": prompt_id, "output": outputs[node_id]}})
+        except PromptInterrupted:
+            status = "interrupted"
+            self.stats["prompts_interrupted"] += 1
+            await self.send(client_id, {"type": "execution_interrupted", "data": {
+                "prompt_id": prompt_id, "node_id": node_id, "node_type": prompt[node_id]["class_type"]}})
+        except SimulatedFailure as e:
+            status = "error"
+            self.stats["prompts_failed"] += 1
+            await self.send(client_id, {"type": "execution_error", "data": {
+                "prompt_id": prompt_id, "node_id": node_id, "node_type": prompt[node_id]["class_type"],
+                "exception_message": str(e), "exception_type": "RuntimeError", "traceback": []}})
+        else:
+            self.stats["prompts_completed"] += 1
+            await self.send(client_id, {"type": "execution_success", "data": {"prompt_id": prompt_id}})
+
+        # ComfyUI's default cache keeps the outputs of the last prompt only
+        self.node_cache = executed
+        duration = time.monotonic() - started
+        self.stats["execution_seconds"] += duration
+        self.executions.append(duration)
+        self.history[prompt_id] = {
+            "prompt": [item["number"], prompt_id, prompt, {"client_id": client_id}, list(outputs)],
+            "outputs": outputs,
+            "status": {"status_str": status, "completed": status == "success", "messages": []},
+        }
+        while len(self.history) > MAX_HISTORY:
+            self.history.popitem(last=False)
+        await self.send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        self._interrupt = asyncio.Event()
+        while True:
+            if not self.queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            _, self.running = self.queue.popitem(last=False)
+            self._interrupt.clear()
+            await self.broadcast_status()
+            try:
+                await self.execute(self.running)
+            except Exception as e:
+                print(f"❌ Fake executor error: {e}")
+            finally:
+                self.running = None
+            await self.broadcast_status()
+
+    def stats_snapshot(self) -> Dict:
+        def percentiles(values):
+            values = sorted(values)
+            if not values:
+                return {}
+            pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+            return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": values[-1]}
+
+        snapshot = dict(self.stats)
+        snapshot["elapsed_seconds"] = time.time() - self.stats["started_at"]
+        snapshot["queue_depth"] = len(self.queue) + (1 if self.running else 0)
+        snapshot["queue_wait"] = percentiles(self.queue_waits)
+        snapshot["execution"] = percentiles(self.executions)
+        return snapshot
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    comfy = FakeComfy(config)
+    app = FastAPI(title="Fake ComfyUI")
+    app.state.comfy = comfy
+
+    def http_error() -> Optional[JSONResponse]:
+        if config.random.random() < config.http_error_rate:
+            return JSONResponse({"error": "Simulated server error"}, status_code=500)
+        return None
+
+    @app.on_event("startup")
+    async def start_executor():
+        asyncio.get_event_loop().create_task(comfy.run())
+
+    @app.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket, clientId: Optional[str] = None):
+        await websocket.accept()
+        client_id = clientId or uuid.uuid4().hex
+        comfy.clients[client_id] = websocket
+        await websocket.send_text(json.dumps({"type": "status", "data": {
+            "status": {"exec_info": {"queue_remaining": len(comfy.queue)}}, "sid": client_id}}))
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if comfy.clients.get(client_id) is websocket:
+                del comfy.clients[client_id]
+
+    @app.post("/prompt")
+    async def queue_prompt(request: Request):
+        error = http_error()
+        if error:
+            return error
+        body = json.loads(await request.body())
+        prompt = body.get("prompt") or {}
+        invalid = comfy.validate(prompt)
+        if invalid:
+            comfy.stats["prompts_rejected"] += 1
+            return JSONResponse(invalid, status_code=400)
+        result = comfy.submit(prompt, body.get("client_id"), body.get("prompt_id"))
+        await comfy.broadcast_status()
+        return result
+
+    @app.get("/queue")
+    async def get_queue():
+        return comfy.queue_listing()
+
+    @app.post("/queue")
+    async def edit_queue(request: Request):
+        body = json.loads(await request.body() or b"{}")
+        if body.get("clear"):
+            comfy.delete(list(comfy.queue))
+        comfy.delete(body.get("delete", []))
+        await comfy.broadcast_status()
+        return Response(status_code=200)
+
+    @app.post("/interrupt")
+    async def interrupt(request: Request):
+        raw = await request.body()
+        body = json.loads(raw) if raw else {}
+        comfy.interrupt(body.get("prompt_id"))
+        return Response(status_code=200)
+
+    @app.get("/history")
+    async def get_all_history(max_items: Optional[int] = None):
+        items = list(comfy.history.items())
+        if max_items:
+            items = items[-max_items:]
+        return dict(items)
+
+    @app.get("/history/{prompt_id}")
+    async def get_history(prompt_id: str):
+        return {prompt_id: comfy.history[prompt_id]} if prompt_id in comfy.history else {}
+
+    @app.get("/view")
+    async def view(filename: str, subfolder: str = "", type: str = "output"):
+        error = http_error()
+        if error:
+            return error
+        image = comfy.uploads.get(filename) if type == "input" else comfy.outputs.get(filename)
+        if image is None:
+            return Response(status_code=404)
+        comfy.stats["views"] += 1
+        comfy.stats["view_bytes"] += len(image)
+        return Response(image, media_type="image/png")
+
+    @app.post("/upload/image")
+    async def upload_image(image: UploadFile = File(...), type: str = Form("input"),
+                           subfolder: str = Form(""), overwrite: str = Form("false")):
+        data = await image.read()
+        comfy.uploads[image.filename] = data
+        comfy.stats["uploads"] += 1
+        comfy.stats["upload_bytes"] += len(data)
+        return {"name": image.filename, "subfolder": subfolder, "type": type}
+
+    @app.get("/system_stats")
+    async def system_stats():
+        return {
+            "system": {"os": "fake", "comfyui_version": "fake"},
+            "devices": [{"name": "fake-gpu", "type": "cuda", "index": 0,
+                         "vram_total": config.vram_total, "vram_free": config.vram_total}],
+        }
+
+    @app.get("/fake/stats")
+    async def fake_stats():
+        return comfy.stats_snapshot()
+
+    @app.post("/fake/stats/reset")
+    async def reset_fake_stats():
+        comfy.reset_stats()
+        return comfy.stats_snapshot()
+
+    return app
+
+
+def _parse_size(value: str):
+    width, height = value.lower().split("x", 1)
+    return int(width), int(height)
+
+
+def _parse_override(value: str):
+    key, seconds = value.split("=", 1)
+    return key, float(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPU-free ComfyUI stand-in for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--node-latency", type=float, default=0.005, help="Seconds per ordinary node")
+    parser.add_argument("--step-latency", type=float, default=0.02, help="Seconds per sampler step")
+    parser.add_argument("--latency", action="append", type=_parse_override, default=[], metavar="NODE_OR_CLASS=SECONDS",
+                        help="Fixed latency for a node id or class_type (repeatable)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of prompts that fail mid-execution")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="Share of /prompt and /view calls answered with 500")
+    parser.add_argument("--output-size", type=_parse_size, default=(1024, 768), metavar="WxH")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for failure injection")
+    args = parser.parse_args()
+
+    config = FakeConfig(
+        node_latency=args.node_latency, step_latency=args.step_latency, latency_overrides=dict(args.latency),
+        failure_rate=args.failure_rate, http_error_rate=args.http_error_rate, output_size=args.output_size,
+        seed=args.seed,
+    )
+    print(f"🧪 Fake ComfyUI on {args.host}:{args.port} "
+          f"(node {args.node_latency}s, step {args.step_latency}s, failures {args.failure_rate:.0%}, "
+          f"output {args.output_size[0]}x{args.output_size[1]})")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Generation Load Test
+Drives /api/virtual-staging/generate at a fixed concurrency and reports throughput,
+latency percentiles and where the time went
+
+Run the server against the fake ComfyUI (or a real one) first:
+    python benchmarks/fake_comfyui.py --port 8188 &
+    COMFY_BACKENDS=127.0.0.1:8188 python run_server.py &
+    python benchmarks/load_test.py --requests 200 --concurrency 8 --num-images 2
+
+Every request uploads a distinct synthetic room photo with no seed, so the
+result cache and request coalescing do not hide the ComfyUI round trips.
+``--same-image --seed 1`` measures the opposite case. When ``--fake-url``
+points at the fake server, its queue-wait and execution totals are used to
+split each request's latency into ComfyUI time and app overhead (upload,
+normalization, scheduling, fetching and saving images).
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from PIL import Image, ImageDraw
+
+
+def synthetic_room(width: int, height: int, seed: int) -> bytes:
+    """A JPEG that looks enough like a room photo (walls, floor, window) to be a realistic upload"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), tuple(rng.randint(180, 240) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    floor_top = int(height * rng.uniform(0.55, 0.7))
+    draw.rectangle([0, floor_top, width, height], fill=tuple(rng.randint(90, 160) for _ in range(3)))
+    x = rng.randint(0, width // 2)
+    draw.rectangle([x, height // 6, x + width // 4, floor_top - height // 8], fill=(220, 235, 250))
+    noise = Image.effect_noise((width, height), 12).convert("RGB")
+    image = Image.blend(image, noise, 0.08)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.url = args.url.rstrip("/") + "/api/virtual-staging/generate"
+        self.headers = {"X-API-Key": args.api_key}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.samples: List[Dict] = []
+        self.same_image = synthetic_room(args.image_width, args.image_height, 0) if args.same_image else None
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def one_request(self, index: int) -> Dict:
+        image = self.same_image or synthetic_room(self.args.image_width, self.args.image_height, index + 1)
+        data = {"num_images": str(self.args.num_images), "style": self.args.style, "quality": self.args.quality}
+        if self.args.seed is not None:
+            data["seed"] = str(self.args.seed)
+        started = time.perf_counter()
+        try:
+            response = self._session().post(self.url, headers=self.headers, data=data,
+                                            files={"file": ("room.jpg", image, "image/jpeg")},
+                                            timeout=self.args.timeout)
+            status = response.status_code
+            body = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+        except requests.RequestException as e:
+            status, body = None, {"error": str(e)}
+        sample = {
+            "status": status,
+            "latency": time.perf_counter() - started,
+            "images": len(body.get("results", [])) if status == 200 else 0,
+            "cached": sum(1 for result in body.get("results", []) if result.get("cached")) if status == 200 else 0,
+            "error": None if status == 200 else (body.get("detail") or body.get("error") or f"HTTP {status}"),
+        }
+        return sample
+
+    def run(self, count: int) -> float:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for sample in pool.map(self.one_request, range(count)):
+                with self._lock:
+                    self.samples.append(sample)
+                if self.args.verbose:
+                    print(f"  {sample['status']} {sample['latency']:.3f}s {sample['error'] or ''}")
+        return time.perf_counter() - started
+
+
+def fake_stats(fake_url: Optional[str], reset: bool = False) -> Optional[Dict]:
+    if not fake_url:
+        return None
+    try:
+        if reset:
+            response = requests.post(fake_url.rstrip("/") + "/fake/stats/reset", timeout=5)
+        else:
+            response = requests.get(fake_url.rstrip("/") + "/fake/stats", timeout=5)
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"⚠️ No statistics from fake ComfyUI at {fake_url}: {e}")
+        return None
+
+
+def summarize(args, samples: List[Dict], wall: float, comfy: Optional[Dict]) -> Dict:
+    ok = [sample for sample in samples if sample["status"] == 200]
+    latencies = [sample["latency"] for sample in ok]
+    errors: Dict[str, int] = {}
+    for sample in samples:
+        if sample["status"] != 200:
+            key = f"{sample['status']}: {str(sample['error'])[:80]}"
+            errors[key] = errors.get(key, 0) + 1
+
+    report = {
+        "config": {
+            "url": args.url, "requests": args.requests, "concurrency": args.concurrency,
+            "num_images": args.num_images, "style": args.style, "quality": args.quality,
+            "same_image": args.same_image, "seed": args.seed,
+            "image_size": f"{args.image_width}x{args.image_height}",
+        },
+        "wall_seconds": round(wall, 3),
+        "requests_ok": len(ok),
+        "requests_failed": len(samples) - len(ok),
+        "errors": errors,
+        "throughput_rps": round(len(ok) / wall, 3) if wall else None,
+        "images_per_second": round(sum(sample["images"] for sample in ok) / wall, 3) if wall else None,
+        "cached_images": sum(sample["cached"] for sample in ok),
+        "latency_seconds": {
+            "mean": round(statistics.mean(latencies), 4) if latencies else None,
+            "p50": percentile(latencies, 0.50),
+            "p90": percentile(latencies, 0.90),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else None,
+        },
+    }
+
+    if comfy and ok:
+        prompts = comfy["prompts_completed"] + comfy["prompts_failed"] + comfy["prompts_interrupted"]
+        # Summed over the prompts of a request; exact when its variants run one after another
+        queue_wait = comfy["queue_wait_seconds"] / len(ok)
+        execution = comfy["execution_seconds"] / len(ok)
+        report["stages_per_request_seconds"] = {
+            "comfy_queue_wait": round(queue_wait, 4),
+            "comfy_execution": round(execution, 4),
+            "app_overhead": round(report["latency_seconds"]["mean"] - queue_wait - execution, 4),
+        }
+        report["comfy"] = {
+            "prompts": prompts,
+            "prompts_per_request": round(prompts / len(ok), 2),
+            "prompts_failed": comfy["prompts_failed"],
+            "prompts_rejected": comfy["prompts_rejected"],
+            "nodes_cached_share": round(comfy["nodes_cached"] / max(1, comfy["nodes_cached"] + comfy["nodes_executed"]), 3),
+            "uploads": comfy["uploads"],
+            "upload_bytes": comfy["upload_bytes"],
+            "views": comfy["views"],
+            "view_bytes": comfy["view_bytes"],
+            "busy_share": round(comfy["execution_seconds"] / wall, 3) if wall else None,
+            "queue_wait": comfy["queue_wait"],
+            "execution": comfy["execution"],
+        }
+    return report
+
+
+def print_report(report: Dict):
+    def ms(value):
+        return f"{value * 1000:8.1f} ms" if value is not None else "       -"
+
+    config = report["config"]
+    print("=" * 60)
+    print(f"📈 {config['requests']} requests x {config['num_images']} images, concurrency {config['concurrency']}, "
+          f"style {config['style']}, quality {config['quality']}")
+    print(f"   ok {report['requests_ok']}, failed {report['requests_failed']} in {report['wall_seconds']:.1f}s")
+    print(f"   throughput {report['throughput_rps']} req/s, {report['images_per_second']} images/s "
+          f"({report['cached_images']} images from cache)")
+    latency = report["latency_seconds"]
+    print("⏱️  latency  " + "  ".join(f"{name} {ms(latency[name])}" for name in ("mean", "p50", "p90", "p99", "max")))
+    stages = report.get("stages_per_request_seconds")
+    if stages:
+        print("🔬 per request: " + ", ".join(f"{name} {ms(value).strip()}" for name, value in stages.items()))
+        comfy = report["comfy"]
+        print(f"   {comfy['prompts_per_request']} prompts/request, {comfy['nodes_cached_share']:.0%} of nodes cached, "
+              f"backend busy {comfy['busy_share']:.0%}")
+    for error, count in report["errors"].items():
+        print(f"❌ {count} x {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the virtual staging generation endpoint")
+    parser.add_argument("--url", default="http://localhost:8004")
+    parser.add_argument("--api-key", default=os.getenv("LOAD_TEST_API_KEY") or os.getenv("SUPER_ADMIN_API_KEY"),
+                        help="API key to send (default: $LOAD_TEST_API_KEY or $SUPER_ADMIN_API_KEY)")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=2, help="Requests sent (and discarded) before measuring")
+    parser.add_argument("--num-images", type=int, default=1)
+    parser.add_argument("--style", default="scandinavian")
+    parser.add_argument("--quality", default="standard")
+    parser.add_argument("--seed", type=int, default=None, help="Send a fixed seed (enables result caching)")
+    parser.add_argument("--same-image", action="store_true", help="Upload the same image every time")
+    parser.add_argument("--image-width", type=int, default=1280)
+    parser.add_argument("--image-height", type=int, default=960)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--fake-url", default=None, help="Fake ComfyUI base URL for the stage breakdown")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write the report to this file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.api_key:
+        parser.error("an API key is required (--api-key or $SUPER_ADMIN_API_KEY)")
+
+    test = LoadTest(args)
+    if args.warmup:
+        print(f"🔥 Warming up with {args.warmup} requests...")
+        test.run(args.warmup)
+        test.samples = []
+    fake_stats(args.fake_url, reset=True)
+
+    print(f"🚀 Sending {args.requests} requests at concurrency {args.concurrency}...")
+    wall = test.run(args.requests)
+    report = summarize(args, test.samples, wall, fake_stats(args.fake_url))
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {args.json_path}")
+    return 0 if report["requests_ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
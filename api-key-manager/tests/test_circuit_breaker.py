@@ -0,0 +1,75 @@
+import pytest
+
+from app.services import comfy_backends
+from app.services.comfy_backends import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(comfy_backends.time, "monotonic", clock)
+    return clock
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=30, max_cooldown=300)
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.allows_request()
+    assert breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allows_request()
+    assert breaker.retry_after() == 30
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=30)
+    breaker.record_failure()
+    breaker.record_success()
+    assert not breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_a_single_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allows_request()
+    breaker.on_dispatch()
+    assert breaker.state == "half_open"
+    assert not breaker.allows_request()
+    # A trial that ended without a verdict frees the way for another
+    breaker.on_release()
+    assert breaker.allows_request()
+
+
+def test_successful_trial_closes_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.on_dispatch()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.cooldown == 30
+    assert breaker.allows_request()
+
+
+def test_failed_trial_doubles_the_cooldown_up_to_the_maximum(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30, max_cooldown=100)
+    breaker.record_failure()
+    for expected in (60, 100, 100):
+        clock.now += breaker.cooldown
+        breaker.on_dispatch()
+        assert breaker.record_failure()
+        assert breaker.state == "open"
+        assert breaker.cooldown == expected
+        assert breaker.retry_after() == expected
+    assert breaker.times_opened == 4
@@ -0,0 +1,92 @@
+import copy
+import json
+import os
+
+import pytest
+
+from app.services.comfy_workflow import (
+    OUTPUT_NODE, QUALITY_TIERS, apply_quality_tier, dangling_links, prune_to_outputs,
+    supports_quality_tier, upstream_nodes
+)
+from app.services.style_registry import StylePresetError, load_workflow
+
+WORKFLOW_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "joger.json")
+
+
+@pytest.fixture
+def workflow():
+    with open(WORKFLOW_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_prune_keeps_only_the_outputs_subgraph():
+    prompt = {
+        "1": {"class_type": "LoadImage", "inputs": {"image": "room.png"}},
+        "2": {"class_type": "Blur", "inputs": {"image": ["1", 0]}},
+        "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0]}},
+        "4": {"class_type": "PreviewImage", "inputs": {"images": ["1", 0]}},
+        "5": {"class_type": "CheckpointLoader", "inputs": {"ckpt_name": "unused.safetensors"}},
+    }
+    pruned = prune_to_outputs(prompt, ["3"])
+    assert set(pruned) == {"1", "2", "3"}
+    # Nodes are shared, not copied
+    assert pruned["2"] is prompt["2"]
+
+
+def test_prune_rejects_unknown_output_node():
+    with pytest.raises(KeyError):
+        prune_to_outputs({"1": {"class_type": "LoadImage", "inputs": {}}}, ["2"])
+
+
+def test_prune_workflow_drops_preview_sinks(workflow):
+    pruned = prune_to_outputs(workflow, [OUTPUT_NODE])
+    previews = {node_id for node_id, node in workflow.items()
+                if node["class_type"] in ("PreviewImage", "MaskPreview")}
+    assert previews
+    assert not previews & set(pruned)
+    assert set(pruned) == upstream_nodes(workflow, [OUTPUT_NODE])
+    assert dangling_links(pruned) == []
+    assert prune_to_outputs(pruned, [OUTPUT_NODE]) == pruned
+
+
+def test_load_workflow_compiles_the_pruned_workflow(workflow):
+    assert load_workflow(WORKFLOW_PATH) == prune_to_outputs(workflow, [OUTPUT_NODE])
+
+
+def test_load_workflow_rejects_dangling_links(workflow, tmp_path):
+    del workflow["9"]
+    path = tmp_path / "broken.json"
+    path.write_text(json.dumps(workflow), encoding="utf-8")
+    with pytest.raises(StylePresetError):
+        load_workflow(str(path))
+
+
+def test_standard_tier_leaves_the_workflow_as_authored(workflow):
+    prompt = apply_quality_tier(copy.deepcopy(workflow), "standard")
+    assert prompt == prune_to_outputs(workflow, [OUTPUT_NODE])
+
+
+def test_final_tier_raises_sampler_steps(workflow):
+    prompt = apply_quality_tier(copy.deepcopy(workflow), "final")
+    for node_id, inputs in QUALITY_TIERS["final"]["overrides"].items():
+        for name, value in inputs.items():
+            assert prompt[node_id]["inputs"][name] == value
+    # Untouched samplers keep their authored steps
+    assert prompt["7"]["inputs"]["steps"] == workflow["7"]["inputs"]["steps"]
+
+
+def test_draft_tier_saves_the_inpaint_decode_and_drops_later_passes(workflow):
+    prompt = apply_quality_tier(copy.deepcopy(workflow), "draft")
+    source = QUALITY_TIERS["draft"]["output_from"]
+    assert prompt[OUTPUT_NODE]["inputs"]["images"] == source
+    assert "144" not in prompt  # 4x upscale
+    assert "155" not in prompt  # refine sampler
+    assert dangling_links(prompt) == []
+    assert set(prompt) == upstream_nodes(prompt, [OUTPUT_NODE])
+
+
+def test_supports_quality_tier(workflow):
+    assert all(supports_quality_tier(workflow, tier) for tier in QUALITY_TIERS)
+    without_refine = {node_id: node for node_id, node in workflow.items() if node_id != "155"}
+    assert not supports_quality_tier(without_refine, "final")
+    assert supports_quality_tier(without_refine, "standard")
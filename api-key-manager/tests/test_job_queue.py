@@ -0,0 +1,33 @@
+import pytest
+
+from app.database.models import DatabaseManager
+from app.services.job_queue import JobQueue
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    return JobQueue(DatabaseManager(str(tmp_path / "jobs.db")), handler=lambda job: {}, num_workers=0)
+
+
+def submit(job_queue):
+    return job_queue.submit(api_key_id=1, input_path="room.png", style="scandinavian", num_images=1)
+
+
+def test_cancel_reports_a_queued_job(job_queue):
+    job_id = submit(job_queue)
+    assert job_queue.cancel(job_id) == "queued"
+    assert job_queue.get_job(job_id)["status"] == "cancelled"
+
+
+def test_cancel_reports_a_job_claimed_by_a_worker(job_queue):
+    job_id = submit(job_queue)
+    assert job_queue._claim_next("worker")["id"] == job_id
+    # The caller's stale copy still says queued; the input now belongs to the worker
+    assert job_queue.cancel(job_id) == "running"
+
+
+def test_cancel_leaves_finished_jobs_alone(job_queue):
+    job_id = submit(job_queue)
+    job_queue.cancel(job_id)
+    assert job_queue.cancel(job_id) is None
+    assert job_queue.cancel("missing") is None
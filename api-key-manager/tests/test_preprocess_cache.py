@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from app.database.models import DatabaseManager
+from app.services.preprocess_cache import PreprocessCache
+
+MAPS = {"depth": b"d" * 100, "segmentation": b"s" * 100, "mask": b"m" * 100}
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    return DatabaseManager(str(tmp_path / "cache.db"))
+
+
+def test_put_indexes_the_maps(db_manager, tmp_path):
+    cache = PreprocessCache(db_manager, root=str(tmp_path / "maps"))
+    maps = cache.put("v1", "ab" * 32, MAPS)
+    assert set(maps) == set(MAPS)
+    assert cache.get("v1", "ab" * 32) == maps
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == 300
+
+
+def test_expired_entries_and_their_version_directory_are_deleted(db_manager, tmp_path):
+    root = tmp_path / "maps"
+    cache = PreprocessCache(db_manager, root=str(root), ttl_days=0)
+    cache.put("old-version", "ab" * 32, MAPS)
+    cache.evict()
+    assert cache.get("old-version", "ab" * 32) is None
+    assert not os.path.exists(root / "old-version")
+    assert cache.stats()["entries"] == 0
+
+
+def test_byte_budget_evicts_least_recently_used_first(db_manager, tmp_path):
+    cache = PreprocessCache(db_manager, root=str(tmp_path / "maps"), max_bytes=700)
+    for input_hash in ("aa" * 32, "bb" * 32, "cc" * 32):
+        cache.put("v1", input_hash, MAPS)
+    db_manager.execute_update("UPDATE preprocess_cache SET last_access = '2000-01-01' WHERE input_hash = ?",
+                              ("bb" * 32,))
+    cache.evict()
+    assert cache.get("v1", "bb" * 32) is None
+    assert cache.get("v1", "aa" * 32) and cache.get("v1", "cc" * 32)
+    assert cache.evictions == 1
+
+
+def test_dropped_lock_is_not_reused(db_manager, tmp_path):
+    cache = PreprocessCache(db_manager, root=str(tmp_path / "maps"))
+    lock = cache.lock("v1", "ab" * 32)
+    assert cache.lock("v1", "ab" * 32) is lock
+    cache.drop_lock("v1", "ab" * 32)
+    assert cache.lock("v1", "ab" * 32) is not lock
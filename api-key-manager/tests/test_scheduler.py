@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from app.services.scheduler import FairScheduler, SchedulingCancelled
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            raise AssertionError("Timed out waiting for the scheduler")
+        time.sleep(0.005)
+
+
+def grant_order(scheduler, requests):
+    """
+    Hold the only slot, queue ``requests`` ((key, role) pairs) one at a
+    time, then release the slot and return the keys in the order they were
+    granted
+    """
+    scheduler.acquire("blocker")
+    order = []
+    threads = []
+    for key, role in requests:
+        def run(key=key, role=role):
+            with scheduler.slot(key, role):
+                order.append(key)
+        waiting = scheduler.status()["waiting"]
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: scheduler.status()["waiting"] == waiting + 1)
+    scheduler.release("blocker")
+    for thread in threads:
+        thread.join(timeout=5)
+    return order
+
+
+def test_keys_take_turns_instead_of_running_back_to_back():
+    scheduler = FairScheduler(slots=1, role_weights={"user": 1}, max_in_flight_per_key=10)
+    order = grant_order(scheduler, [("a", "user"), ("a", "user"), ("a", "user"), ("b", "user")])
+    assert order == ["a", "b", "a", "a"]
+
+
+def test_higher_weight_roles_get_a_larger_share():
+    scheduler = FairScheduler(slots=1, role_weights={"user": 1, "admin": 2}, max_in_flight_per_key=10)
+    requests = [("user", "user")] * 3 + [("admin", "admin")] * 3
+    order = grant_order(scheduler, requests)
+    assert order == ["admin", "user", "admin", "admin", "user", "user"]
+
+
+def test_per_key_limit_leaves_free_slots_to_other_keys():
+    scheduler = FairScheduler(slots=2, role_weights={"user": 1}, max_in_flight_per_key=1)
+    scheduler.acquire("a")
+    blocked = threading.Thread(target=scheduler.acquire, args=("a",))
+    blocked.start()
+    wait_until(lambda: scheduler.status()["waiting"] == 1)
+    # The free slot goes to another key, not to a's second variant
+    scheduler.acquire("b")
+    assert scheduler.status()["in_flight"] == 2
+    scheduler.release("a")
+    blocked.join(timeout=5)
+    status = scheduler.status()
+    assert (status["in_flight"], status["waiting"]) == (2, 0)
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    scheduler = FairScheduler(slots=1, role_weights={"user": 1})
+    scheduler.acquire("a")
+    cancel_event = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            scheduler.acquire("b", cancel_event=cancel_event)
+        except SchedulingCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    wait_until(lambda: scheduler.status()["waiting"] == 1)
+    cancel_event.set()
+    thread.join(timeout=5)
+    assert len(errors) == 1
+    assert scheduler.status()["waiting"] == 0
+    scheduler.release("a")
+    assert scheduler.status()["in_flight"] == 0
+
+
+def test_status_counts_slots():
+    scheduler = FairScheduler(slots=3, role_weights={"user": 1})
+    with scheduler.slot("a"):
+        assert scheduler.status()["in_flight"] == 1
+    assert scheduler.status()["in_flight"] == 0
+    with pytest.raises(RuntimeError):
+        with scheduler.slot("a"):
+            raise RuntimeError("boom")
+    assert scheduler.status()["in_flight"] == 0
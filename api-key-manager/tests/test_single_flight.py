@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from app.services.single_flight import SingleFlight
+
+
+def test_followers_share_the_leaders_result():
+    flights = SingleFlight()
+    leader_flight, leader = flights.join("key")
+    follower_flight, follower = flights.join("key")
+    assert leader and not follower
+    assert follower_flight is leader_flight
+
+    calls = []
+    flights.execute(leader_flight, lambda flight: calls.append(1) or {"status": "success"})
+    assert calls == [1]
+    assert follower_flight.future.result(timeout=1) == {"status": "success"}
+    assert flights.status()["in_flight"] == 0
+    assert (flights.led, flights.coalesced) == (1, 1)
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+    _, first = flights.join("a")
+    _, second = flights.join("b")
+    assert first and second
+
+
+def test_finished_flight_is_not_joined_again():
+    flights = SingleFlight()
+    flight, _ = flights.join("key")
+    flights.execute(flight, lambda flight: {"status": "success"})
+    _, leader = flights.join("key")
+    assert leader
+
+
+def test_errors_reach_every_caller():
+    flights = SingleFlight()
+    flight, _ = flights.join("key")
+    follower_flight, _ = flights.join("key")
+
+    def fail(flight):
+        raise RuntimeError("backend down")
+
+    flights.execute(flight, fail)
+    with pytest.raises(RuntimeError, match="backend down"):
+        follower_flight.future.result(timeout=1)
+
+
+def test_cancelled_only_once_every_caller_cancelled():
+    flights = SingleFlight()
+    first, second = threading.Event(), threading.Event()
+    flight, _ = flights.join("key", first)
+    flights.join("key", second)
+    first.set()
+    assert not flight.cancel_event.is_set()
+    second.set()
+    assert flight.cancel_event.is_set()
+    # Everyone left, so the next caller starts a new flight
+    _, leader = flights.join("key")
+    assert leader
+
+
+def test_progress_is_fanned_out_to_every_caller():
+    flights = SingleFlight()
+    received = []
+    flight, _ = flights.join("key", progress_callback=lambda event: received.append(("a", event)))
+    flights.join("key", progress_callback=lambda event: received.append(("b", event)))
+    flight.publish({"event": "progress"})
+    assert received == [("a", {"event": "progress"}), ("b", {"event": "progress"})]
+
+
+def test_run_returns_cancelled_result_to_a_follower_that_gives_up():
+    flights = SingleFlight()
+    release = threading.Event()
+    results = {}
+
+    def work(flight):
+        release.wait(5)
+        return {"status": "success"}
+
+    leader = threading.Thread(target=lambda: results.setdefault("leader", flights.run("key", work)))
+    leader.start()
+    while flights.status()["in_flight"] == 0:
+        time.sleep(0.005)
+
+    cancel_event = threading.Event()
+    cancel_event.set()
+    assert flights.run("key", work, cancel_event=cancel_event, cancelled_result={"status": "cancelled"}) == (
+        {"status": "cancelled"}, True
+    )
+    release.set()
+    leader.join(timeout=5)
+    assert results["leader"] == ({"status": "success"}, False)
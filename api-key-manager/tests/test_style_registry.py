@@ -0,0 +1,55 @@
+import json
+import threading
+import time
+
+from app.services.style_registry import StyleRegistry
+
+
+def write_style(styles_dir, name, prompt="A living room"):
+    config = {"prompt": prompt, "ckpt_name": "model.safetensors", "workflow": "joger.json"}
+    (styles_dir / f"{name}.json").write_text(json.dumps(config), encoding="utf-8")
+
+
+def test_presets_load_on_first_use(tmp_path):
+    write_style(tmp_path, "modern")
+    registry = StyleRegistry(str(tmp_path))
+    assert registry.names() == ["modern"]
+    assert registry.get("modern").workflow_version
+
+
+def test_check_picks_up_new_styles(tmp_path):
+    write_style(tmp_path, "modern")
+    registry = StyleRegistry(str(tmp_path))
+    registry.check()
+    before = registry.get("modern")
+    write_style(tmp_path, "rustic")
+    registry.check()
+    assert registry.names() == ["modern", "rustic"]
+    # Unchanged workflow, so the compiled preset matches the old one
+    assert registry.get("modern").workflow_version == before.workflow_version
+
+
+def test_concurrent_reloads_leave_a_complete_registry(tmp_path):
+    for name in ("a", "b", "c", "d"):
+        write_style(tmp_path, name)
+    registry = StyleRegistry(str(tmp_path))
+    threads = [threading.Thread(target=registry.reload) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert registry.names() == ["a", "b", "c", "d"]
+
+
+def test_watcher_reloads_in_the_background(tmp_path):
+    write_style(tmp_path, "modern")
+    registry = StyleRegistry(str(tmp_path), check_interval=0.01)
+    registry.start()
+    try:
+        write_style(tmp_path, "rustic")
+        deadline = time.monotonic() + 5
+        while "rustic" not in registry.names() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert registry.names() == ["modern", "rustic"]
+    finally:
+        registry.stop()